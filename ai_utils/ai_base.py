@@ -1,11 +1,68 @@
+import asyncio
+
 class AIHandler:
     """
     Interface for all AI handlers.
+    The async methods are used by the server's async mode. By default they run the
+    blocking methods on a worker thread; handlers with an async API client override them.
     """
+    # whether answers depend on the earlier messages of the thread, not just the question and the context
+    keeps_history = False
+
     def setup(self):
         raise NotImplementedError("Subclasses should implement this method")
 
     def get_response(self, context: str, input: str, init=False):
         raise NotImplementedError("Subclasses should implement this method")
 
+    def get_response_stream(self, input: str):
+        """
+        Generator that yields the response to input in chunks as the model produces them.
+        Handlers that can't stream yield the whole response at once.
+        """
+        yield self.get_response(input)
+
+    def add_exchange(self, question: str, answer: str):
+        """
+        Adds a question answered without the model (e.g. from the answer cache) to the conversation,
+        so follow-up questions see it. Handlers that don't keep the conversation ignore it.
+        """
+        pass
+
+    def get_state(self):
+        """
+        Returns what another instance needs to pick up where this one is (IDs, not live objects),
+        or None if a new setup with the session context is all it needs.
+        """
+        return None
+
+    def restore(self, state: object, sessionContext: object):
+        """
+        Sets the handler up from another instance's get_state(), e.g. in another server process.
+        By default that's a new setup.
+        """
+        self.setup(sessionContext)
+
+    def close(self):
+        """
+        Called when the thread using the handler ends. Releases anything shared with other threads.
+        """
+        pass
+
+    async def setup_async(self, sessionContext: object):
+        await asyncio.to_thread(self.setup, sessionContext)
+
+    async def restore_async(self, state: object, sessionContext: object):
+        await asyncio.to_thread(self.restore, state, sessionContext)
+
+    async def get_response_async(self, input: str):
+        return await asyncio.to_thread(self.get_response, input)
+
+    async def add_exchange_async(self, question: str, answer: str):
+        await asyncio.to_thread(self.add_exchange, question, answer)
 
+    async def get_response_stream_async(self, input: str):
+        """
+        Async generator version of get_response_stream.
+        """
+        yield await self.get_response_async(input)
@@ -3,7 +3,7 @@ from ai_utils.assistants_handler import AssistantsHandler
 
 def get_ai_handler(ai_type, sessionID, context: object):
     if ai_type == "chat_completions":
-        return ChatCompletionsHandler()
+        return ChatCompletionsHandler(sessionID=sessionID, context=context)
     elif ai_type == "assistants":
         return AssistantsHandler(sessionID=sessionID, context=context)
     else:
@@ -0,0 +1,86 @@
+"""
+Cache of the AI handlers' answers, so a question asked again about the same files is answered
+in milliseconds instead of another model call.
+
+Answers are keyed by (sessionID, context hash, handler type, normalized question). The
+context hash is the session's manifest hash, so when the session's files change, the old
+answers just stop matching. invalidate() drops them right away, to free the memory.
+The question is all the key holds of the conversation, so the server only caches answers
+that don't depend on earlier messages: any answer of a handler that doesn't keep the
+conversation, and the answer to the first message of a thread otherwise.
+The cache is an LRU bounded by both entry count and total answer size.
+"""
+
+import re
+import threading
+from collections import OrderedDict
+
+MAX_ENTRIES = 1024
+MAX_BYTES = 16 * 1024 * 1024
+ERROR_PREFIX = "Error occurred" # the handlers' "please repeat your message" replies aren't worth keeping
+
+def normalize_question(question):
+    """
+    Returns the question in a form that ignores case, spacing, quote style and trailing punctuation.
+    """
+    text = question.strip().lower().replace('’', "'").replace('“', '"').replace('”', '"')
+    return re.sub(r"\s+", " ", text).rstrip('?!. ')
+
+class AnswerCache:
+    """
+    LRU cache of answers. Safe to share between threads.
+    """
+    def __init__(self, max_entries=MAX_ENTRIES, max_bytes=MAX_BYTES):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict() # (sessionID, context_hash, ai_type, question) -> answer, least recently used first
+        self.bytes = 0
+        self.lock = threading.Lock()
+        self.stats = {"hits": 0, "misses": 0, "evictions": 0, "invalidations": 0}
+
+    def get(self, sessionID, context_hash, ai_type, question):
+        """
+        Returns the cached answer to question, or None.
+        """
+        key = (sessionID, context_hash, ai_type, normalize_question(question))
+        with self.lock:
+            answer = self.entries.get(key)
+            if answer is None:
+                self.stats["misses"] += 1
+                return None
+            self.entries.move_to_end(key)
+            self.stats["hits"] += 1
+            return answer
+
+    def put(self, sessionID, context_hash, ai_type, question, answer):
+        if not answer or answer.startswith(ERROR_PREFIX) or len(answer) > self.max_bytes:
+            return
+        key = (sessionID, context_hash, ai_type, normalize_question(question))
+        with self.lock:
+            old = self.entries.pop(key, None)
+            if old is not None:
+                self.bytes -= len(old)
+            self.entries[key] = answer
+            self.bytes += len(answer)
+            while len(self.entries) > self.max_entries or self.bytes > self.max_bytes:
+                _, evicted = self.entries.popitem(last=False)
+                self.bytes -= len(evicted)
+                self.stats["evictions"] += 1
+
+    def invalidate(self, sessionID, context_hash=None):
+        """
+        Drops the session's answers, except those for context_hash (its current files).
+        """
+        with self.lock:
+            stale = [key for key in self.entries if key[0] == sessionID and key[1] != context_hash]
+            for key in stale:
+                self.bytes -= len(self.entries.pop(key))
+            self.stats["invalidations"] += len(stale)
+
+    def get_stats(self):
+        with self.lock:
+            lookups = self.stats["hits"] + self.stats["misses"]
+            return dict(self.stats, entries=len(self.entries), bytes=self.bytes,
+                        hit_rate=round(self.stats["hits"] / lookups, 3) if lookups else None)
+
+answer_cache = AnswerCache()
@@ -1,150 +1,338 @@
-from openai import OpenAI
+from openai import OpenAI, AsyncOpenAI, NotFoundError
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from ai_utils.ai_base import AIHandler
+from ai_utils.resource_registry import get_registry
+from ai_utils.shared_context import shared_contexts
+from ai_utils.context_shards import build_shards, diff_shards, shard_hash
+from ai_utils.run_waiter import RunError, wait_for_run, wait_for_run_async, iter_run_events, iter_run_events_async, is_run_event
+from ai_utils.instrumented_client import instrument_client
+from network_utils.metrics import time_stage, record_usage
 import json
-import time
-import os
+import hashlib
+
+ASSISTANT_NAME = "DataDude Directory Assistant"
+ASSISTANT_SETTINGS = dict(
+    instructions=f"""You are DataDude, an expert filesystem detective. Answer queries very accurately, according to the files uploaded in the vector stores. To read the file contents,
+        read the JSON Files: Open the <id>_*.json files. Each one holds the files of one folder of the directory.
+        <id> is the id at the end of the name of the vector store attached to the current thread. 
+        All responses should be text. If not, send a url link to the asset instead of the asset itself.
+        When the user references 'this folder' or 'this project', assume they are referring to the information about
+        the uploaded directory captured in the previously mentioned json files.
+        """,
+    # instructions=f"""You are DataDude, an expert filesystem detective. Answer queries very accurately, according to the files uploaded in the vector stores. To read the file contents, write Python code to:
+    #     1. Read the JSON File: Open the {self.sessionID}_context.json file and load the entire file object, not just the content key.
+    #     2. Extract Encoded Content: Access the base64 encoded content from the JSON data as bytes, not a string. This is important.
+    #     3. Base64 Decode: Decode the base64 encoded string to get the gzip compressed binary data.
+    #     4. Gzip Decompress: Decompress the gzip data to retrieve the original content.
+    #     5. Write to stdout: Print the decompressed content or save to a new file.
+        
+    #     All responses should be text. If not, send a url link to the asset instead of the asset itself.
+    #     When the user references 'this folder' or 'this project', assume they are referring to the information about
+    #     the uploaded directory.
+    #     """,
+    name=ASSISTANT_NAME,
+    tools=[{"type": "file_search"}, {"type": "code_interpreter"}],
+    model="gpt-3.5-turbo", # https://platform.openai.com/docs/models,
+    temperature=0.0 # makes things more deterministic, up to 2 makes things more random
+)
+VECTOR_STORE_PREFIX = "Directory Context Files "
+CHUNKING_STRATEGY = {
+    "type": "static",
+    "static": {
+        "max_chunk_size_tokens": 4096,
+        "chunk_overlap_tokens": int(4096/2) # max overlap tokens
+    }
+}
+UPLOAD_WORKERS = 8 # context shards uploaded at once
+RUN_INSTRUCTIONS = "Ignore any file beginning with a '.', or any file in a folder starting with a '.', like .git or .ssh for example. When the user asks about anything related to a file/folder's time, use the lastModified value of the respective file/folder. The uploaded directory is split across JSON files, one or more per folder, each with a folder path and its files. Answer the query by looking at the uploaded file content."
 
 def show_json(obj):
     dict = json.loads(obj.model_dump_json())
     print(json.dumps(dict, indent=2, sort_keys=True))
 
-def create_temp_file(data, filename):
+def combine_messages(messages):
+    """
+    Joins the Assistant's messages into one response.
+    """
+    message_response = []
+    for message in messages:
+        # print(message)
+        if message.content[0].type == 'text':
+            message_response.append(message.content[0].text.value)
+        if message.content[0].type == 'image_url':
+            message_response.append(message.content[0].image_url.url)
+        if message.content[0].type == 'image_file':
+            message_response.append("File ID: " + message.content[0].image_file.file_id)
+    if not message_response:
+        return "Error occurred. Please repeat your message."
+
+    # combine messages
+    return ' '.join(message_response)
+
+def get_delta_text(event):
+    """
+    Returns the pieces of new Assistant output in a run stream event.
+    Image outputs are returned as their URL or file ID, like combine_messages does.
+    """
+    if event.event != "thread.message.delta":
+        return []
+    pieces = []
+    for content in event.data.delta.content or []:
+        if content.type == 'text' and content.text and content.text.value:
+            pieces.append(content.text.value)
+        if content.type == 'image_url' and content.image_url:
+            pieces.append(content.image_url.url)
+        if content.type == 'image_file' and content.image_file:
+            pieces.append("File ID: " + content.image_file.file_id)
+    return pieces
+
+def get_context_hash(sessionContext: object):
+    return hashlib.sha256(json.dumps(sessionContext).encode('utf-8')).hexdigest()
+
+def get_thread_params(vector_store_id: str):
     """
-    creates temp file w/ data in it
+    Returns the arguments of threads.create for a thread that searches the vector store.
     """
-    if not os.path.exists("tmp"):
-        os.makedirs("tmp")
-    path = "tmp/" + filename
-    with open(path, 'wb') as file:
-        file.write(data)
-    return path
-
-def delete_temp_folder(filename):
+    return dict(tool_resources={"file_search": {"vector_store_ids": [vector_store_id]}})
+
+def get_message_params(thread_id: str, input: str):
+    return dict(thread_id=thread_id, role="user", content=f"{input.strip()}")
+
+def get_exchange_messages(thread_id: str, question: str, answer: str):
     """
-    removes the tmp folder and all files within
+    Returns the arguments of the two messages.create calls that add an answered question to a thread.
     """
-    os.rmdir("tmp")
-    os.remove("tmp/" + filename)
-    return
+    return [dict(thread_id=thread_id, role="user", content=question.strip()),
+            dict(thread_id=thread_id, role="assistant", content=answer)]
+
+def get_run_error_reply(error: RunError):
+    print(f"assistants_handler.py: Error: {error}")
+    return f"Error occurred ({error.status}). Please repeat your message."
+
+def is_datadude_assistant(assistant):
+    return assistant.name == ASSISTANT_NAME
+
+def is_live_vector_store(vector_store, sessionID: str):
+    """
+    Returns True if the vector store is the session's, and hasn't expired.
+    """
+    return vector_store.name == VECTOR_STORE_PREFIX + sessionID and vector_store.status != "expired"
+
+def get_vector_store_params(sessionID: str):
+    return dict(name=VECTOR_STORE_PREFIX + sessionID, expires_after={"days": 2, "anchor": "last_active_at"})
+
+def is_session_file(file, sessionID: str):
+    return file.filename.split("_")[0] == sessionID
+
+def is_context_current(session: object, context_hash: str):
+    """
+    Returns True if the registry says this exact context was uploaded last. The vector store
+    still has to be checked for the files.
+    """
+    return session.get("context_hash") == context_hash and bool(session.get("file_ids"))
+
+def files_ready(vector_store, file_ids: list):
+    """
+    Returns True if the vector store holds exactly these files, all done processing.
+    """
+    return vector_store.file_counts.completed == len(file_ids) and vector_store.file_counts.total == len(file_ids)
+
+class ContextUpload:
+    """
+    What upload_context has to do to bring the session's vector store up to date with a context:
+    the shards to upload, the old files to delete, and the registry updates in between.
+    The handler does the API calls, in the order of the methods here.
+    """
+    def __init__(self, sessionID: str, session: object, sessionContext: object, context_hash: str, vector_store_id: str):
+        self.sessionID = sessionID
+        self.session = session
+        self.context_hash = context_hash
+        self.vector_store_id = vector_store_id
+        # shards uploaded to another (e.g. expired) vector store don't count
+        self.old_shards = session.get("shards", {}) if session.get("vector_store_id") == vector_store_id else {}
+        self.shards = build_shards(sessionID, sessionContext)
+        self.upload, self.stale = diff_shards(self.old_shards, self.shards)
+        self.uploaded = {} # shard name -> file ID
+        self.new_shards = None # shard name -> {"hash", "file_id"}, once the uploads are in
+        self.file_ids = None
+
+    def get_file(self, name: str):
+        """
+        Returns the file argument of files.create for a shard.
+        """
+        return (name, self.shards[name])
+
+    def add_uploaded(self, registry, file_ids: list):
+        """
+        Records the file IDs of the uploaded shards (in the order of self.upload), so they're
+        cleaned up even if adding them to the vector store fails.
+        Returns the arguments of file_batches.create, or None if nothing was uploaded.
+        """
+        self.uploaded = dict(zip(self.upload, file_ids))
+        registry.update_session(self.sessionID, file_ids=self.session.get("file_ids", []) + list(self.uploaded.values()))
+        self.new_shards = {name: {"hash": shard_hash(data), "file_id": self.uploaded.get(name) or self.old_shards[name]["file_id"]} for name, data in self.shards.items()}
+        self.file_ids = [shard["file_id"] for shard in self.new_shards.values()]
+        if not self.uploaded:
+            return None
+        return dict(vector_store_id=self.vector_store_id, file_ids=list(self.uploaded.values()), extra_body={"chunking_strategy": CHUNKING_STRATEGY})
 
+    def check_batch(self, batch):
+        if batch.file_counts.failed or batch.file_counts.cancelled:
+            raise RuntimeError(f"{batch.file_counts.failed + batch.file_counts.cancelled} of {len(self.uploaded)} context files failed to upload")
+
+    def deletes_by_id(self):
+        """
+        Returns True if the stale shards' files are known by ID. Otherwise (e.g. files from the
+        single context file days) the session's files are cleaned up by name, keeping self.file_ids.
+        """
+        return "shards" in self.session
+
+    def finish(self, registry, assistant):
+        """
+        Records the uploaded context, and returns the shared context's resources.
+        """
+        registry.update_session(self.sessionID, shards=self.new_shards, file_ids=self.file_ids, context_hash=self.context_hash)
+        return {"assistant": assistant, "vector_store_id": self.vector_store_id, "file_ids": self.file_ids}
 
 class AssistantsHandler(AIHandler):
     """
     This AI handler persists message state in the forms of threads.
+    Each step that talks to the API has a blocking and an async version, for the server's async
+    mode. The decisions between the calls are shared (see ContextUpload and the functions above),
+    so the two versions only differ in how they make the calls.
     """
+    keeps_history = True
+
     def __init__(self, sessionID: str, context: object):
-        self.client = OpenAI()
+        self.client = instrument_client(OpenAI())
+        self.async_client = instrument_client(AsyncOpenAI())
         self.assistant = None
         self.thread_id = None
         self.sessionID = sessionID
         self.vector_store_id = None
         self.run = None
+        self.cancel_event = threading.Event()
+        self.registry = get_registry()
+        self.shared_context = None
         if sessionID and context:
             # this is skipped when running test scripts
             self.setup(context)
 
+    def use_shared_context(self, shared_context):
+        self.shared_context = shared_context
+        self.assistant = shared_context.resources["assistant"]
+        self.vector_store_id = shared_context.resources["vector_store_id"]
+
     def setup(self, sessionContext: object):
         """
-        Loads AI assistant and creates a new thread.
+        Loads AI assistant and the session's shared context, and creates a new thread.
+        Threads of a session with the same context share one upload of it.
         """
-        # The assistant only needs to be created once. It should not be created every time.
-        # At most, we should find the assistant, then load it here.
-        my_assistants = self.client.beta.assistants.list(
-            order="desc",
-        )
-        # if my_assistants.has_next_page(): 
-        #     print("dude you got a lot of assistants.")
-        # do some pagination https://platform.openai.com/docs/api-reference/assistants/listAssistants
-        
-        if len(my_assistants.data) > 0:
-            # get data dude directory assistant
-            assistants_list = my_assistants.data
-            # could've used a for loop for this search, but this oneliner is nice
-            data_dude_assistant = next((assistant for assistant in assistants_list if assistant.name == "DataDude Directory Assistant"), None)
-            self.assistant = data_dude_assistant
-        
-        if self.assistant == None:
-            self.assistant = self.client.beta.assistants.create(
-                instructions=f"""You are DataDude, an expert filesystem detective. Answer queries very accurately, according to the files uploaded in the vector stores. To read the file contents,
-                    read the JSON File: Open the <id>_context.json file and load the entire file content.
-                    <id> is the id at the end of the name of the vector store attached to the current thread. 
-                    All responses should be text. If not, send a url link to the asset instead of the asset itself.
-                    When the user references 'this folder' or 'this project', assume they are referring to the information about
-                    the uploaded directory captured in the previously mentioned json file.
-                    """,
-                # instructions=f"""You are DataDude, an expert filesystem detective. Answer queries very accurately, according to the files uploaded in the vector stores. To read the file contents, write Python code to:
-                #     1. Read the JSON File: Open the {self.sessionID}_context.json file and load the entire file object, not just the content key.
-                #     2. Extract Encoded Content: Access the base64 encoded content from the JSON data as bytes, not a string. This is important.
-                #     3. Base64 Decode: Decode the base64 encoded string to get the gzip compressed binary data.
-                #     4. Gzip Decompress: Decompress the gzip data to retrieve the original content.
-                #     5. Write to stdout: Print the decompressed content or save to a new file.
-                    
-                #     All responses should be text. If not, send a url link to the asset instead of the asset itself.
-                #     When the user references 'this folder' or 'this project', assume they are referring to the information about
-                #     the uploaded directory.
-                #     """,
-                name="DataDude Directory Assistant",
-                tools=[{"type": "file_search"}, {"type": "code_interpreter"}],
-                model="gpt-3.5-turbo", # https://platform.openai.com/docs/models,
-                temperature=0.0 # makes things more deterministic, up to 2 makes things more random
-            )
+        context_hash = get_context_hash(sessionContext)
+        self.use_shared_context(shared_contexts.acquire(self.sessionID, context_hash, lambda: self.upload_context(sessionContext, context_hash)))
 
+        # Create new thread and attach vector store to it
+        with time_stage("thread_creation"):
+            thread = self.client.beta.threads.create(**get_thread_params(self.vector_store_id))
+        self.thread_id = thread.id
 
-        
-        my_vector_stores = self.client.beta.vector_stores.list(order="desc")
-        if len(my_vector_stores.data) > 0:
-            # get latest vector store
-            vector_store_list = my_vector_stores.data
-            # could've used a for loop for this search, but this oneliner is nice
-            vector_store = next((vector_store for vector_store in vector_store_list if vector_store.name == "Directory Context Files " + self.sessionID), None)
-            if vector_store and vector_store.status != "expired":
-                self.vector_store_id = vector_store.id
-       
-        if self.vector_store_id == None:
-            # Create vector store for the session/directory
-            vector_store = self.client.beta.vector_stores.create(
-                name="Directory Context Files " + self.sessionID, 
-                expires_after={"days": 2, "anchor": "last_active_at"},
-            )
-            self.vector_store_id = vector_store.id
-        
-        # Create temp file with data to upload to thread
-        file_path = create_temp_file(json.dumps(sessionContext).encode('utf-8'), self.sessionID + "_context.json")
-        file_stream = open(file_path, "rb")
-        
-        # Delete old files uploaded attached to the vector store and uploaded
-        self.delete_session_files()
-        
-        # Create new file batch and upload to vector store
-        # It is better to create the file separately, then add to vector store and poll
+    def get_state(self):
+        """
+        Returns the IDs of the thread's OpenAI thread, assistant and vector store, and the hash of the context in it.
+        """
+        if self.thread_id is None:
+            return None
+        return {
+            "thread_id": self.thread_id,
+            "assistant_id": self.assistant.id,
+            "vector_store_id": self.vector_store_id,
+            "context_hash": self.shared_context.context_hash if self.shared_context else None,
+        }
+
+    def restore(self, state: object, sessionContext: object):
+        """
+        Picks the OpenAI thread back up from get_state()'s IDs, so the conversation carries on.
+        Falls back to a new setup if there's no state or the assistant is gone.
+        """
+        if not state:
+            self.setup(sessionContext)
+            return
+        try:
+            shared_context = shared_contexts.acquire(self.sessionID, state["context_hash"], lambda: self.restore_context(state))
+        except NotFoundError:
+            self.setup(sessionContext)
+            return
+        self.use_shared_context(shared_context)
+        self.thread_id = state["thread_id"]
+
+    def restore_context(self, state: object):
+        """
+        Returns the resources of a shared context that was uploaded before, from their IDs.
+        """
+        assistant = self.client.beta.assistants.retrieve(state["assistant_id"])
+        file_ids = (self.registry.get_session(self.sessionID) or {}).get("file_ids", [])
+        return {"assistant": assistant, "vector_store_id": state["vector_store_id"], "file_ids": file_ids}
+
+    def upload_context(self, sessionContext: object, context_hash: str):
+        """
+        Builds the session's shared context and returns its resources.
+        The context is split into shards (see ai_utils/context_shards.py), and only the shards
+        that changed since the last upload to the session's vector store are uploaded again.
+        Nothing is uploaded if the registry already has this exact context in the vector store.
+        """
+        # The assistant only needs to be created once. It should not be created every time.
+        # Its ID, and the session's vector store ID, are kept in the local resource registry.
+        session = self.registry.get_session(self.sessionID) or {}
+        with time_stage("assistant_lookup"):
+            assistant = self.load_assistant()
+        with time_stage("vector_store_lookup"):
+            vector_store_id = self.load_vector_store_id()
+        with time_stage("context_check"):
+            ready = is_context_current(session, context_hash) and self.context_files_ready(vector_store_id, session["file_ids"])
+        if ready:
+            return {"assistant": assistant, "vector_store_id": vector_store_id, "file_ids": session["file_ids"]}
+
+        # Upload the files in parallel, then add them to the vector store in one batch.
+        # It is better to create the files separately, then add to vector store and poll
         # That way you have control over the chunking strategy and can play around with it.
-        uploaded_file = self.client.files.create(file=file_stream, purpose="assistants") # file size up to 512 MB
-        file_id = uploaded_file.id
-        self.client.files.wait_for_processing(id=file_id)
-        if uploaded_file.status == "error":
-            # Error
-            print(f"assistants_handler.py: Error: File failed to upload")
-            exit(1)
-        self.client.beta.vector_stores.files.create(self.vector_store_id, file_id=file_id, extra_body={
-            "chunking_strategy": {
-                "type": "static",
-                "static": {
-                    "max_chunk_size_tokens": 4096,
-                    "chunk_overlap_tokens": int(4096/2) # max overlap tokens
-                }
-            }
-        } )
-        self.client.beta.vector_stores.files.poll(vector_store_id=self.vector_store_id, file_id=file_id)
+        plan = ContextUpload(self.sessionID, session, sessionContext, context_hash, vector_store_id)
+        with time_stage("file_upload"), ThreadPoolExecutor(max_workers=UPLOAD_WORKERS) as executor:
+            file_ids = list(executor.map(lambda name: self.client.files.create(file=plan.get_file(name), purpose="assistants").id, plan.upload))
+        batch_params = plan.add_uploaded(self.registry, file_ids)
+        if batch_params:
+            batch = self.client.beta.vector_stores.file_batches.create(**batch_params)
+            # wait for the vector store to process the files
+            with time_stage("vector_store_poll"):
+                batch = self.client.beta.vector_stores.file_batches.poll(batch.id, vector_store_id=vector_store_id)
+            plan.check_batch(batch)
 
-        # Create new thread and attach vector store to it
-        thread = self.client.beta.threads.create(
-            tool_resources={
-                "file_search":{
-                    "vector_store_ids": [self.vector_store_id]
-                }
-            }
-        )
-        self.thread_id = thread.id
+        # Delete the old files only now, so threads still using the vector store never find it empty
+        if plan.deletes_by_id():
+            for file_id in plan.stale:
+                try:
+                    self.client.files.delete(file_id)
+                except NotFoundError:
+                    pass
+        else:
+            self.delete_session_files(exclude=plan.file_ids)
+        return plan.finish(self.registry, assistant)
+
+    def context_files_ready(self, vector_store_id: str, file_ids: list):
+        """
+        Returns True if the vector store holds exactly these files, all done processing.
+        """
+        return files_ready(self.client.beta.vector_stores.retrieve(vector_store_id), file_ids)
+
+    def close(self):
+        """
+        Cancels the thread's run in progress and releases its reference to the session's shared context.
+        """
+        self.cancel()
+        if self.shared_context is not None:
+            shared_contexts.release(self.shared_context)
+            self.shared_context = None
 
     def get_response(self, input: str):
         """
@@ -154,22 +342,22 @@ class AssistantsHandler(AIHandler):
         We don't care about context or an init message because the Assistant itself holds the context.
         """
 
-        user_message = self.client.beta.threads.messages.create(
-            thread_id=self.thread_id,
-            role="user",
-            content=f"{input.strip()}",
-        )
-        
-        # Create a Run
-        run = self.client.beta.threads.runs.create(
-            thread_id=self.thread_id,
-            assistant_id=self.assistant.id,
-            additional_instructions="Ignore any file beginning with a '.', or any file in a folder starting with a '.', like .git or .ssh for example. When the user asks about anything related to a file/folder's time, use the lastModified value of the respective file/folder. Answer the query by looking at the uploaded file content."
-        )
-        self.run = run
+        user_message = self.client.beta.threads.messages.create(**get_message_params(self.thread_id, input))
         
-        # Runs are async, so we have to wait til it completed processing
-        self.wait_on_run()
+        try:
+            if hasattr(self.client.beta.threads.runs, "stream"):
+                # Stream the run, so we know it's done the moment it is
+                for event in iter_run_events(self.client, cancel_event=self.cancel_event, **self.get_run_params()):
+                    if is_run_event(event):
+                        self.run = event.data
+            else:
+                # Create a Run
+                self.run = self.client.beta.threads.runs.create(**self.get_run_params())
+                # Runs are async, so we have to wait til it completed processing
+                self.wait_on_run()
+        except RunError as e:
+            return get_run_error_reply(e)
+        record_usage(self.sessionID, getattr(self.run, "usage", None))
         run_steps = self.client.beta.threads.runs.steps.list(
             thread_id=self.thread_id,
             run_id=self.run.id
@@ -181,33 +369,185 @@ class AssistantsHandler(AIHandler):
 
         # List the Messages in the Thread to see what got added by the Assistant.
         # Listed from oldest first (asc), and filter only messages after the user message.
-        messages = self.client.beta.threads.messages.list(thread_id=self.thread_id, order="asc", after=user_message.id)
-        
-        message_response = []
-        for message in messages:
-            # print(message)
-            if message.content[0].type == 'text':
-                message_response.append(message.content[0].text.value)
-            if message.content[0].type == 'image_url':
-                message_response.append(message.content[0].image_url.url)
-            if message.content[0].type == 'image_file':
-                message_response.append("File ID: " + message.content[0].image_file.file_id)
-        if not message_response:
-            return "Error occurred. Please repeat your message."
+        with time_stage("message_listing"):
+            messages = self.client.beta.threads.messages.list(thread_id=self.thread_id, order="asc", after=user_message.id)
+            return combine_messages(messages)
 
-        # combine messages
-        combined_message = ' '.join(message_response)
-        return combined_message
+    def get_response_stream(self, input: str):
+        """
+        Adds message to the thread and streams the Run, yielding the Assistant's text as it's generated.
+        Image outputs are yielded as their URL or file ID, like get_response does.
+        """
+        self.client.beta.threads.messages.create(**get_message_params(self.thread_id, input))
+
+        for event in iter_run_events(self.client, cancel_event=self.cancel_event, **self.get_run_params()):
+            if is_run_event(event):
+                self.run = event.data
+            yield from get_delta_text(event)
+        record_usage(self.sessionID, getattr(self.run, "usage", None))
+
+    def add_exchange(self, question: str, answer: str):
+        """
+        Adds the question and its answer to the thread as they are, without a Run.
+        """
+        for message in get_exchange_messages(self.thread_id, question, answer):
+            self.client.beta.threads.messages.create(**message)
+
+    def get_run_params(self):
+        return dict(
+            thread_id=self.thread_id,
+            assistant_id=self.assistant.id,
+            additional_instructions=RUN_INSTRUCTIONS
+        )
 
-    
     def wait_on_run(self):
-        while self.run.status == "queued" or self.run.status == "in_progress":
-            # print("Run status: ", self.run.status)
-            self.run = self.client.beta.threads.runs.retrieve(
-                thread_id=self.thread_id,
-                run_id=self.run.id,
-            )
-            time.sleep(0.5)
+        """
+        Waits for self.run to finish. See ai_utils/run_waiter.py.
+        """
+        self.run = wait_for_run(self.client, self.run, cancel_event=self.cancel_event)
+
+    def cancel(self):
+        """
+        Cancels the run in progress, if any, and any run started after. Safe to call from another thread.
+        """
+        self.cancel_event.set()
+
+    async def setup_async(self, sessionContext: object):
+        """
+        Async version of setup, for the server's async mode.
+        """
+        context_hash = get_context_hash(sessionContext)
+        self.use_shared_context(await shared_contexts.acquire_async(self.sessionID, context_hash, lambda: self.upload_context_async(sessionContext, context_hash)))
+
+        with time_stage("thread_creation"):
+            thread = await self.async_client.beta.threads.create(**get_thread_params(self.vector_store_id))
+        self.thread_id = thread.id
+
+    async def upload_context_async(self, sessionContext: object, context_hash: str):
+        client = self.async_client
+        session = self.registry.get_session(self.sessionID) or {}
+        with time_stage("assistant_lookup"):
+            assistant = await self.load_assistant_async()
+        with time_stage("vector_store_lookup"):
+            vector_store_id = await self.load_vector_store_id_async()
+        with time_stage("context_check"):
+            ready = is_context_current(session, context_hash) and await self.context_files_ready_async(vector_store_id, session["file_ids"])
+        if ready:
+            return {"assistant": assistant, "vector_store_id": vector_store_id, "file_ids": session["file_ids"]}
+
+        plan = ContextUpload(self.sessionID, session, sessionContext, context_hash, vector_store_id)
+        # the semaphore bounds the uploads in flight, like the worker pool in upload_context
+        semaphore = asyncio.Semaphore(UPLOAD_WORKERS)
+        async def upload_shard(name):
+            async with semaphore:
+                return (await client.files.create(file=plan.get_file(name), purpose="assistants")).id
+        with time_stage("file_upload"):
+            file_ids = await asyncio.gather(*(upload_shard(name) for name in plan.upload))
+        batch_params = plan.add_uploaded(self.registry, file_ids)
+        if batch_params:
+            batch = await client.beta.vector_stores.file_batches.create(**batch_params)
+            with time_stage("vector_store_poll"):
+                batch = await client.beta.vector_stores.file_batches.poll(batch.id, vector_store_id=vector_store_id)
+            plan.check_batch(batch)
+
+        if plan.deletes_by_id():
+            for file_id in plan.stale:
+                try:
+                    await client.files.delete(file_id)
+                except NotFoundError:
+                    pass
+        else:
+            await self.delete_session_files_async(exclude=plan.file_ids)
+        return plan.finish(self.registry, assistant)
+
+    async def context_files_ready_async(self, vector_store_id: str, file_ids: list):
+        return files_ready(await self.async_client.beta.vector_stores.retrieve(vector_store_id), file_ids)
+
+    async def get_response_async(self, input: str):
+        """
+        Async version of get_response. Waiting on the run suspends the coroutine instead of blocking a thread.
+        """
+        client = self.async_client
+        user_message = await client.beta.threads.messages.create(**get_message_params(self.thread_id, input))
+        try:
+            if hasattr(client.beta.threads.runs, "stream"):
+                async for event in iter_run_events_async(client, cancel_event=self.cancel_event, **self.get_run_params()):
+                    if is_run_event(event):
+                        self.run = event.data
+            else:
+                self.run = await client.beta.threads.runs.create(**self.get_run_params())
+                self.run = await wait_for_run_async(client, self.run, cancel_event=self.cancel_event)
+        except RunError as e:
+            return get_run_error_reply(e)
+        record_usage(self.sessionID, getattr(self.run, "usage", None))
+        with time_stage("message_listing"):
+            messages = [message async for message in client.beta.threads.messages.list(thread_id=self.thread_id, order="asc", after=user_message.id)]
+            return combine_messages(messages)
+
+    async def get_response_stream_async(self, input: str):
+        """
+        Async version of get_response_stream.
+        """
+        client = self.async_client
+        await client.beta.threads.messages.create(**get_message_params(self.thread_id, input))
+        async for event in iter_run_events_async(client, cancel_event=self.cancel_event, **self.get_run_params()):
+            if is_run_event(event):
+                self.run = event.data
+            for piece in get_delta_text(event):
+                yield piece
+        record_usage(self.sessionID, getattr(self.run, "usage", None))
+
+    async def add_exchange_async(self, question: str, answer: str):
+        for message in get_exchange_messages(self.thread_id, question, answer):
+            await self.async_client.beta.threads.messages.create(**message)
+
+    async def delete_session_files_async(self, exclude=()):
+        file_ids = self.get_registered_file_ids()
+        if file_ids is None:
+            file_ids = [file.id async for file in self.async_client.files.list(purpose="assistants") if is_session_file(file, self.sessionID)]
+        file_ids = [file_id for file_id in file_ids if file_id not in exclude]
+        for file_id in file_ids:
+            try:
+                await self.async_client.files.delete(file_id)
+            except NotFoundError:
+                pass
+        self.registry.update_session(self.sessionID, file_ids=list(exclude))
+
+    async def load_assistant_async(self):
+        assistant_id = self.registry.get_assistant_id()
+        if assistant_id:
+            try:
+                return await self.async_client.beta.assistants.retrieve(assistant_id)
+            except NotFoundError:
+                pass
+        assistant = None
+        async for candidate in self.async_client.beta.assistants.list(order="desc", limit=100):
+            if is_datadude_assistant(candidate):
+                assistant = candidate
+                break
+        if assistant == None:
+            assistant = await self.async_client.beta.assistants.create(**ASSISTANT_SETTINGS)
+        self.registry.set_assistant_id(assistant.id)
+        return assistant
+
+    async def load_vector_store_id_async(self):
+        vector_store_id = self.get_registered_vector_store_id()
+        if vector_store_id:
+            try:
+                vector_store = await self.async_client.beta.vector_stores.retrieve(vector_store_id)
+                if vector_store.status != "expired":
+                    return vector_store.id
+            except NotFoundError:
+                pass
+        vector_store = None
+        async for candidate in self.async_client.beta.vector_stores.list(order="desc", limit=100):
+            if is_live_vector_store(candidate, self.sessionID):
+                vector_store = candidate
+                break
+        if vector_store == None:
+            vector_store = await self.async_client.beta.vector_stores.create(**get_vector_store_params(self.sessionID))
+        self.registry.update_session(self.sessionID, vector_store_id=vector_store.id)
+        return vector_store.id
 
     def delete_vectore_stores(self):
         vector_stores = self.client.beta.vector_stores.list(order="desc", limit=100)
@@ -228,16 +568,71 @@ class AssistantsHandler(AIHandler):
         print(f"deleted {ctr-1} files")
 
     
-    def delete_session_files(self):
-        files = self.client.files.list(purpose="assistants")
-        ctr = 1
-        for file in files:
-            # delete it
-            file_session = file.filename.split("_")
-            if file_session[0] == self.sessionID:
-                self.client.files.delete(file.id)
-            ctr += 1
-        print(f"deleted {ctr-1} old files")
+    def get_registered_file_ids(self):
+        """
+        Returns the IDs of the session's files in the registry, or None if it doesn't have them.
+        """
+        session = self.registry.get_session(self.sessionID)
+        if session is not None and "file_ids" in session:
+            return session["file_ids"]
+        return None
+
+    def get_registered_vector_store_id(self):
+        return (self.registry.get_session(self.sessionID) or {}).get("vector_store_id")
+
+    def delete_session_files(self, exclude=()):
+        file_ids = self.get_registered_file_ids()
+        if file_ids is None:
+            # registry miss: go through every file in the account for the session's
+            file_ids = [file.id for file in self.client.files.list(purpose="assistants") if is_session_file(file, self.sessionID)]
+        file_ids = [file_id for file_id in file_ids if file_id not in exclude]
+        for file_id in file_ids:
+            try:
+                self.client.files.delete(file_id)
+            except NotFoundError:
+                # already gone
+                pass
+        self.registry.update_session(self.sessionID, file_ids=list(exclude))
+        print(f"deleted {len(file_ids)} old files")
+
+    def load_assistant(self):
+        """
+        Returns the DataDude assistant. The one in the registry is checked with a single retrieve.
+        On a miss, every page of assistants is searched by name, and it's created if it's not found.
+        """
+        assistant_id = self.registry.get_assistant_id()
+        if assistant_id:
+            try:
+                return self.client.beta.assistants.retrieve(assistant_id)
+            except NotFoundError:
+                pass
+        # iterating the list goes through all pages
+        assistant = next((assistant for assistant in self.client.beta.assistants.list(order="desc", limit=100) if is_datadude_assistant(assistant)), None)
+        if assistant == None:
+            assistant = self.client.beta.assistants.create(**ASSISTANT_SETTINGS)
+        self.registry.set_assistant_id(assistant.id)
+        return assistant
+
+    def load_vector_store_id(self):
+        """
+        Returns the ID of the session's vector store, looked up like load_assistant does.
+        Expired vector stores are replaced.
+        """
+        vector_store_id = self.get_registered_vector_store_id()
+        if vector_store_id:
+            try:
+                vector_store = self.client.beta.vector_stores.retrieve(vector_store_id)
+                if vector_store.status != "expired":
+                    return vector_store.id
+            except NotFoundError:
+                pass
+        vector_store = next((vector_store for vector_store in self.client.beta.vector_stores.list(order="desc", limit=100)
+                             if is_live_vector_store(vector_store, self.sessionID)), None)
+        if vector_store == None:
+            # Create vector store for the session/directory
+            vector_store = self.client.beta.vector_stores.create(**get_vector_store_params(self.sessionID))
+        self.registry.update_session(self.sessionID, vector_store_id=vector_store.id)
+        return vector_store.id
 
     def get_thread_messages(self, thread_id: str):
         """
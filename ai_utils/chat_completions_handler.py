@@ -1,26 +1,35 @@
-from openai import OpenAI
+from openai import OpenAI, AsyncOpenAI
 from ai_utils.ai_base import AIHandler
+from ai_utils.metadata_query import MetadataIndex
+from ai_utils.retrieval_index import RetrievalIndex, get_index, get_excerpt, DEFAULT_TOP_K
+from ai_utils.instrumented_client import instrument_client
+from network_utils.metrics import time_stage, record_usage
 
 def create_context_text(context: object):
     """
-    Summarizes the context to keep it concise
+    Summarizes the context to keep it concise.
+    The prompt gets a summary of the folder, not a list of every file: the files a question
+    is about come with its excerpts, found by name or content.
     """
-    files_summary = "\n".join([f"{file['name']} ({file['path']}, {file['size']} bytes)" for file in context['files']])
-    # git_info_summary = "\n".join([f"{key}: {value}" for key, value in context['git_info'].items()])
-
-    return f"Files:\n{files_summary}\n"
-    # \nGit Info:\n{git_info_summary}"
+    return f"Folder summary:\n{MetadataIndex(context['files']).get_summary()}\n"
 
 class ChatCompletionsHandler(AIHandler):
     """
     This AI handler holds no state between messages.
     They effectively reset to zero.
     However, context is up to date on every message sent.
-    The context is sent as a "system" message.
+    The context is sent as a "system" message, along with excerpts of the files
+    most relevant to each query, found with a local BM25 index.
     """
-    def __init__(self):
-        self.client = OpenAI()
+    def __init__(self, sessionID: str = None, context: object = None):
+        self.client = instrument_client(OpenAI())
+        self.async_client = instrument_client(AsyncOpenAI())
         self.system_messages = []
+        self.sessionID = sessionID
+        self.files = {}
+        self.index = None
+        if context:
+            self.setup(context)
 
 
     def setup(self, sessionContext: object):
@@ -34,17 +43,91 @@ class ChatCompletionsHandler(AIHandler):
         ]
         self.system_messages = messages
 
-    def get_response(self, input: str):
+        # Threads of a session share its index, which only re-reads the files that changed
+        self.files = {file['path']: file for file in sessionContext['files']}
+        with time_stage("index_update"):
+            self.index = get_index(self.sessionID) if self.sessionID else RetrievalIndex()
+            self.index.update(sessionContext['files'])
+            self.index.save()
+
+    def get_excerpts_message(self, input: str):
+        """
+        Returns a system message with the file chunks that best match input, or None if none do.
+        """
+        if self.index is None:
+            return None
+        excerpts = []
+        with time_stage("index_search"):
+            results = self.index.search(input, DEFAULT_TOP_K)
+        for _, path, start, end in results:
+            if path not in self.files:
+                continue
+            if start == 0:
+                # the file matched by name only
+                excerpts.append(path)
+            else:
+                excerpts.append(f"{path} (lines {start}-{end}):\n{get_excerpt(self.files[path], start, end)}")
+        if not excerpts:
+            return None
+        return {"role": "system", "content": "Excerpts of the files that may be relevant to the query:\n\n" + "\n\n".join(excerpts)}
+
+    def get_messages(self, input: str):
         messages = []
         for message in self.system_messages:
             messages.append(message)  
+        excerpts_message = self.get_excerpts_message(input)
+        if excerpts_message:
+            messages.append(excerpts_message)
         messages.append(
             {"role": "user", "content": f"{input}"},
         )
-        
+        return messages
+
+    def get_response(self, input: str):
         completion = self.client.chat.completions.create(
             model="gpt-3.5-turbo",
-            messages=messages,
+            messages=self.get_messages(input),
             temperature=0 # from 0 to 2, where 0 is most deterministic and 2 most random.
         )
+        record_usage(self.sessionID, completion.usage)
+        return completion.choices[0].message.content
+
+    def get_response_stream(self, input: str):
+        """
+        Yields the completion's text as it's generated.
+        """
+        stream = self.client.chat.completions.create(
+            model="gpt-3.5-turbo",
+            messages=self.get_messages(input),
+            temperature=0,
+            stream=True,
+            stream_options={"include_usage": True} # the last chunk has the token counts
+        )
+        for chunk in stream:
+            if chunk.usage:
+                record_usage(self.sessionID, chunk.usage)
+            if chunk.choices and chunk.choices[0].delta.content:
+                yield chunk.choices[0].delta.content
+
+    async def get_response_async(self, input: str):
+        completion = await self.async_client.chat.completions.create(
+            model="gpt-3.5-turbo",
+            messages=self.get_messages(input),
+            temperature=0
+        )
+        record_usage(self.sessionID, completion.usage)
         return completion.choices[0].message.content
+
+    async def get_response_stream_async(self, input: str):
+        stream = await self.async_client.chat.completions.create(
+            model="gpt-3.5-turbo",
+            messages=self.get_messages(input),
+            temperature=0,
+            stream=True,
+            stream_options={"include_usage": True} # the last chunk has the token counts
+        )
+        async for chunk in stream:
+            if chunk.usage:
+                record_usage(self.sessionID, chunk.usage)
+            if chunk.choices and chunk.choices[0].delta.content:
+                yield chunk.choices[0].delta.content
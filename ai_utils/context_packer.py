@@ -0,0 +1,182 @@
+"""
+Fits a scanned folder into a token budget instead of failing when it's too big.
+
+Metadata (name, path, size, lastModified) of every file is always kept. File contents
+are then added in priority order - recently modified, small, documentation/source files
+near the top of the tree first - until the budget runs out. A file that doesn't fit whole
+is cut down to an excerpt of its head and tail if there's room for one, otherwise its
+content is dropped. Symbols are only for the server's own lookups, so they are dropped
+first: they are added back, in the same order, with whatever budget the contents leave.
+Token counts come from the shared TokenCountCache, so repacking a folder only tokenizes
+files that changed. Each file is counted on its own, with a margin of
+ITEM_SEPARATOR_TOKENS for where it meets the next one (see count_json_tokens), so the
+packed total errs on the high side of what the whole body tokenizes to.
+"""
+
+import os
+import sys
+import json
+
+# allow running this file as a script from anywhere
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from ai_utils.token_counter import get_token_cache, count_tokens, ITEM_SEPARATOR_TOKENS
+from ai_utils.token_validator import TokenLimitExceededError
+
+FILE_TYPE_PRIORITY = {'.md': 1.0, '.py': 0.9, '.js': 0.8, '.jsx': 0.8, '.sh': 0.6}
+DEFAULT_TYPE_PRIORITY = 0.5
+PRIORITY_WEIGHTS = {"recency": 0.4, "size": 0.2, "type": 0.2, "depth": 0.2}
+MIN_EXCERPT_TOKENS = 256 # don't bother with excerpts smaller than this
+EXCERPT_MARKER = "\n\n... [excerpt, {} characters omitted] ...\n\n"
+EXCERPT_ATTEMPTS = 3
+DROPPABLE_FIELDS = ("content", "symbols")
+
+def get_metadata(file_info):
+    """
+    Returns the file info without its content and symbols.
+    """
+    return {key: value for key, value in file_info.items() if key not in DROPPABLE_FIELDS}
+
+def rank(values, reverse=False):
+    """
+    Returns each value's rank scaled to [0, 1], 1 being the largest (or the smallest if reverse).
+    """
+    order = sorted(range(len(values)), key=lambda i: values[i], reverse=reverse)
+    scale = max(len(values) - 1, 1)
+    ranks = [0.0] * len(values)
+    for position, i in enumerate(order):
+        ranks[i] = position / scale
+    return ranks
+
+def get_priorities(files):
+    """
+    Scores each file's content between 0 and 1. Higher scores are packed first.
+    """
+    recency = rank([file_info.get("lastModified", "") for file_info in files])
+    smallness = rank([file_info.get("size", 0) for file_info in files], reverse=True)
+    depths = [file_info["path"].count('/') for file_info in files]
+    min_depth = min(depths, default=0)
+    priorities = []
+    for i, file_info in enumerate(files):
+        name = file_info["name"]
+        extension = name[name.rfind('.'):] if '.' in name else ''
+        file_type = FILE_TYPE_PRIORITY.get(extension, DEFAULT_TYPE_PRIORITY)
+        priorities.append(
+            PRIORITY_WEIGHTS["recency"] * recency[i]
+            + PRIORITY_WEIGHTS["size"] * smallness[i]
+            + PRIORITY_WEIGHTS["type"] * file_type
+            + PRIORITY_WEIGHTS["depth"] / (1 + depths[i] - min_depth)
+        )
+    return priorities
+
+def make_excerpt(content, keep_chars):
+    """
+    Returns the head and tail of content, keep_chars characters in total.
+    """
+    head_chars = keep_chars * 3 // 4
+    tail_chars = keep_chars - head_chars
+    omitted = len(content) - keep_chars
+    return content[:head_chars] + EXCERPT_MARKER.format(omitted) + (content[-tail_chars:] if tail_chars else "")
+
+def fit_excerpt(file_info, content_tokens, budget, cache):
+    """
+    Returns (record, tokens) for an excerpt of the file that fits in budget tokens, or None.
+    """
+    content = file_info["content"]
+    scale = budget / content_tokens
+    for _ in range(EXCERPT_ATTEMPTS):
+        keep_chars = int(len(content) * scale * 0.9)
+        if keep_chars <= 0:
+            return None
+        record = dict(file_info)
+        record["content"] = make_excerpt(content, keep_chars)
+        record["contentStatus"] = "excerpt"
+        tokens = cache.count_record(record) + ITEM_SEPARATOR_TOKENS
+        if tokens <= budget:
+            return record, tokens
+        scale *= budget / tokens
+    return None
+
+def pack_context(body, max_tokens, list_key="files", cache=None):
+    """
+    Fits a request body into max_tokens by trimming the content of the files in body[list_key].
+    Returns the packed body and a report dict with the token count and how many files
+    were kept whole, cut to excerpts or left without content.
+    The body is returned unchanged if it already fits.
+    Raises TokenLimitExceededError if even the metadata alone, without symbols, doesn't fit.
+    """
+    if cache is None:
+        cache = get_token_cache()
+    files = body.get(list_key) or []
+    skeleton = dict(body)
+    skeleton[list_key] = []
+    skeleton_tokens = count_tokens(json.dumps(skeleton), cache.model)
+
+    metadata = [get_metadata(file_info) for file_info in files]
+    metadata_json = [json.dumps(record) for record in metadata]
+    full_tokens = [cache.count_record(file_info) + ITEM_SEPARATOR_TOKENS for file_info in files]
+    report = {"tokens": skeleton_tokens + sum(full_tokens), "full": 0, "excerpts": 0, "dropped": 0}
+    if report["tokens"] <= max_tokens:
+        report["full"] = sum(1 for file_info in files if "content" in file_info)
+        return body, report
+
+    metadata_tokens = [cache.count(text) + ITEM_SEPARATOR_TOKENS for text in metadata_json]
+    used = skeleton_tokens + sum(metadata_tokens)
+    if used > max_tokens:
+        raise TokenLimitExceededError(used, max_tokens)
+
+    packed = list(metadata)
+    # +1 in case the marker doesn't merge with the closing brace the way it does here
+    marker_tokens = count_tokens(', "contentStatus": "over_token_budget"}', cache.model) - count_tokens('}', cache.model) + 1
+    priorities = get_priorities(files)
+    packed_tokens = list(metadata_tokens)
+    with_content = [i for i, file_info in enumerate(files) if "content" in file_info]
+    for i in sorted(with_content, key=lambda i: priorities[i], reverse=True):
+        file_info = get_metadata(files[i])
+        file_info["content"] = files[i]["content"]
+        tokens = cache.count_record(file_info, metadata_json[i]) + ITEM_SEPARATOR_TOKENS
+        if used + tokens - metadata_tokens[i] <= max_tokens:
+            packed[i] = file_info
+            report["full"] += 1
+        else:
+            budget = max_tokens - used + metadata_tokens[i]
+            excerpt = None
+            if budget - metadata_tokens[i] >= MIN_EXCERPT_TOKENS:
+                excerpt = fit_excerpt(file_info, tokens - metadata_tokens[i], budget, cache)
+            if excerpt is not None:
+                packed[i], tokens = excerpt
+                report["excerpts"] += 1
+            else:
+                tokens = metadata_tokens[i]
+                if used + marker_tokens <= max_tokens:
+                    packed[i] = dict(packed[i], contentStatus="over_token_budget")
+                    tokens += marker_tokens
+                report["dropped"] += 1
+        used += tokens - metadata_tokens[i]
+        packed_tokens[i] = tokens
+
+    # symbols are only for the server's own lookups, so they get whatever room the content left
+    with_symbols = [i for i, file_info in enumerate(files) if "symbols" in file_info]
+    for i in sorted(with_symbols, key=lambda i: priorities[i], reverse=True):
+        record = dict(packed[i], symbols=files[i]["symbols"])
+        tokens = cache.count_record(record) + ITEM_SEPARATOR_TOKENS
+        if used + tokens - packed_tokens[i] <= max_tokens:
+            packed[i] = record
+            used += tokens - packed_tokens[i]
+
+    report["tokens"] = used
+    packed_body = dict(body)
+    packed_body[list_key] = packed
+    return packed_body, report
+
+if __name__ == "__main__":
+    # Packs a request body read from stdin and prints it
+    max_tokens = int(sys.argv[1]) if len(sys.argv) > 1 else 500000
+    body = json.loads(sys.stdin.read())
+    try:
+        packed_body, report = pack_context(body, max_tokens)
+    except TokenLimitExceededError as e:
+        print(f"TokenLimitExceededError: {e}")
+        sys.exit(1)
+    print(json.dumps(packed_body))
+    print(f"packed {report['tokens']} tokens: {report['full']} full files, {report['excerpts']} excerpts, {report['dropped']} without content", file=sys.stderr)
+    get_token_cache().save()
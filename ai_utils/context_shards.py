@@ -0,0 +1,72 @@
+"""
+Splits a session's context into shards to upload to the vector store.
+
+Instead of one <sessionID>_context.json holding the whole folder, the files are grouped by
+the folder they're in, and each folder's files are written to one or more JSON documents
+of at most SHARD_BYTES. A file bigger than that gets a shard of its own. Shard names only
+depend on the folder and the shard's position in it, so after a change only the shards of
+the folders that changed hash differently, and only those are uploaded again.
+
+Shard names start with "<sessionID>_", like the old single context file, so the session's
+files can still be found by name.
+"""
+
+import os
+import json
+import hashlib
+
+SHARD_BYTES = 1024 * 1024 # the scanner caps file content at 1 MB, so most files fit in a shard
+MAX_NAME_CHARS = 80
+
+def shard_hash(data: bytes):
+    return hashlib.sha256(data).hexdigest()
+
+def get_shard_prefix(sessionID, folder):
+    """
+    Returns the file name prefix of a folder's shards: readable, but unique per folder.
+    """
+    readable = folder.replace(os.sep, "__").replace(" ", "-").strip("_.") or "root"
+    folder_hash = hashlib.sha256(folder.encode('utf-8', errors='surrogatepass')).hexdigest()[:8]
+    return f"{sessionID}_{readable[-MAX_NAME_CHARS:]}-{folder_hash}"
+
+def group_by_folder(files):
+    """
+    Returns a dict of folder path -> the file records in it, sorted by path.
+    """
+    folders = {}
+    for record in sorted(files, key=lambda record: record["path"]):
+        folders.setdefault(os.path.dirname(record["path"]), []).append(record)
+    return folders
+
+def build_shards(sessionID, context, max_shard_bytes=SHARD_BYTES):
+    """
+    Returns a dict of shard file name -> shard content (bytes) for a session context ({"files": [...]}).
+    """
+    shards = {}
+    # symbols are only for the server's own lookups, the model reads the content
+    files = [{key: value for key, value in record.items() if key != "symbols"} for record in context.get("files") or []]
+    for folder, records in group_by_folder(files).items():
+        chunks = [[]]
+        chunk_bytes = 0
+        for record in records:
+            record_bytes = len(json.dumps(record).encode('utf-8')) + 2 # +2 for the ", " between records
+            if chunks[-1] and chunk_bytes + record_bytes > max_shard_bytes:
+                chunks.append([])
+                chunk_bytes = 0
+            chunks[-1].append(record)
+            chunk_bytes += record_bytes
+        prefix = get_shard_prefix(sessionID, folder)
+        for i, chunk in enumerate(chunks):
+            shards[f"{prefix}-{i}.json"] = json.dumps({"folder": folder, "files": chunk}).encode('utf-8')
+    return shards
+
+def diff_shards(old_shards, new_shards):
+    """
+    Compares the shards in the vector store (name -> {"hash": ..., "file_id": ...}) with newly built ones (name -> bytes).
+    Returns the names to upload (new or changed) and the file IDs to delete (changed or gone).
+    """
+    upload = [name for name, data in new_shards.items()
+              if name not in old_shards or old_shards[name]["hash"] != shard_hash(data)]
+    stale = [shard["file_id"] for name, shard in old_shards.items()
+             if name not in new_shards or name in upload]
+    return upload, stale
@@ -0,0 +1,76 @@
+"""
+Wraps an OpenAI client so every API call made through it is counted and timed for /metrics,
+and traced as a span if tracing is on.
+Calls are labelled with the SDK method's path, like "beta.threads.runs.create" or
+"chat.completions.create". Only the first page of a list is counted, since the later
+pages are fetched while iterating over it.
+"""
+
+import time
+import inspect
+from network_utils.metrics import openai_requests, openai_errors, openai_request_seconds
+from network_utils import tracing
+
+def is_resource(value):
+    return type(value).__module__.startswith("openai.resources")
+
+class InstrumentedClient:
+    """
+    Stands in for an OpenAI (or AsyncOpenAI) client, or one of its resources like client.beta.threads.
+    """
+    def __init__(self, target, path=""):
+        self._target = target
+        self._path = path
+
+    def __getattr__(self, name):
+        value = getattr(self._target, name)
+        if name.startswith("_"):
+            return value
+        endpoint = f"{self._path}.{name}" if self._path else name
+        if is_resource(value):
+            return InstrumentedClient(value, endpoint)
+        if inspect.ismethod(value) and is_resource(value.__self__):
+            return instrument_call(value, endpoint)
+        return value
+
+def instrument_call(method, endpoint):
+    """
+    Returns method, counted and timed. The async client's methods return a coroutine,
+    which is timed until it's done.
+    """
+    def call(*args, **kwargs):
+        openai_requests.inc(endpoint=endpoint)
+        span = tracing.start_span("openai " + endpoint)
+        start = time.perf_counter()
+        try:
+            result = method(*args, **kwargs)
+        except Exception as e:
+            record_call(endpoint, start, span, e)
+            raise
+        if inspect.iscoroutine(result):
+            return await_call(result, endpoint, start, span)
+        record_call(endpoint, start, span)
+        return result
+    return call
+
+async def await_call(coroutine, endpoint, start, span):
+    try:
+        result = await coroutine
+    except Exception as e:
+        record_call(endpoint, start, span, e)
+        raise
+    record_call(endpoint, start, span)
+    return result
+
+def record_call(endpoint, start, span, error=None):
+    openai_request_seconds.observe(time.perf_counter() - start, endpoint=endpoint)
+    if error is not None:
+        openai_errors.inc(endpoint=endpoint, error=type(error).__name__)
+    if span is not None:
+        span.end(error)
+
+def instrument_client(client):
+    """
+    Returns the client, with its API calls counted and timed.
+    """
+    return InstrumentedClient(client)
@@ -0,0 +1,185 @@
+"""
+Answers common questions about a folder's file metadata without asking the model.
+
+"When was the last updated file?", "What is the path to server.py?", "What's the biggest
+file?" and "How many .py files are there?" only need the scanner's metadata. MetadataIndex
+precomputes the files sorted by lastModified and by size, a name -> paths lookup, counts per
+extension and totals per folder, so answering one of these takes a regex match and a lookup.
+Questions it doesn't recognize get None, and go to the AI handler as before.
+"""
+
+import os
+import re
+import sys
+import time
+from datetime import datetime
+
+MAX_QUESTION_WORDS = 14 # longer questions are left to the model, they probably ask for more
+MAX_LISTED = 20 # most files listed in one answer
+SUMMARY_FILES = 5
+LANGUAGE_EXTENSIONS = {"python": ".py", "javascript": ".js", "markdown": ".md", "shell": ".sh", "json": ".json", "text": ".txt"}
+
+def format_time(last_modified):
+    """
+    Formats an ISO timestamp like "6/1/2024 at 6:18 PM".
+    """
+    dt = datetime.fromisoformat(last_modified)
+    return f"{dt.month}/{dt.day}/{dt.year} at {dt.strftime('%I:%M %p').lstrip('0')}"
+
+def format_size(size):
+    for unit in ("bytes", "KB", "MB", "GB"):
+        if size < 1024 or unit == "GB":
+            return f"{size} {unit}" if unit == "bytes" else f"{size:.1f} {unit}"
+        size /= 1024
+
+def get_extension(name):
+    return name[name.rfind('.'):].lower() if '.' in name[1:] else ''
+
+def parse_count(text):
+    """
+    Returns how many files a question asks for ("the 5 largest files" -> 5), 1 if it asks for "the file".
+    """
+    match = re.search(r"\b(\d+)\b", text)
+    if match:
+        return max(1, min(int(match.group(1)), MAX_LISTED))
+    return MAX_LISTED if re.search(r"\bfiles\b", text) and not re.search(r"\b(?:the|which|what) (?:one|file)\b", text) else 1
+
+class MetadataIndex:
+    """
+    Precomputed metadata lookups over a list of scanned file records.
+    """
+    def __init__(self, files):
+        self.files = [{key: value for key, value in file.items() if key not in ("content", "symbols")} for file in files]
+        self.by_modified = sorted(self.files, key=lambda file: file["lastModified"], reverse=True)
+        self.by_size = sorted(self.files, key=lambda file: file["size"], reverse=True)
+        self.paths_by_name = {}
+        self.extension_counts = {}
+        self.folders = {}
+        self.root = os.path.commonpath([os.path.dirname(file["path"]) for file in self.files]) if self.files else ''
+        for file in self.files:
+            self.paths_by_name.setdefault(file["name"].lower(), []).append(file["path"])
+            extension = get_extension(file["name"])
+            self.extension_counts[extension] = self.extension_counts.get(extension, 0) + 1
+            # add the file to the totals of its folder and every folder above it
+            folder = os.path.relpath(os.path.dirname(file["path"]), self.root)
+            while True:
+                totals = self.folders.setdefault(folder, {"files": 0, "size": 0, "lastModified": ""})
+                totals["files"] += 1
+                totals["size"] += file["size"]
+                totals["lastModified"] = max(totals["lastModified"], file["lastModified"])
+                if folder in ('.', ''):
+                    break
+                folder = os.path.dirname(folder) or '.'
+        self.questions = [
+            (re.compile(r"^(?:what|which|when|show me)\b.*\b(?:last|latest|newest|most recent(?:ly)?)\b(?: \w+)? files?$"), self.answer_recent),
+            (re.compile(r"^(?:what|which|when|show me)\b.*\b(?:oldest|least recent(?:ly)?)\b(?: \w+)? files?$"), self.answer_oldest),
+            (re.compile(r"^(?:what|which|show me)\b.*\b(?:largest|biggest)\b files?$"), self.answer_largest),
+            (re.compile(r"^(?:what|which|show me)\b.*\bsmallest\b files?$"), self.answer_smallest),
+            (re.compile(r"^(?:what is|what's|whats) the (?:full )?path (?:to|of) (?:the )?(?:file )?([\w.\-]+)$"), self.answer_path),
+            (re.compile(r"^where is (?:the )?(?:file )?([\w\-]*\.[\w.\-]+)$"), self.answer_path),
+            (re.compile(r"^how many (?:(\.?\w+) )?files\b(?: are)?(?: there)?(?: in (?:this|the) (?:folder|project|directory))?(?: are there)?$"), self.answer_count),
+            (re.compile(r"^how (?:big|large) is (?:the )?(this \w+|[\w./\-]+?)(?: (?:folder|directory|file))?$"), self.answer_size),
+        ]
+
+    def answer(self, question):
+        """
+        Returns the answer to a recognized metadata question, or None.
+        """
+        text = re.sub(r"\s+", " ", question.strip().lower()).rstrip('?!. ')
+        if not text or len(text.split()) > MAX_QUESTION_WORDS or not self.files:
+            return None
+        for pattern, answer in self.questions:
+            match = pattern.search(text)
+            if match:
+                return answer(text, *match.groups())
+        return None
+
+    def list_files(self, files, describe):
+        return "\n".join(f"{file['path']} ({describe(file)})" for file in files)
+
+    def answer_recent(self, text):
+        count = parse_count(text)
+        if count == 1:
+            file = self.by_modified[0]
+            return f"{file['name']}, which was updated on {format_time(file['lastModified'])}."
+        return self.list_files(self.by_modified[:count], lambda file: format_time(file['lastModified']))
+
+    def answer_oldest(self, text):
+        count = parse_count(text)
+        oldest = self.by_modified[-count:][::-1]
+        if count == 1:
+            return f"{oldest[0]['name']}, which was last updated on {format_time(oldest[0]['lastModified'])}."
+        return self.list_files(oldest, lambda file: format_time(file['lastModified']))
+
+    def answer_largest(self, text):
+        count = parse_count(text)
+        if count == 1:
+            file = self.by_size[0]
+            return f"{file['name']} ({file['path']}), at {format_size(file['size'])}."
+        return self.list_files(self.by_size[:count], lambda file: format_size(file['size']))
+
+    def answer_smallest(self, text):
+        count = parse_count(text)
+        smallest = self.by_size[-count:][::-1]
+        if count == 1:
+            return f"{smallest[0]['name']} ({smallest[0]['path']}), at {format_size(smallest[0]['size'])}."
+        return self.list_files(smallest, lambda file: format_size(file['size']))
+
+    def answer_path(self, text, name):
+        paths = self.paths_by_name.get(name)
+        if not paths:
+            # not a file name we know, maybe it's a function or something else. Let the model have a go.
+            return None
+        return "\n".join(paths[:MAX_LISTED])
+
+    def answer_count(self, text, kind=None):
+        if kind is None or kind in ("the", "all"):
+            return f"{len(self.files)} files."
+        extension = LANGUAGE_EXTENSIONS.get(kind) or (kind if kind.startswith('.') else '.' + kind)
+        if extension not in self.extension_counts:
+            return None
+        return f"{self.extension_counts[extension]} {extension} files."
+
+    def answer_size(self, text, name):
+        if name in ("this folder", "this project", "this directory", "it", "folder", "project", "directory"):
+            name = '.'
+        folder = self.folders.get(name.removeprefix('./').strip('/') or '.')
+        if folder is not None:
+            return f"{format_size(folder['size'])} in {folder['files']} files, last updated on {format_time(folder['lastModified'])}."
+        paths = self.paths_by_name.get(name)
+        if paths and len(paths) == 1:
+            file = next(file for file in self.files if file["path"] == paths[0])
+            return f"{format_size(file['size'])}."
+        return None
+
+    def get_summary(self):
+        """
+        Returns a short text summary of the folder for a model's prompt: totals, file types,
+        and the most recently updated and largest files.
+        """
+        if not self.files:
+            return "The folder has no files."
+        extensions = sorted(self.extension_counts.items(), key=lambda item: item[1], reverse=True)[:10]
+        lines = [
+            f"{len(self.files)} files, {format_size(self.folders['.']['size'])} in total.",
+            "File types: " + ", ".join(f"{extension or 'no extension'} ({count})" for extension, count in extensions),
+            "Most recently updated: " + "; ".join(f"{file['path']} ({format_time(file['lastModified'])})" for file in self.by_modified[:SUMMARY_FILES]),
+            "Largest: " + "; ".join(f"{file['path']} ({format_size(file['size'])})" for file in self.by_size[:SUMMARY_FILES]),
+        ]
+        return "\n".join(lines)
+
+if __name__ == "__main__":
+    # Answers metadata questions about a folder, one per line of stdin
+    # allow running this file as a script from anywhere
+    sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+    from directory_utils.directory_scanner import read_dudeignore, get_directory_structure
+
+    folder = os.path.abspath(sys.argv[1] if len(sys.argv) > 1 else '.')
+    start = time.perf_counter()
+    index = MetadataIndex(get_directory_structure(folder, read_dudeignore(folder)))
+    print(f"indexed {len(index.files)} files in {time.perf_counter() - start:.2f} s", file=sys.stderr)
+    for line in sys.stdin:
+        start = time.perf_counter()
+        answer = index.answer(line)
+        elapsed = 1e6 * (time.perf_counter() - start)
+        print(f"{line.strip()}\n  -> {answer if answer is not None else '(left to the model)'} [{elapsed:.0f} us]")
@@ -0,0 +1,109 @@
+"""
+Local registry of the OpenAI resources DataDude created: the assistant's ID, and for each
+session its vector store ID and uploaded file IDs.
+
+Setup looks IDs up here and checks them with a single retrieve call, instead of listing
+every assistant, vector store and file in the account and matching names. The listings
+are only used on a miss (first run, a deleted resource, a registry from another machine),
+and what they find is written back here.
+
+The registry is a JSON file. Every update re-reads it, changes it and replaces it under an
+exclusive file lock, so several server processes can share it.
+"""
+
+import os
+import json
+import threading
+from functools import lru_cache
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:
+    # Windows: only threads of one process are kept from clobbering each other
+    fcntl = None
+
+REGISTRY_PATH = os.path.expanduser("~/.datadude/openai_resources.json")
+REGISTRY_VERSION = 1
+
+class ResourceRegistry:
+    """
+    Session ID -> OpenAI resource IDs, persisted to a JSON file. Safe to share between threads and processes.
+    """
+    def __init__(self, path=REGISTRY_PATH):
+        self.path = path
+        self.lock = threading.Lock()
+
+    @contextmanager
+    def locked(self):
+        """
+        Holds the registry's thread lock and, where available, an exclusive lock on its lock file.
+        """
+        with self.lock:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            with open(self.path + ".lock", 'a') as lock_file:
+                if fcntl:
+                    fcntl.flock(lock_file, fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    if fcntl:
+                        fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def load(self):
+        try:
+            with open(self.path, 'r') as file:
+                registry = json.load(file)
+        except (OSError, ValueError):
+            # no registry yet, or a corrupt one: every lookup misses and gets rebuilt
+            return {"version": REGISTRY_VERSION, "assistant_id": None, "sessions": {}}
+        if registry.get("version") != REGISTRY_VERSION:
+            return {"version": REGISTRY_VERSION, "assistant_id": None, "sessions": {}}
+        return registry
+
+    def save(self, registry):
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, 'w') as file:
+            json.dump(registry, file, indent=2)
+        os.replace(tmp_path, self.path)
+
+    def get_assistant_id(self):
+        with self.locked():
+            return self.load().get("assistant_id")
+
+    def set_assistant_id(self, assistant_id):
+        with self.locked():
+            registry = self.load()
+            registry["assistant_id"] = assistant_id
+            self.save(registry)
+
+    def get_session(self, sessionID):
+        """
+        Returns the session's resource IDs ({"vector_store_id": ..., "file_ids": [...]}), or None.
+        A key is missing until it's been set, which tells a lookup it has to rebuild that part.
+        """
+        with self.locked():
+            return self.load()["sessions"].get(sessionID)
+
+    def update_session(self, sessionID, **fields):
+        """
+        Sets the given fields of the session's record, creating it if needed.
+        """
+        with self.locked():
+            registry = self.load()
+            session = registry["sessions"].setdefault(sessionID, {})
+            session.update(fields)
+            self.save(registry)
+
+    def remove_session(self, sessionID):
+        with self.locked():
+            registry = self.load()
+            if registry["sessions"].pop(sessionID, None) is not None:
+                self.save(registry)
+
+@lru_cache(maxsize=None)
+def get_registry(path=REGISTRY_PATH):
+    """
+    Returns the process-wide ResourceRegistry.
+    """
+    return ResourceRegistry(path)
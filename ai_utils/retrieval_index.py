@@ -0,0 +1,303 @@
+"""
+Local BM25 retrieval over a session's files, for handlers that don't have a remote vector store.
+
+Each file's content is cut into chunks of CHUNK_LINES lines, and each chunk's terms
+(identifiers and words, with camelCase and snake_case names also split into their parts,
+plus the terms of the file's path) are counted. Those counts are kept per file, keyed by a
+hash of the file's content, and saved to disk, so updating the index after a rescan only
+re-tokenizes the files that changed.
+
+For searching, the counts are turned into BM25 weights in a sparse chunk x term matrix
+(scipy.sparse when NumPy and SciPy are installed, plain Python postings lists otherwise),
+and a query adds up the columns of its terms and takes the top k chunks.
+"""
+
+import os
+import re
+import sys
+import json
+import math
+import time
+import hashlib
+import argparse
+import threading
+from functools import lru_cache
+from collections import Counter
+
+try:
+    import numpy as np
+    from scipy import sparse
+except ImportError:
+    np = None
+    sparse = None
+
+RETRIEVAL_DIRECTORY = os.path.expanduser("~/.datadude/retrieval")
+INDEX_VERSION = 1
+CHUNK_LINES = 40
+DEFAULT_TOP_K = 8
+BM25_K1 = 1.2
+BM25_B = 0.75
+IDENTIFIER_PATTERN = re.compile(r"[A-Za-z_][A-Za-z0-9_]*|\d+")
+PART_PATTERN = re.compile(r"[A-Z]?[a-z]+|[A-Z]+(?![a-z])|\d+")
+STOP_WORDS = frozenset("a an and are as at be by for from has have in is it of on or that the this to was were will with".split())
+
+@lru_cache(maxsize=1 << 16)
+def get_word_terms(word):
+    """
+    Returns the search terms of one identifier or word: itself in lowercase, plus the parts of a compound name.
+    """
+    terms = []
+    lower = word.lower()
+    if len(lower) > 1 and lower not in STOP_WORDS:
+        terms.append(lower)
+    parts = PART_PATTERN.findall(word)
+    if len(parts) > 1:
+        terms.extend(part.lower() for part in parts if len(part) > 1 and part.lower() not in STOP_WORDS)
+    return tuple(terms)
+
+def tokenize(text):
+    """
+    Returns the search terms in text.
+    """
+    return [term for word in IDENTIFIER_PATTERN.findall(text) for term in get_word_terms(word)]
+
+def count_terms(text, counts):
+    """
+    Adds the counts of the search terms in text to counts (a Counter).
+    Each distinct word is only split once, which is most of the cost of indexing.
+    """
+    for word, count in Counter(IDENTIFIER_PATTERN.findall(text)).items():
+        for term in get_word_terms(word):
+            counts[term] += count
+
+def chunk_file(record):
+    """
+    Returns a file record's chunks as [start_line, end_line, term_count, {term: count}] lists.
+    Files without content get a single chunk of their path's terms, so they can still be found by name.
+    """
+    path_terms = tokenize(record["path"])
+    content = record.get("content")
+    if not content:
+        counts = Counter(path_terms)
+        return [[0, 0, sum(counts.values()), dict(counts)]]
+    lines = content.split('\n')
+    chunks = []
+    for start in range(0, len(lines), CHUNK_LINES):
+        counts = Counter(path_terms)
+        count_terms('\n'.join(lines[start:start + CHUNK_LINES]), counts)
+        chunks.append([start + 1, min(start + CHUNK_LINES, len(lines)), sum(counts.values()), dict(counts)])
+    return chunks
+
+def file_hash(record):
+    return hashlib.sha256(record.get("content", "").encode('utf-8', errors='surrogatepass')).hexdigest()
+
+def get_index_path(sessionID):
+    return os.path.join(RETRIEVAL_DIRECTORY, sessionID + ".json")
+
+class RetrievalIndex:
+    """
+    BM25 index over file chunks. Safe to share between threads.
+    """
+    def __init__(self, path=None):
+        self.path = path
+        self.files = {} # file path -> {"hash": content hash, "chunks": [[start, end, length, {term: count}], ...]}
+        self.lock = threading.Lock()
+        self.searcher = None # built on the first search after a change
+        self.dirty = False
+        if path:
+            self.load()
+
+    def load(self):
+        try:
+            with open(self.path, 'r') as file:
+                saved = json.load(file)
+        except (OSError, ValueError):
+            # no index yet, or a corrupt one: start over
+            return
+        if saved.get("version") == INDEX_VERSION:
+            self.files = saved.get("files", {})
+
+    def save(self):
+        """
+        Writes the index to disk if it changed since it was loaded.
+        """
+        with self.lock:
+            if not self.path or not self.dirty:
+                return
+            files = dict(self.files)
+            self.dirty = False
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, 'w') as file:
+            json.dump({"version": INDEX_VERSION, "files": files}, file)
+        os.replace(tmp_path, self.path)
+
+    def update(self, files):
+        """
+        Brings the index in line with a list of file records: changed and new files are
+        re-chunked, and files that are gone are dropped. Returns the number of files re-chunked.
+        """
+        seen = set()
+        changed = 0
+        for record in files:
+            path = record["path"]
+            seen.add(path)
+            content_hash = file_hash(record)
+            entry = self.files.get(path)
+            if entry is not None and entry["hash"] == content_hash:
+                continue
+            chunks = chunk_file(record)
+            with self.lock:
+                self.files[path] = {"hash": content_hash, "chunks": chunks}
+            changed += 1
+        with self.lock:
+            deleted = [path for path in self.files if path not in seen]
+            for path in deleted:
+                del self.files[path]
+            if changed or deleted:
+                self.searcher = None
+                self.dirty = True
+        return changed
+
+    def get_searcher(self):
+        with self.lock:
+            if self.searcher is None:
+                self.searcher = build_searcher(self.files)
+            return self.searcher
+
+    def search(self, query, k=DEFAULT_TOP_K):
+        """
+        Returns the k best chunks for query as (score, path, start_line, end_line), best first.
+        """
+        return self.get_searcher().search(query, k)
+
+class SparseSearcher:
+    """
+    Scores queries with a scipy.sparse chunk x term matrix of BM25 weights.
+    """
+    def __init__(self, chunk_ids, vocabulary, lengths, row_sizes, columns, counts):
+        self.chunk_ids = chunk_ids
+        self.vocabulary = vocabulary
+        lengths = np.asarray(lengths, dtype=np.float32)
+        rows = np.repeat(np.arange(len(chunk_ids)), row_sizes)
+        counts = np.asarray(counts, dtype=np.float32)
+        average_length = max(float(lengths.mean()) if len(lengths) else 1.0, 1.0)
+        weights = counts * (BM25_K1 + 1) / (counts + BM25_K1 * (1 - BM25_B + BM25_B * lengths[rows] / average_length))
+        matrix = sparse.csc_matrix((weights, (rows, np.asarray(columns))), shape=(len(chunk_ids), len(vocabulary)))
+        document_frequency = np.diff(matrix.indptr)
+        self.idf = np.log(1 + (len(chunk_ids) - document_frequency + 0.5) / (document_frequency + 0.5)).astype(np.float32)
+        self.matrix = matrix
+
+    def search(self, query, k):
+        term_ids = [self.vocabulary[term] for term in set(tokenize(query)) if term in self.vocabulary]
+        if not term_ids or not self.chunk_ids:
+            return []
+        scores = np.asarray(self.matrix[:, term_ids] @ self.idf[term_ids]).ravel()
+        k = min(k, len(scores))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [(float(scores[i]),) + self.chunk_ids[i] for i in top if scores[i] > 0]
+
+class PostingsSearcher:
+    """
+    Scores queries with plain Python postings lists. Used when NumPy/SciPy aren't installed.
+    """
+    def __init__(self, chunk_ids, vocabulary, lengths, row_sizes, columns, counts):
+        self.chunk_ids = chunk_ids
+        self.vocabulary = vocabulary
+        self.postings = [[] for _ in vocabulary]
+        average_length = max(sum(lengths) / len(lengths) if lengths else 1.0, 1.0)
+        i = 0
+        for row, size in enumerate(row_sizes):
+            norm = BM25_K1 * (1 - BM25_B + BM25_B * lengths[row] / average_length)
+            for column, count in zip(columns[i:i + size], counts[i:i + size]):
+                self.postings[column].append((row, count * (BM25_K1 + 1) / (count + norm)))
+            i += size
+        self.idf = [math.log(1 + (len(chunk_ids) - len(postings) + 0.5) / (len(postings) + 0.5)) for postings in self.postings]
+
+    def search(self, query, k):
+        scores = {}
+        for term in set(tokenize(query)):
+            term_id = self.vocabulary.get(term)
+            if term_id is None:
+                continue
+            idf = self.idf[term_id]
+            for row, weight in self.postings[term_id]:
+                scores[row] = scores.get(row, 0.0) + weight * idf
+        top = sorted(scores.items(), key=lambda item: item[1], reverse=True)[:k]
+        return [(score,) + self.chunk_ids[row] for row, score in top]
+
+def build_searcher(files):
+    """
+    Flattens the per-file term counts (chunk by chunk) and returns a searcher over them.
+    """
+    chunk_ids = []
+    lengths = []
+    row_sizes = []
+    columns = []
+    counts = []
+    vocabulary = {}
+    for path, entry in files.items():
+        for start, end, length, term_counts in entry["chunks"]:
+            chunk_ids.append((path, start, end))
+            lengths.append(length)
+            row_sizes.append(len(term_counts))
+            columns.extend([vocabulary.setdefault(term, len(vocabulary)) for term in term_counts])
+            counts.extend(term_counts.values())
+    searcher_class = SparseSearcher if sparse is not None else PostingsSearcher
+    return searcher_class(chunk_ids, vocabulary, lengths, row_sizes, columns, counts)
+
+def get_excerpt(record, start, end):
+    """
+    Returns lines start to end (1-based, inclusive) of a file record's content.
+    """
+    content = record.get("content")
+    if not content:
+        return ""
+    return '\n'.join(content.split('\n')[start - 1:end])
+
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+def get_index(sessionID):
+    """
+    Returns the process-wide RetrievalIndex of a session, loaded from disk the first time.
+    """
+    with _indexes_lock:
+        if sessionID not in _indexes:
+            _indexes[sessionID] = RetrievalIndex(get_index_path(sessionID))
+        return _indexes[sessionID]
+
+def release_index(sessionID):
+    """
+    Forgets a session's index. The next get_index() loads it from disk again.
+    """
+    with _indexes_lock:
+        _indexes.pop(sessionID, None)
+
+if __name__ == "__main__":
+    # Indexes a folder and prints the best chunks for a query, with timings
+    parser = argparse.ArgumentParser(description="Search a folder's files with the local BM25 index")
+    parser.add_argument('folder', type=str, help='Folder to index')
+    parser.add_argument('query', type=str, help='What to search for')
+    parser.add_argument('-k', type=int, default=DEFAULT_TOP_K, help='Number of chunks to show')
+    parser.add_argument('--index', type=str, default=None, help='Where to keep the index (default: not saved)')
+    args = parser.parse_args()
+
+    # allow running this file as a script from anywhere
+    sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+    from directory_utils.directory_scanner import read_dudeignore, get_directory_structure
+
+    folder = os.path.abspath(args.folder)
+    records = get_directory_structure(folder, read_dudeignore(folder))
+    index = RetrievalIndex(args.index)
+    start = time.perf_counter()
+    changed = index.update(records)
+    index.get_searcher()
+    print(f"indexed {changed} of {len(records)} files in {time.perf_counter() - start:.2f} s ({'scipy' if sparse is not None else 'python'} scoring)", file=sys.stderr)
+    index.save()
+    start = time.perf_counter()
+    results = index.search(args.query, args.k)
+    print(f"searched in {1000 * (time.perf_counter() - start):.1f} ms", file=sys.stderr)
+    for score, path, start_line, end_line in results:
+        print(f"{score:7.2f}  {path}:{start_line}-{end_line}")
@@ -0,0 +1,335 @@
+"""
+Waits for Assistants API runs to finish.
+
+Runs are polled with exponential backoff and jitter: the first check comes quickly, since
+short answers are often done in well under a second, and the interval then grows so long
+runs don't spend the rate limit on status checks. Streamed runs aren't polled at all: a
+watchdog cancels them once they're past their deadline, which ends the stream even while
+it's waiting for the next event. Every wait has a deadline, and can be cancelled; either
+way the run is cancelled on OpenAI's side too. Runs that stop in a state
+we can't continue from (requires_action, failed, expired, ...) raise RunError instead of
+being read as if they had completed.
+
+Each finished wait is recorded (wait time, number of polls, final status), and timed as the
+run_wait stage for /metrics. get_run_stats() returns totals over the recent runs for /stats.
+"""
+
+import time
+import random
+import asyncio
+import threading
+from collections import deque
+from network_utils.metrics import stage_seconds
+from network_utils import tracing
+
+INITIAL_POLL_INTERVAL = 0.15 # seconds
+MAX_POLL_INTERVAL = 2.0
+BACKOFF_FACTOR = 1.5
+DEFAULT_RUN_TIMEOUT = 300 # seconds
+ACTIVE_STATUSES = ("queued", "in_progress", "cancelling")
+STATS_HISTORY = 1000 # runs kept for get_run_stats()
+WATCH_INTERVAL = 0.25 # seconds between the watchdog's checks of a streamed run
+STREAM_READ_TIMEOUT = 60 # seconds a run stream may go without sending anything, in case cancelling doesn't end it
+
+class RunError(Exception):
+    """
+    Raised when a run ends in any status other than completed.
+    run is None if the run stream ended before saying which run it was.
+    """
+    no_run_status = "failed"
+
+    def __init__(self, run, message=None):
+        self.run = run
+        self.status = run.status if run is not None else self.no_run_status
+        error = getattr(run, "last_error", None)
+        if message is None:
+            message = f"Run {run.id} ended with status {run.status}"
+            if error:
+                message += f": {error.message}"
+        super().__init__(message)
+
+class RunTimeoutError(RunError):
+    """
+    Raised when a run doesn't finish before its deadline. The run is cancelled.
+    """
+    no_run_status = "expired"
+
+class RunCancelledError(RunError):
+    """
+    Raised when the wait is cancelled by the caller. The run is cancelled.
+    """
+    no_run_status = "cancelled"
+
+run_stats = deque(maxlen=STATS_HISTORY)
+run_stats_lock = threading.Lock()
+
+def record_run(run, wait_time, polls, streamed=False):
+    """
+    Records a finished wait and returns its stats record.
+    """
+    record = {"run_id": run.id, "status": run.status, "wait_time": wait_time, "polls": polls, "streamed": streamed}
+    stage_seconds.observe(wait_time, stage="run_wait")
+    tracing.record_span("run_wait", wait_time, run_id=run.id, status=run.status, polls=polls, streamed=streamed)
+    with run_stats_lock:
+        run_stats.append(record)
+    return record
+
+def get_run_stats():
+    """
+    Returns totals over the recently recorded runs: count, mean and max wait time, mean polls per run.
+    """
+    with run_stats_lock:
+        records = list(run_stats)
+    if not records:
+        return {"runs": 0, "mean_wait_time": 0.0, "max_wait_time": 0.0, "mean_polls": 0.0, "failed": 0}
+    return {
+        "runs": len(records),
+        "mean_wait_time": sum(record["wait_time"] for record in records) / len(records),
+        "max_wait_time": max(record["wait_time"] for record in records),
+        "mean_polls": sum(record["polls"] for record in records) / len(records),
+        "failed": sum(1 for record in records if record["status"] != "completed"),
+    }
+
+def iter_poll_delays(initial=INITIAL_POLL_INTERVAL, maximum=MAX_POLL_INTERVAL, factor=BACKOFF_FACTOR):
+    """
+    Generator of delays between polls: exponential backoff up to maximum, with jitter so
+    many runs started together don't poll in lockstep.
+    """
+    delay = initial
+    while True:
+        yield delay * random.uniform(0.75, 1.25)
+        delay = min(delay * factor, maximum)
+
+def is_run_event(event):
+    """
+    Returns True for run stream events that carry the run itself (thread.run.*, not run steps).
+    """
+    return event.event.startswith("thread.run.") and not event.event.startswith("thread.run.step.")
+
+def check_final_run(run):
+    """
+    Returns the run if it completed, otherwise raises RunError.
+    """
+    if run.status != "completed":
+        raise RunError(run)
+    return run
+
+def wait_for_run(client, run, timeout=DEFAULT_RUN_TIMEOUT, cancel_event: threading.Event = None):
+    """
+    Polls a run until it leaves the queued/in_progress states and returns the final run.
+    Raises RunTimeoutError after timeout seconds, RunCancelledError if cancel_event is set,
+    and RunError if the run didn't complete.
+    """
+    start = time.monotonic()
+    deadline = start + timeout
+    polls = 0
+    try:
+        for delay in iter_poll_delays():
+            if run.status not in ACTIVE_STATUSES:
+                break
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                cancel_run(client, run)
+                raise RunTimeoutError(run, f"Run {run.id} didn't finish within {timeout} seconds")
+            # Event.wait doubles as the sleep, so a cancel is noticed right away
+            if cancel_event is not None and cancel_event.wait(min(delay, remaining)):
+                cancel_run(client, run)
+                raise RunCancelledError(run, f"Run {run.id} was cancelled")
+            if cancel_event is None:
+                time.sleep(min(delay, remaining))
+            run = client.beta.threads.runs.retrieve(thread_id=run.thread_id, run_id=run.id)
+            polls += 1
+    finally:
+        record_run(run, time.monotonic() - start, polls)
+    if run.status == "requires_action":
+        # DataDude's assistant has no function tools to answer with, so the run can't go on
+        cancel_run(client, run)
+    return check_final_run(run)
+
+async def sleep_unless_cancelled(seconds, cancel_event: threading.Event = None):
+    """
+    Sleeps for seconds, checking cancel_event every WATCH_INTERVAL. Returns True if it was set.
+    """
+    if cancel_event is None:
+        await asyncio.sleep(seconds)
+        return False
+    end = time.monotonic() + seconds
+    while not cancel_event.is_set():
+        remaining = end - time.monotonic()
+        if remaining <= 0:
+            return False
+        await asyncio.sleep(min(remaining, WATCH_INTERVAL))
+    return True
+
+async def wait_for_run_async(client, run, timeout=DEFAULT_RUN_TIMEOUT, cancel_event: threading.Event = None):
+    """
+    Async version of wait_for_run for an AsyncOpenAI client.
+    Cancelling the awaiting task cancels the run, like setting cancel_event does.
+    """
+    start = time.monotonic()
+    deadline = start + timeout
+    polls = 0
+    try:
+        for delay in iter_poll_delays():
+            if run.status not in ACTIVE_STATUSES:
+                break
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                await cancel_run_async(client, run)
+                raise RunTimeoutError(run, f"Run {run.id} didn't finish within {timeout} seconds")
+            try:
+                cancelled = await sleep_unless_cancelled(min(delay, remaining), cancel_event)
+            except asyncio.CancelledError:
+                await cancel_run_async(client, run)
+                raise
+            if cancelled:
+                await cancel_run_async(client, run)
+                raise RunCancelledError(run, f"Run {run.id} was cancelled")
+            run = await client.beta.threads.runs.retrieve(thread_id=run.thread_id, run_id=run.id)
+            polls += 1
+    finally:
+        record_run(run, time.monotonic() - start, polls)
+    if run.status == "requires_action":
+        await cancel_run_async(client, run)
+    return check_final_run(run)
+
+class RunWatchdog:
+    """
+    Watches a streamed run from beside the loop reading its events, and cancels the run on
+    OpenAI's side once it's past its deadline or cancel_event is set. OpenAI then ends the
+    stream, even if it was stalled. fired says why it did ("timeout" or "cancelled"), or is None.
+    """
+    def __init__(self, deadline, cancel_event: threading.Event = None):
+        self.deadline = deadline
+        self.cancel_event = cancel_event
+        self.run = None # kept up to date by the loop reading the stream
+        self.fired = None
+        self.done = threading.Event()
+
+    def check(self):
+        if time.monotonic() >= self.deadline:
+            self.fired = "timeout"
+        elif self.cancel_event is not None and self.cancel_event.is_set():
+            self.fired = "cancelled"
+        return self.fired
+
+    def watch(self, client):
+        """
+        Runs on its own thread until stop() is called.
+        """
+        while not self.check():
+            if self.done.wait(WATCH_INTERVAL):
+                return
+        # the run may not have been created yet
+        while self.run is None:
+            if self.done.wait(WATCH_INTERVAL):
+                return
+        if self.run.status in ACTIVE_STATUSES:
+            cancel_run(client, self.run)
+
+    async def watch_async(self, client):
+        """
+        Runs as its own task until it's cancelled.
+        """
+        while not self.check():
+            await asyncio.sleep(WATCH_INTERVAL)
+        while self.run is None:
+            await asyncio.sleep(WATCH_INTERVAL)
+        if self.run.status in ACTIVE_STATUSES:
+            await cancel_run_async(client, self.run)
+
+    def stop(self):
+        self.done.set()
+
+    def raise_if_fired(self, run, timeout):
+        """
+        Raises RunTimeoutError or RunCancelledError if the watchdog cut the run short.
+        """
+        if self.fired is None or (run is not None and run.status == "completed"):
+            return
+        run_name = f"Run {run.id}" if run is not None else "The run"
+        if self.fired == "timeout":
+            raise RunTimeoutError(run, f"{run_name} didn't finish within {timeout} seconds")
+        raise RunCancelledError(run, f"{run_name} was cancelled")
+
+def iter_run_events(client, timeout=DEFAULT_RUN_TIMEOUT, cancel_event: threading.Event = None, **run_params):
+    """
+    Generator that starts a run with the streaming API and yields its events as they arrive,
+    so there's no polling at all. run_params are passed to runs.stream (thread_id, assistant_id, ...).
+    Raises like wait_for_run once the run is over. Closing the generator early cancels the run.
+    """
+    start = time.monotonic()
+    run = None
+    watchdog = RunWatchdog(start + timeout, cancel_event)
+    threading.Thread(target=watchdog.watch, args=(client,), daemon=True).start()
+    try:
+        with client.beta.threads.runs.stream(timeout=STREAM_READ_TIMEOUT, **run_params) as stream:
+            for event in stream:
+                if is_run_event(event):
+                    run = watchdog.run = event.data
+                yield event
+    except GeneratorExit:
+        if run is not None and run.status in ACTIVE_STATUSES:
+            cancel_run(client, run)
+        raise
+    except Exception:
+        # a stream the watchdog cut short may end with a read error
+        if watchdog.fired is None:
+            raise
+    finally:
+        watchdog.stop()
+        if run is not None:
+            record_run(run, time.monotonic() - start, 0, streamed=True)
+    watchdog.raise_if_fired(run, timeout)
+    if run is None:
+        raise RuntimeError("The run stream ended without any run events")
+    if run.status == "requires_action":
+        cancel_run(client, run)
+    check_final_run(run)
+
+async def iter_run_events_async(client, timeout=DEFAULT_RUN_TIMEOUT, cancel_event: threading.Event = None, **run_params):
+    """
+    Async version of iter_run_events for an AsyncOpenAI client.
+    """
+    start = time.monotonic()
+    run = None
+    watchdog = RunWatchdog(start + timeout, cancel_event)
+    watcher = asyncio.ensure_future(watchdog.watch_async(client))
+    try:
+        async with client.beta.threads.runs.stream(timeout=STREAM_READ_TIMEOUT, **run_params) as stream:
+            async for event in stream:
+                if is_run_event(event):
+                    run = watchdog.run = event.data
+                yield event
+    except (GeneratorExit, asyncio.CancelledError):
+        if run is not None and run.status in ACTIVE_STATUSES:
+            await asyncio.shield(cancel_run_async(client, run))
+        raise
+    except Exception:
+        if watchdog.fired is None:
+            raise
+    finally:
+        watcher.cancel()
+        if run is not None:
+            record_run(run, time.monotonic() - start, 0, streamed=True)
+    watchdog.raise_if_fired(run, timeout)
+    if run is None:
+        raise RuntimeError("The run stream ended without any run events")
+    if run.status == "requires_action":
+        await cancel_run_async(client, run)
+    check_final_run(run)
+
+def cancel_run(client, run):
+    """
+    Asks OpenAI to cancel the run. Errors are ignored, the run may have just finished.
+    """
+    try:
+        client.beta.threads.runs.cancel(thread_id=run.thread_id, run_id=run.id)
+    except Exception as e:
+        print(f"run_waiter.py: Warning: failed to cancel run {run.id}: {e}")
+
+async def cancel_run_async(client, run):
+    try:
+        await client.beta.threads.runs.cancel(thread_id=run.thread_id, run_id=run.id)
+    except Exception as e:
+        print(f"run_waiter.py: Warning: failed to cancel run {run.id}: {e}")
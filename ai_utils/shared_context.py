@@ -0,0 +1,110 @@
+"""
+Session context shared by all threads of a session.
+
+Uploading a session's context (the vector store and its files) is the slow part of setting
+up a thread, and every thread of a session needs the same thing. The server keeps one
+SharedContext per session, keyed by a hash of the context it was built from. A thread that
+opens the same context as a live one just takes a reference to it. Concurrent setups of the
+same context are single-flight: the first one builds it, the others wait for it and share
+the result. When the context changes, the next setup builds a new one, and threads still
+holding the old one keep it until they're done.
+"""
+
+import asyncio
+import threading
+
+class SharedContext:
+    """
+    One session's uploaded context. resources holds whatever the builder returned.
+    """
+    def __init__(self, key, context_hash):
+        self.key = key
+        self.context_hash = context_hash
+        self.refs = 0
+        self.resources = None
+        self.error = None
+        self.ready = threading.Event()
+
+class SharedContextPool:
+    """
+    Reference-counted SharedContexts, at most one live one per key. Safe to share between threads.
+    """
+    def __init__(self):
+        self.contexts = {}
+        self.lock = threading.Lock()
+
+    def claim(self, key, context_hash):
+        """
+        Takes a reference to the key's context for context_hash, making a new (empty) one if needed.
+        Returns (context, is_builder). The builder must call finish() when it's done.
+        """
+        with self.lock:
+            context = self.contexts.get(key)
+            if context is not None and context.context_hash == context_hash and context.error is None:
+                context.refs += 1
+                return context, False
+            context = SharedContext(key, context_hash)
+            context.refs = 1
+            self.contexts[key] = context
+            return context, True
+
+    def finish(self, context, resources=None, error=None):
+        """
+        Stores the builder's result and wakes up the threads waiting on the context.
+        """
+        context.resources = resources
+        context.error = error
+        if error is not None:
+            with self.lock:
+                if self.contexts.get(context.key) is context:
+                    del self.contexts[context.key]
+        context.ready.set()
+
+    def acquire(self, key, context_hash, build):
+        """
+        Returns the key's context for context_hash, calling build() to make its resources
+        if there isn't one yet or being built. Raises whatever build raised.
+        """
+        context, is_builder = self.claim(key, context_hash)
+        if is_builder:
+            try:
+                self.finish(context, build())
+            except BaseException as e:
+                self.finish(context, error=e)
+        context.ready.wait()
+        if context.error is not None:
+            self.release(context)
+            raise context.error
+        return context
+
+    async def acquire_async(self, key, context_hash, build):
+        """
+        Async version of acquire. build is a coroutine function.
+        """
+        context, is_builder = self.claim(key, context_hash)
+        if is_builder:
+            try:
+                self.finish(context, await build())
+            except BaseException as e:
+                self.finish(context, error=e)
+        if not context.ready.is_set():
+            await asyncio.get_running_loop().run_in_executor(None, context.ready.wait)
+        if context.error is not None:
+            self.release(context)
+            raise context.error
+        return context
+
+    def release(self, context):
+        """
+        Drops a reference. The context is forgotten when the last one is gone.
+        """
+        with self.lock:
+            context.refs -= 1
+            if context.refs <= 0 and self.contexts.get(context.key) is context:
+                del self.contexts[context.key]
+
+    def get_stats(self):
+        with self.lock:
+            return {"contexts": len(self.contexts), "refs": sum(context.refs for context in self.contexts.values())}
+
+shared_contexts = SharedContextPool()
@@ -0,0 +1,196 @@
+"""
+Answers "where is X defined" questions from the symbol tables of a session's files.
+
+The scanner (with --symbols) adds each source file's definitions and imports to its record.
+SymbolIndex gathers them into name -> definitions and name -> imports lookups, so
+definition, reference and import questions are answered without asking the model. Records
+that came without symbols are parsed here instead.
+
+For questions it doesn't answer itself, get_excerpts() returns the code of the functions
+and classes the question names, so the model gets the exact lines instead of searching for them.
+"""
+
+import os
+import re
+import sys
+import time
+
+# allow running this file as a script from anywhere
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from directory_utils.symbol_table import extract_symbols
+
+MAX_QUESTION_WORDS = 14
+MAX_LISTED = 30 # most definitions or references listed in one answer
+MAX_ANSWER_LINES = 30 # a single definition's code is included in the answer up to this long
+MAX_EXCERPT_SYMBOLS = 3
+MAX_EXCERPT_LINES = 80
+MAX_DEFINITIONS_PER_EXCERPT = 2 # names defined in more places than this are too ambiguous to send
+NAME = r"`?([A-Za-z_$][\w$.]*?)`?(?:\(\))?"
+KIND = r"(?:function|class|method|variable|constant)"
+IDENTIFIER_PATTERN = re.compile(r"[A-Za-z_$][\w$]*(?:\.[A-Za-z_$][\w$]*)*")
+# plain words that happen to be defined somewhere shouldn't pull in excerpts
+COMMON_WORDS = frozenset("""a an and are as at be by can do does for from get has have how i in is it of on or set
+    the this to use used what when where which who why with you main run test file files data code""".split())
+
+def get_import_keys(module, name):
+    """
+    Returns the names an import can be looked up by: the module, its last part, and the imported name.
+    """
+    if '/' in module:
+        # a JavaScript or shell path: "./utils/api.js" -> "api"
+        last = os.path.splitext(module.rstrip('/').split('/')[-1])[0]
+    else:
+        # a Python module: "network_utils.event_stream" -> "event_stream"
+        last = module.split('.')[-1]
+    return {key for key in (module, last, name) if key}
+
+class SymbolIndex:
+    """
+    Definition and import lookups over a list of file records.
+    """
+    def __init__(self, files):
+        self.definitions = {} # name -> [(path, kind, line, end_line), ...]
+        self.imports = {} # module or imported name -> [(path, line), ...]
+        self.contents = {} # path -> content, for files whose line numbers can be trusted
+        for record in files:
+            symbols = record.get("symbols") or extract_symbols(record)
+            if symbols is None:
+                continue
+            path = record["path"]
+            if record.get("content") and not record.get("contentStatus"):
+                self.contents[path] = record["content"]
+            for name, kind, line, end_line in symbols["definitions"]:
+                self.definitions.setdefault(name, []).append((path, kind, line, end_line))
+            for module, name, line in symbols["imports"]:
+                for key in get_import_keys(module, name):
+                    self.imports.setdefault(key, []).append((path, line))
+        self.lower_names = {}
+        for name in self.definitions:
+            self.lower_names.setdefault(name.lower(), name)
+        self.questions = [
+            (re.compile(rf"^where(?: is|'s| are) (?:the )?(?:{KIND} )?{NAME}(?: {KIND})? (?:used|called|referenced)$", re.I), self.answer_references),
+            (re.compile(rf"^(?:what|who|which files?) (?:calls|uses|references) (?:the )?(?:{KIND} )?{NAME}$", re.I), self.answer_references),
+            (re.compile(rf"^(?:find|show me|list) (?:all )?(?:the )?(?:references|usages|uses|calls) (?:to|of) (?:the )?(?:{KIND} )?{NAME}$", re.I), self.answer_references),
+            (re.compile(rf"^where(?: is|'s| are) (?:the )?(?:module )?{NAME} imported$", re.I), self.answer_imports),
+            (re.compile(rf"^(?:what|which files?) imports? (?:the )?(?:module )?{NAME}$", re.I), self.answer_imports),
+            (re.compile(rf"^where(?: is|'s| are) (?:the )?(?:{KIND} )?{NAME}(?: {KIND})?(?: (?:defined|declared|implemented))?$", re.I), self.answer_definition),
+            (re.compile(rf"^(?:which|what) file (?:defines|has|contains|declares) (?:the )?(?:{KIND} )?{NAME}$", re.I), self.answer_definition),
+            (re.compile(rf"^(?:find|show me|go to) (?:the )?definition of (?:the )?(?:{KIND} )?{NAME}$", re.I), self.answer_definition),
+            (re.compile(rf"^where do (?:i|we|you) define (?:the )?(?:{KIND} )?{NAME}$", re.I), self.answer_definition),
+        ]
+
+    def find_definitions(self, name):
+        """
+        Returns the definitions of a name (the last part of a dotted name), matching case only if it has to.
+        """
+        name = name.split('.')[-1]
+        if name not in self.definitions:
+            name = self.lower_names.get(name.lower(), name)
+        return name, self.definitions.get(name, [])
+
+    def answer(self, question):
+        """
+        Returns the answer to a recognized symbol question, or None.
+        """
+        text = re.sub(r"\s+", " ", question.strip()).rstrip('?!. ')
+        if not text or len(text.split()) > MAX_QUESTION_WORDS or not self.definitions:
+            return None
+        for pattern, answer in self.questions:
+            match = pattern.search(text)
+            if match:
+                return answer(match.group(1))
+        return None
+
+    def get_code(self, path, line, end_line, max_lines):
+        content = self.contents.get(path)
+        if content is None:
+            return None
+        lines = content.split('\n')[line - 1:min(end_line, line + max_lines - 1)]
+        if end_line - line + 1 > max_lines:
+            lines.append(f"... ({end_line - line + 1 - max_lines} more lines)")
+        return '\n'.join(lines)
+
+    def answer_definition(self, name):
+        name, definitions = self.find_definitions(name)
+        if not definitions:
+            # not a name we know. Let the model have a go.
+            return None
+        if len(definitions) == 1:
+            path, kind, line, end_line = definitions[0]
+            answer = f"{name} is a {kind} defined in {path} at line {line}."
+            code = self.get_code(path, line, end_line, MAX_ANSWER_LINES)
+            return answer + (f"\n\n```\n{code}\n```" if code else "")
+        listed = "\n".join(f"{path}:{line} ({kind})" for path, kind, line, _ in definitions[:MAX_LISTED])
+        more = f"\n... and {len(definitions) - MAX_LISTED} more" if len(definitions) > MAX_LISTED else ""
+        return f"{name} is defined in {len(definitions)} places:\n{listed}{more}"
+
+    def answer_references(self, name):
+        name, definitions = self.find_definitions(name)
+        if not definitions:
+            return None
+        pattern = re.compile(rf"(?<![\w$]){re.escape(name)}(?![\w$])")
+        defined_at = {(path, line) for path, _, line, _ in definitions}
+        references = []
+        files = set()
+        for path, content in self.contents.items():
+            if name not in content:
+                continue
+            for line_number, line in enumerate(content.split('\n'), 1):
+                if (path, line_number) not in defined_at and pattern.search(line):
+                    references.append(f"{path}:{line_number}: {line.strip()[:120]}")
+                    files.add(path)
+        if not references:
+            return f"{name} isn't used anywhere outside its definition, as far as I can see."
+        listed = "\n".join(references[:MAX_LISTED])
+        more = f"\n... and {len(references) - MAX_LISTED} more" if len(references) > MAX_LISTED else ""
+        return f"{name} is used on {len(references)} lines in {len(files)} files:\n{listed}{more}"
+
+    def answer_imports(self, name):
+        imports = self.imports.get(name) or self.imports.get(name.split('.')[-1])
+        if not imports:
+            return None
+        listed = "\n".join(f"{path}:{line}" for path, line in imports[:MAX_LISTED])
+        more = f"\n... and {len(imports) - MAX_LISTED} more" if len(imports) > MAX_LISTED else ""
+        return f"{name} is imported in {len(imports)} places:\n{listed}{more}"
+
+    def get_excerpts(self, question):
+        """
+        Returns the code of the functions and classes named in the question (as one text for
+        the model, with their paths and line numbers), or None if it names none.
+        """
+        excerpts = []
+        seen = set()
+        for word in IDENTIFIER_PATTERN.findall(question):
+            name = word.split('.')[-1]
+            if name in seen or len(name) < 3 or name.lower() in COMMON_WORDS or name not in self.definitions:
+                continue
+            seen.add(name)
+            definitions = [definition for definition in self.definitions[name] if definition[1] != "variable"]
+            if not definitions or len(definitions) > MAX_DEFINITIONS_PER_EXCERPT:
+                continue
+            for path, kind, line, end_line in definitions:
+                code = self.get_code(path, line, end_line, MAX_EXCERPT_LINES)
+                if code:
+                    excerpts.append(f"{path} (lines {line}-{end_line}, {kind} {name}):\n{code}")
+            if len(seen) >= MAX_EXCERPT_SYMBOLS:
+                break
+        if not excerpts:
+            return None
+        return "Code of the functions and classes named in the question:\n\n" + "\n\n".join(excerpts)
+
+if __name__ == "__main__":
+    # Answers symbol questions about a folder, one per line of stdin
+    from directory_utils.directory_scanner import read_dudeignore, get_directory_structure
+
+    folder = os.path.abspath(sys.argv[1] if len(sys.argv) > 1 else '.')
+    start = time.perf_counter()
+    index = SymbolIndex(get_directory_structure(folder, read_dudeignore(folder), symbols=True))
+    print(f"indexed {len(index.definitions)} names in {time.perf_counter() - start:.2f} s", file=sys.stderr)
+    for line in sys.stdin:
+        start = time.perf_counter()
+        answer = index.answer(line)
+        if answer is None:
+            answer = index.get_excerpts(line)
+            answer = f"(left to the model, with excerpts)\n{answer}" if answer else "(left to the model)"
+        elapsed = 1e6 * (time.perf_counter() - start)
+        print(f"{line.strip()}\n  -> {answer} [{elapsed:.0f} us]")
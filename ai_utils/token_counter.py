@@ -1,15 +1,260 @@
+"""
+In-process token counting.
+The tiktoken encoding is built once per process and reused, and token counts of
+file records are memoized by content hash (and saved to disk), so only files that
+changed since the last count get re-tokenized.
+"""
+
+import os
 import sys
+import json
+import hashlib
+import argparse
+import threading
+from functools import lru_cache
 import tiktoken
 
-def count_tokens(text):
+DEFAULT_MODEL = "gpt-3.5-turbo"
+TOKEN_CACHE_PATH = os.path.expanduser("~/.datadude/token_counts.json")
+MAX_CACHE_ENTRIES = 500000 # oldest entries are dropped past this
+DEFAULT_THREADS = os.cpu_count() or 1
+BATCH_SIZE = 64 # texts per thread in each batch handed to tiktoken
+DEFAULT_TREE_DEPTH = 2
+# tokens added to each item of a JSON list counted on its own: one for the ", " between items, and
+# one for the tokens that can split differently where items meet than at the ends of an item alone
+ITEM_SEPARATOR_TOKENS = 2
+
+@lru_cache(maxsize=None)
+def get_encoding(model=DEFAULT_MODEL):
+    """
+    Returns the tiktoken encoding for a model. Built on first use, then shared by the whole process.
+    """
+    return tiktoken.encoding_for_model(model)
+
+def count_tokens(text, model=DEFAULT_MODEL):
     """
     Counts the number of tokens in a given text using tiktoken library.
+    Special tokens like <|endoftext|> in the text are counted as plain text.
     """
-    enc = tiktoken.encoding_for_model("gpt-3.5-turbo")
-    tokens = enc.encode(text)
+    enc = get_encoding(model)
+    tokens = enc.encode(text, disallowed_special=())
     return len(tokens)
 
+class TokenCountCache:
+    """
+    Token counts keyed by the sha256 of the counted text, for one model.
+    Safe to share between threads. Call save() to persist new counts.
+    """
+    def __init__(self, path=TOKEN_CACHE_PATH, model=DEFAULT_MODEL):
+        self.path = path
+        self.model = model
+        self.counts = {}
+        self.dirty = False
+        self.lock = threading.Lock()
+        if path:
+            self.load()
+
+    def load(self):
+        try:
+            with open(self.path, 'r') as file:
+                saved = json.load(file)
+        except (OSError, ValueError):
+            # no cache yet, or a corrupt one: start over
+            return
+        if saved.get("model") == self.model:
+            self.counts = saved.get("counts", {})
+
+    def save(self):
+        """
+        Writes the cache to disk if anything was added since it was loaded.
+        """
+        with self.lock:
+            if not self.path or not self.dirty:
+                return
+            if len(self.counts) > MAX_CACHE_ENTRIES:
+                # dicts keep insertion order, so this drops the oldest counts
+                self.counts = dict(list(self.counts.items())[-MAX_CACHE_ENTRIES:])
+            counts = dict(self.counts)
+            self.dirty = False
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, 'w') as file:
+            json.dump({"model": self.model, "counts": counts}, file)
+        os.replace(tmp_path, self.path)
+
+    def lookup(self, key):
+        return self.counts.get(key)
+
+    def store(self, key, token_count):
+        with self.lock:
+            self.counts[key] = token_count
+            self.dirty = True
+
+    def count(self, text):
+        """
+        Returns the token count of text, tokenizing it only if it hasn't been seen before.
+        """
+        key = hashlib.sha256(text.encode('utf-8', errors='surrogatepass')).hexdigest()
+        token_count = self.lookup(key)
+        if token_count is None:
+            token_count = count_tokens(text, self.model)
+            self.store(key, token_count)
+        return token_count
+
+    def record_key(self, record, metadata_json=None):
+        """
+        Returns the cache key for a scanned file record: a digest of its metadata and content,
+        so an unchanged file's content is hashed, not serialized and tokenized.
+        Records without content are keyed like any other text.
+        """
+        if metadata_json is None:
+            metadata_json = json.dumps({key: value for key, value in record.items() if key != "content"})
+        if "content" not in record:
+            return hashlib.sha256(metadata_json.encode('utf-8', errors='surrogatepass')).hexdigest()
+        digest = hashlib.sha256(metadata_json.encode('utf-8', errors='surrogatepass'))
+        digest.update(b"\0")
+        digest.update(record["content"].encode('utf-8', errors='surrogatepass'))
+        return "record:" + digest.hexdigest()
+
+    def count_record(self, record, metadata_json=None):
+        """
+        Returns the token count of json.dumps(record) for a scanned file record.
+        Pass metadata_json (json.dumps of the record without content) if the caller already has it.
+        """
+        key = self.record_key(record, metadata_json)
+        token_count = self.lookup(key)
+        if token_count is None:
+            token_count = count_tokens(json.dumps(record), self.model)
+            self.store(key, token_count)
+        return token_count
+
+@lru_cache(maxsize=None)
+def get_token_cache(path=TOKEN_CACHE_PATH, model=DEFAULT_MODEL):
+    """
+    Returns the process-wide TokenCountCache for a model.
+    """
+    return TokenCountCache(path, model)
+
+def count_json_tokens(body, list_key="files", cache=None):
+    """
+    Counts the tokens of json.dumps(body). Each item of body[list_key] (e.g. a scanned file record)
+    is counted separately through the cache, so unchanged files cost a hash instead of a re-tokenization.
+    Tokens can merge or split differently where items meet than at the ends of each item alone,
+    so ITEM_SEPARATOR_TOKENS per item are added to err on the high side.
+    """
+    if cache is None:
+        cache = get_token_cache()
+    if list_key not in body:
+        return count_tokens(json.dumps(body), cache.model)
+    items = body.get(list_key) or []
+    skeleton = dict(body)
+    skeleton[list_key] = []
+    token_count = count_tokens(json.dumps(skeleton), cache.model)
+    for item in items:
+        token_count += cache.count_record(item) + ITEM_SEPARATOR_TOKENS
+    return token_count
+
+def iter_batch_token_counts(items, model=DEFAULT_MODEL, num_threads=DEFAULT_THREADS, batch_size=BATCH_SIZE):
+    """
+    Generator that counts tokens of many texts in parallel.
+    Takes an iterable of (key, text) pairs and yields (key, token_count) a batch at a time.
+    Uses tiktoken's batch encoding, which runs on num_threads threads outside the GIL.
+    """
+    enc = get_encoding(model)
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) >= batch_size * num_threads:
+            token_lists = enc.encode_ordinary_batch([text for _, text in batch], num_threads=num_threads)
+            yield from ((key, len(tokens)) for (key, _), tokens in zip(batch, token_lists))
+            batch = []
+    if batch:
+        token_lists = enc.encode_ordinary_batch([text for _, text in batch], num_threads=num_threads)
+        yield from ((key, len(tokens)) for (key, _), tokens in zip(batch, token_lists))
+
+def iter_record_token_counts(records, cache=None, num_threads=DEFAULT_THREADS):
+    """
+    Generator that yields (path, token_count) for scanned file records, counting json.dumps(record)
+    like count_json_tokens does. Cached records are yielded right away, the rest are tokenized in
+    parallel batches and added to the cache, so the order isn't the order of records.
+    """
+    if cache is None:
+        cache = get_token_cache()
+    keys = {}
+
+    def uncached_records():
+        for record in records:
+            key = cache.record_key(record)
+            token_count = cache.lookup(key)
+            if token_count is not None:
+                cached.append((record["path"], token_count))
+                continue
+            keys[record["path"]] = key
+            yield record["path"], json.dumps(record)
+
+    cached = []
+    for path, token_count in iter_batch_token_counts(uncached_records(), cache.model, num_threads):
+        cache.store(keys.pop(path), token_count)
+        yield from cached
+        cached.clear()
+        yield path, token_count
+    yield from cached
+
+def get_directory_token_totals(root, path_counts, depth=DEFAULT_TREE_DEPTH):
+    """
+    Adds up (path, token_count) pairs per folder, down to depth folders below root.
+    Returns a dict of folder path (relative to root, '.' for root itself) to token count.
+    """
+    totals = {}
+    for path, token_count in path_counts:
+        parts = os.path.relpath(os.path.dirname(path), root).split(os.sep)
+        if parts == ['.']:
+            parts = []
+        totals['.'] = totals.get('.', 0) + token_count
+        for i in range(1, min(len(parts), depth) + 1):
+            folder = os.path.join(*parts[:i])
+            totals[folder] = totals.get(folder, 0) + token_count
+    return totals
+
+def print_directory_token_totals(totals, max_tokens=None):
+    """
+    Prints folder token totals as an indented tree, biggest folders first within each parent.
+    """
+    children = {}
+    for folder in totals:
+        if folder != '.':
+            children.setdefault(os.path.dirname(folder) or '.', []).append(folder)
+
+    def print_folder(folder, indent):
+        share = f" ({100 * totals[folder] / max_tokens:.1f}% of {max_tokens})" if max_tokens else ""
+        name = folder if folder == '.' else os.path.basename(folder) + '/'
+        print(f"{totals[folder]:>12}  {'  ' * indent}{name}{share}")
+        for child in sorted(children.get(folder, []), key=lambda child: totals[child], reverse=True):
+            print_folder(child, indent + 1)
+
+    if '.' in totals:
+        print_folder('.', 0)
+
 if __name__ == "__main__":
-    input_text = sys.stdin.read()
-    token_count = count_tokens(input_text)
-    print(token_count)
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Counts tokens of stdin, or of a scanned folder with --tree")
+    parser.add_argument('--tree', type=str, default=None, help='Scan this folder and print its tokens per subfolder')
+    parser.add_argument('--depth', type=int, default=DEFAULT_TREE_DEPTH, help='Folder levels to break down with --tree')
+    parser.add_argument('--threads', type=int, default=DEFAULT_THREADS, help='Tokenizer threads for --tree')
+    parser.add_argument('--max-tokens', type=int, default=None, help='Show each folder as a share of this limit')
+    args = parser.parse_args()
+
+    if args.tree is None:
+        input_text = sys.stdin.read()
+        token_count = count_tokens(input_text)
+        print(token_count)
+    else:
+        # allow running this file as a script from anywhere
+        sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+        from directory_utils.directory_scanner import read_dudeignore, iter_directory_structure
+
+        folder = os.path.abspath(args.tree)
+        records = iter_directory_structure(folder, read_dudeignore(folder))
+        cache = get_token_cache()
+        totals = get_directory_token_totals(folder, iter_record_token_counts(records, cache, args.threads), args.depth)
+        cache.save()
+        print_directory_token_totals(totals, args.max_tokens)
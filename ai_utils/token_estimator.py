@@ -0,0 +1,73 @@
+"""
+Fast token estimates, and a byte count check that spares the tokenizer for small texts.
+
+Instead of running the tokenizer, the estimator counts bytes by character class
+(letters, digits, whitespace, punctuation, non-ASCII) with bytes.translate, which runs
+at memory speed, and weighs each class by how many tokens a byte of it tends to cost.
+The weights below are rough defaults that haven't been fitted against the tokenizer, so
+the estimate is only good for reports like token_counter.py's, never for accepting a text
+under a limit. tests/benchmark_token_estimator.py measures its error over real source
+trees and prints least squares weights to refit it with.
+
+What validators can rely on is fits_by_bytes(): every token covers at least one byte, so
+a text with no more bytes than the limit has no more tokens either, without counting.
+"""
+
+import sys
+import string
+
+ASCII_LETTERS = string.ascii_letters.encode('ascii')
+ASCII_DIGITS = string.digits.encode('ascii')
+ASCII_WHITESPACE = string.whitespace.encode('ascii')
+ALL_ASCII = bytes(range(128))
+
+# rough tokens per byte of each character class for cl100k_base (gpt-3.5-turbo, gpt-4), not fitted yet
+TOKENS_PER_BYTE = {
+    "letters": 1 / 4.2,
+    "digits": 1 / 2.6,
+    "whitespace": 0.12,
+    "punctuation": 0.75,
+    "non_ascii": 0.45,
+}
+
+def get_text_stats(data):
+    """
+    Returns the number of bytes of each character class in data (bytes or str).
+    """
+    if isinstance(data, str):
+        data = data.encode('utf-8', errors='surrogatepass')
+    no_letters = data.translate(None, ASCII_LETTERS)
+    no_digits = no_letters.translate(None, ASCII_DIGITS)
+    no_whitespace = no_digits.translate(None, ASCII_WHITESPACE)
+    non_ascii = no_whitespace.translate(None, ALL_ASCII)
+    return {
+        "bytes": len(data),
+        "letters": len(data) - len(no_letters),
+        "digits": len(no_letters) - len(no_digits),
+        "whitespace": len(no_digits) - len(no_whitespace),
+        "punctuation": len(no_whitespace) - len(non_ascii),
+        "non_ascii": len(non_ascii),
+    }
+
+def estimate_tokens(data):
+    """
+    Returns the estimated token count of data (bytes or str).
+    """
+    stats = get_text_stats(data)
+    return sum(stats[key] * weight for key, weight in TOKENS_PER_BYTE.items())
+
+def fits_by_bytes(data, max_tokens):
+    """
+    Returns True if data (bytes or str) has at most max_tokens bytes, and so at most max_tokens tokens.
+    False means it needs an exact count, not that it's over the limit.
+    """
+    if isinstance(data, str):
+        # a character is at least one byte in UTF-8, so only longer strings need encoding
+        if len(data) > max_tokens:
+            return False
+        data = data.encode('utf-8', errors='surrogatepass')
+    return len(data) <= max_tokens
+
+if __name__ == "__main__":
+    input_text = sys.stdin.read()
+    print(int(estimate_tokens(input_text)))
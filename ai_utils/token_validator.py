@@ -1,12 +1,17 @@
-import subprocess
-import sys
-import os
-
 """
 This module simply accepts incoming text and returns a successful status code
 if the token count is within its limits. It fails noisily when the count exceeds the limit.
 """
 
+import sys
+import os
+import json
+
+# allow running this file as a script from anywhere
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from ai_utils.token_counter import count_tokens, count_json_tokens
+from ai_utils.token_estimator import fits_by_bytes
+
 DEFAULT_MAX_TOKENS = 1000  # Default maximum token limit
 
 class TokenLimitExceededError(Exception):
@@ -22,18 +27,32 @@ def validate_token_count(text, max_tokens=DEFAULT_MAX_TOKENS):
     Validates that the token count of the given text does not exceed the maximum token limit.
     Raises TokenLimitExceededError if the limit is exceeded.
     Returns 0 if the validation is successful.
+    Texts with no more bytes than the limit are accepted without tokenizing them.
+    Anything else is counted exactly.
     """
-    result = subprocess.run(['python', os.path.join(os.environ['DATADUDE_DIRECTORY'],'ai_utils/token_counter.py')], input=text, capture_output=True, text=True)
-    if result.returncode != 0:
-        print(f"{result.stderr.strip()}")
-        sys.exit(1)
-    
-    token_count = int(result.stdout.strip())
+    if fits_by_bytes(text, max_tokens):
+        return 0
+
+    token_count = count_tokens(text)
     if token_count > max_tokens:
         raise TokenLimitExceededError(token_count, max_tokens)
     
     return 0
 
+def validate_body_token_count(body, max_tokens=DEFAULT_MAX_TOKENS):
+    """
+    Same as validate_token_count, for a request body dict that will be sent as JSON.
+    Token counts of the body's file records are cached, so only changed files are tokenized.
+    """
+    if fits_by_bytes(json.dumps(body), max_tokens):
+        return 0
+
+    token_count = count_json_tokens(body)
+    if token_count > max_tokens:
+        raise TokenLimitExceededError(token_count, max_tokens)
+
+    return 0
+
 if __name__ == "__main__":
     input_text = sys.stdin.read()
     max_tokens = int(sys.argv[1]) if len(sys.argv) > 1 else DEFAULT_MAX_TOKENS
@@ -1,51 +1,96 @@
 import os
-import requests
 import sys
 import json
+import time
+import tempfile
 import subprocess
 import argparse
+import requests
 
 MAX_TOKENS = 500000 # This overrides the default max token limit (for bigger folders)
+JOB_POLL_INTERVAL = 0.25 # seconds, doubled after each poll of a background job
+MAX_JOB_POLL_INTERVAL = 2
 FOLDER_PATH = os.getcwd()  # Change this to the desired folder path
 os.environ['DATADUDE_DIRECTORY'] = os.path.expanduser("~/code/datadude") # location of server
+sys.path.append(os.environ['DATADUDE_DIRECTORY'])
+from ai_utils.token_validator import validate_body_token_count, TokenLimitExceededError
+from ai_utils.token_counter import get_token_cache
+from ai_utils.context_packer import pack_context
+from network_utils.client_transport import ClientTransport
+from network_utils.session_sync import build_manifest, manifest_hash
+from network_utils import event_stream, tracing
+
+transport = ClientTransport('http://127.0.0.1:5000') # one keep-alive connection for the whole session
 
 ########## Helper Functions ###########
-def get_directory_structure(root_dir=FOLDER_PATH):
+def iter_directory_structure(root_dir=FOLDER_PATH):
     """
-    Calls the directory_scanner.py script as a subprocess and returns the directory structure object.
+    Calls the directory_scanner.py script as a subprocess and yields each file's info as the scanner streams it out.
+    The scan is incremental, so only files changed since the last session are re-read.
+    Source files come with their symbols, so the server can answer where things are defined.
     """
     # Prepare the command to run directory_scanner.py
-    command = ['python',  os.path.join(os.environ['DATADUDE_DIRECTORY'],'directory_utils/directory_scanner.py')]
+    command = ['python',  os.path.join(os.environ['DATADUDE_DIRECTORY'],'directory_utils/directory_scanner.py'), '--incremental', '--ndjson', '--symbols']
     if root_dir is not None:
         command.append(str(root_dir))
+
+    span = tracing.start_span("scan", folder=root_dir)
+    # stderr goes to a file, since a full pipe nobody reads until the end would block the scanner
+    with tempfile.TemporaryFile(mode='w+') as stderr:
+        process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=stderr, text=True)
+        try:
+            for line in process.stdout:
+                record = json.loads(line)
+                if "changes" in record:
+                    # last line of an incremental scan
+                    continue
+                yield record
+            process.wait()
+        finally:
+            # the caller stopped early, or something failed
+            if process.poll() is None:
+                process.kill()
+                process.wait()
+            process.stdout.close()
+            if span is not None:
+                span.end()
+        if process.returncode != 0:
+            stderr.seek(0)
+            print(f"client.py: Error: {stderr.read()}")
+            sys.exit(process.returncode)
+
+def scan_and_count(root_dir=FOLDER_PATH):
+    """
+    Returns the folder's file info records, with each file's tokens counted (into the token
+    cache) as the scanner streams it out, so the counting overlaps the walk of the rest of the
+    folder. Also returns how long the scan took and how much of it went to counting, in seconds.
+    """
+    cache = get_token_cache()
+    files = []
+    count_time = 0.0
+    start = time.perf_counter()
+    for file_info in iter_directory_structure(root_dir):
+        count_start = time.perf_counter()
+        cache.count_record(file_info)
+        count_time += time.perf_counter() - count_start
+        files.append(file_info)
+    return files, time.perf_counter() - start, count_time
     
-    try:
-        result = subprocess.run(command, capture_output=True, text=True)
-        if result.returncode != 0:
-            raise subprocess.CalledProcessError(result.returncode, result.args, output=result.stdout, stderr=result.stderr)
-        # print(result.stdout)
-        return json.loads(result.stdout)
-    except subprocess.CalledProcessError as e:
-        print(f"client.py: Error: {e.stderr}")
-        sys.exit(result.returncode)
-    
-def run_token_validator(str, max_tokens=MAX_TOKENS):
+def run_token_validator(body, max_tokens=MAX_TOKENS):
     """
-    Calls token validator script.
+    Validates the token count of a request body in-process, and returns how long that took in seconds.
+    File token counts are cached between runs, so only changed files are tokenized.
     """
-    command = ['python', os.path.join(os.environ['DATADUDE_DIRECTORY'],'ai_utils/token_validator.py')]
-    if max_tokens is not None:
-        command.append(f'{max_tokens}')
-    try:
-        result = subprocess.run(command, input=str, capture_output=True, text=True)
-        if result.returncode != 0:
-            raise subprocess.CalledProcessError(result.returncode, result.args, output=result.stdout, stderr=result.stderr)
-    except subprocess.CalledProcessError as e:
-        if e.stdout:
-            print(f"\nclient.py: Token Validator Error: {e.stdout}")
-        if e.stderr:
-            print(f"\nclient.py: Token Validator Error: {e.stderr}")
-        sys.exit(result.returncode)
+    start = time.perf_counter()
+    with tracing.span("token_validation"):
+        try:
+            validate_body_token_count(body, max_tokens)
+        except TokenLimitExceededError as e:
+            print(f"\nclient.py: Token Validator Error: TokenLimitExceededError: {e}")
+            sys.exit(1)
+        finally:
+            get_token_cache().save()
+    return time.perf_counter() - start
 #######################################
 
 
@@ -56,42 +101,133 @@ def get_session_and_thread_id(ai_type: str):
     Sends /session POST request to the server.
     Receives the sessionID and threadID to use to start a chat session.
     """
-    url = 'http://127.0.0.1:5000/session'
-    
-    files = get_directory_structure()
+    files, scan_time, count_time = scan_and_count()
     body = {"path": FOLDER_PATH, "files": files}
     if ai_type:
         body["ai_type"] = ai_type
 
-    # Validate token count
-    json_str = json.dumps(body)
-    run_token_validator(json_str)
-    
-    response = requests.post(url, json=body)
-    if response.status_code != 200:
+    # Fit the context into the token budget instead of failing when the folder is too big.
+    # The packer's total is the count validate_body_token_count would make: each file counted
+    # on its own, plus a margin for where files meet. So the body doesn't need validating again after.
+    # The files' counts are in the cache already, from the scan.
+    start = time.perf_counter()
+    try:
+        with tracing.span("pack_context"):
+            body, report = pack_context(body, MAX_TOKENS)
+    except TokenLimitExceededError as e:
+        print(f"\nclient.py: Token Validator Error: TokenLimitExceededError: {e}")
+        sys.exit(1)
+    finally:
+        get_token_cache().save()
+    validation_time = count_time + time.perf_counter() - start
+    if report["excerpts"] or report["dropped"]:
+        print(f"client.py: Folder is over {MAX_TOKENS} tokens. Sending {report['full']} files in full, "
+              f"{report['excerpts']} as excerpts and {report['dropped']} without content.")
+
+    # for the server's /metrics
+    body["timings"] = {"scan": scan_time - count_time, "token_validation": validation_time}
+
+    # Only send what the server doesn't have yet. If nothing changed since the last session
+    # the manifest hash is all it needs.
+    files = body.pop("files")
+    manifest = build_manifest(files)
+    body["manifestHash"] = manifest_hash(manifest)
+    response = transport.post('/session', body)
+    if response.status_code == 409:
+        sync = transport.post('/session/sync', {"path": FOLDER_PATH, "manifest": manifest})
+        sync.raise_for_status()
+        missing = set(sync.json().get("missing"))
+        body["delta"] = True
+        body["files"] = [file for file in files if file["path"] in missing]
+        body["deleted"] = sync.json().get("deleted")
+        response = transport.post('/session', body)
+    if response.status_code == 202:
+        # the server is setting the session up in the background
+        wait_for_job(response.json().get("jobID"))
+    elif response.status_code != 200:
         print(response.text)
     response.raise_for_status()
     return (response.json().get("sessionID"), response.json().get("threadID"))
 
+def end_thread(sessionID, threadID):
+    """
+    Tells the server the chat is over, so it can let go of what the thread was using.
+    """
+    try:
+        transport.delete(f'/session/{sessionID}/threads/{threadID}')
+    except requests.RequestException:
+        # the server may be gone already, it's fine
+        pass
+
+def wait_for_job(jobID):
+    """
+    Polls /jobs/<jobID> until the server's background job is finished.
+    Exits if the job failed.
+    """
+    print("client.py: Setting up the session...")
+    delay = JOB_POLL_INTERVAL
+    while True:
+        response = transport.get('/jobs/' + jobID)
+        response.raise_for_status()
+        job = response.json()
+        if job["status"] == "done":
+            return
+        if job["status"] != "running":
+            print(f"client.py: Error: session setup {job['status']}: {job.get('error')}")
+            sys.exit(1)
+        time.sleep(delay)
+        delay = min(delay * 2, MAX_JOB_POLL_INTERVAL)
+
 def send_chat_message(sessionID, threadID, message, initMessage=False):
     """
     Sends /chat/<sessionID> POST request to the server.
     Request includes chat message to the AI Assistant.
     Receives a response chat message from the AI Assistant.
     """
-    url = 'http://127.0.0.1:5000/chat/' + sessionID
-    
     body = {"threadID": threadID, "message": message, "initMessage": initMessage}
 
     # Validate token count
-    json_str = json.dumps(body)
-    run_token_validator(json_str)
-    response = requests.post(url, json=body)
+    body["timings"] = {"token_validation": run_token_validator(body)}
+    response = transport.post('/chat/' + sessionID, body)
     
     if response.status_code != 200:
         print(response.text)
     response.raise_for_status()
     return (response.json().get("message"))
+
+def stream_chat_message(sessionID, threadID, message, initMessage=False):
+    """
+    Sends /chat/<sessionID> POST request to the server asking for a streamed response.
+    Yields the AI Assistant's response in chunks as the server relays them.
+    """
+    body = {"threadID": threadID, "message": message, "initMessage": initMessage, "stream": True}
+
+    # Validate token count
+    body["timings"] = {"token_validation": run_token_validator(body)}
+    with transport.post('/chat/' + sessionID, body, stream=True) as response:
+        if response.status_code != 200:
+            print(response.text)
+        response.raise_for_status()
+        if not response.headers.get('Content-Type', '').startswith(event_stream.MIMETYPE):
+            # some replies (like to an empty message) aren't streamed
+            yield response.json().get("message")
+            return
+        for event in event_stream.iter_events(response.iter_lines(decode_unicode=True)):
+            if "error" in event:
+                print(f"\nclient.py: Error: {event['error']}")
+                return
+            if "delta" in event:
+                yield event["delta"]
+
+def print_chat_response(sessionID, threadID, message, initMessage=False):
+    """
+    Prints the AI Assistant's response to message as it arrives.
+    """
+    print("Datadude:\t", end="", flush=True)
+    with tracing.span("chat", message=message[:80]):
+        for chunk in stream_chat_message(sessionID, threadID, message, initMessage):
+            print(chunk, end="", flush=True)
+    print()
 ###################################
 
 
@@ -100,8 +236,19 @@ if __name__ == '__main__':
     parser = argparse.ArgumentParser(description="Client for interacting with DataDude server")
     parser.add_argument('-a','--ai', type=str, default="", required=False, choices=['a', 'c'],
                         help='Type of AI handler to use (a for assistants, c for chat_completions)')
+    parser.add_argument('--trace', type=str, default=None,
+                        help='Append spans of the session (here, in the scanner and in the server) to this file, in the Chrome trace event format')
     args = parser.parse_args()
 
+    if args.trace:
+        # the scanner subprocess inherits these
+        os.environ[tracing.TRACE_ENV] = args.trace
+    tracing.configure_from_env("client")
+    if tracing.is_enabled():
+        os.environ[tracing.TRACE_ID_ENV] = tracing.get_trace_id() or tracing.new_trace_id()
+        tracing.set_trace_id(os.environ[tracing.TRACE_ID_ENV])
+        print(f"client.py: Tracing to {os.environ[tracing.TRACE_ENV]} (trace ID {tracing.get_trace_id()})")
+
     # Map shorthand options to full AI type names
     ai_type_map = {'a': 'assistants', 'c': 'chat_completions'}
     ai_type = ""
@@ -123,23 +270,16 @@ if __name__ == '__main__':
             message = line.strip()
             if message:
                 print("Me:\t\t" + message)
-                if first_message:
-                    response = send_chat_message(sessionID, threadID, message, initMessage=True)
-                    first_message = False
-                else:
-                    response = send_chat_message(sessionID, threadID, message)
-                print("Datadude:\t" + response)
+                print_chat_response(sessionID, threadID, message, initMessage=first_message)
+                first_message = False
     else:
         # Interactive input
         print("You can start typing your queries. Press ^D (Ctrl+D) to exit.")
         while True:
             try:
                 message = input("Me:\t\t")
-                if first_message:
-                    response = send_chat_message(sessionID, threadID, message, initMessage=True)
-                    first_message = False
-                else:
-                    response = send_chat_message(sessionID, threadID, message)
-                print("Datadude:\t" + response)
+                print_chat_response(sessionID, threadID, message, initMessage=first_message)
+                first_message = False
             except EOFError:
-                break
\ No newline at end of file
+                break
+    end_thread(sessionID, threadID)
@@ -0,0 +1,116 @@
+"""
+Bounded, binary-safe reading of file content for the directory scanner.
+
+Every file gets at most max_file_bytes of content and the whole scan at most
+max_total_bytes. Binary files are detected from their first few KB and skipped.
+Files over the per-file limit are mmap'ed and only their head and tail are read.
+Anything that wasn't read in full gets a "contentStatus" entry in its file info:
+    "truncated"   - head and tail only
+    "binary"      - no content, the file looks binary
+    "over_budget" - no content, the scan's total byte budget was used up
+    "unreadable"  - no content, the file couldn't be opened
+"""
+
+import mmap
+import threading
+
+DEFAULT_MAX_FILE_BYTES = 1024 * 1024 # 1 MB per file
+DEFAULT_MAX_TOTAL_BYTES = 64 * 1024 * 1024 # 64 MB per scan
+BINARY_SNIFF_BYTES = 8192 # same amount git looks at
+TAIL_FRACTION = 0.25 # share of a truncated file's budget given to its tail
+TRUNCATION_MARKER = "\n\n... [{} bytes truncated] ...\n\n"
+
+def looks_binary(head):
+    """
+    Returns True if the first bytes of a file look like binary data.
+    Uses git's heuristic: a NUL byte means binary.
+    """
+    return b'\0' in head
+
+def decode_text(data):
+    """
+    Decodes file bytes as UTF-8, replacing anything that isn't valid instead of failing.
+    Newlines are normalized the same way text mode open() does.
+    """
+    text = data.decode('utf-8', errors='replace')
+    return text.replace('\r\n', '\n').replace('\r', '\n')
+
+class ContentReader:
+    """
+    Reads file content within a per-file and a total byte budget.
+    One reader is shared by all the threads of a scan, so the total budget is guarded by a lock.
+    """
+    def __init__(self, max_file_bytes=DEFAULT_MAX_FILE_BYTES, max_total_bytes=DEFAULT_MAX_TOTAL_BYTES):
+        self.max_file_bytes = max_file_bytes
+        self.max_total_bytes = max_total_bytes
+        self.bytes_used = 0
+        self.lock = threading.Lock()
+
+    def reserve(self, size):
+        """
+        Takes size bytes from the total budget. Returns False, taking nothing, if there isn't enough left.
+        """
+        with self.lock:
+            if self.bytes_used + size > self.max_total_bytes:
+                return False
+            self.bytes_used += size
+            return True
+
+    def release(self, size):
+        """
+        Gives back bytes that were reserved but not used.
+        """
+        with self.lock:
+            self.bytes_used -= size
+
+    def read(self, file_path, size):
+        """
+        Returns (content, status) for a file of the given size.
+        content is None if nothing was read. status is None if the whole file was read.
+        """
+        reserved = min(size, self.max_file_bytes)
+        if not self.reserve(reserved):
+            # smaller files later in the scan may still fit
+            return None, "over_budget"
+        try:
+            with open(file_path, 'rb') as file:
+                if size <= self.max_file_bytes:
+                    data = file.read(size)
+                    content, status = (None, "binary") if looks_binary(data[:BINARY_SNIFF_BYTES]) else (decode_text(data), None)
+                else:
+                    content, status = self.read_head_and_tail(file)
+        except (OSError, ValueError):
+            # ValueError: the file was emptied before it could be mmap'ed
+            content, status = None, "unreadable"
+        if content is None:
+            self.release(reserved)
+        return content, status
+
+    def read_head_and_tail(self, file):
+        """
+        Reads the start and end of a file that is over the per-file limit, without loading the rest.
+        """
+        with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            size = len(mapped)
+            if looks_binary(mapped[:BINARY_SNIFF_BYTES]):
+                return None, "binary"
+            tail_bytes = int(self.max_file_bytes * TAIL_FRACTION)
+            head_bytes = self.max_file_bytes - tail_bytes
+            head = decode_text(mapped[:head_bytes])
+            tail = decode_text(mapped[size - tail_bytes:]) if tail_bytes else ""
+        return head + TRUNCATION_MARKER.format(size - head_bytes - tail_bytes) + tail, "truncated"
+
+    def apply_budget(self, file_info):
+        """
+        Charges the content of an already built file info record (e.g. one reused from the
+        manifest) against the total budget. Returns the record, or a copy without content if
+        the budget is used up.
+        """
+        if "content" not in file_info:
+            return file_info
+        size = len(file_info["content"].encode('utf-8', errors='surrogatepass'))
+        if self.reserve(size):
+            return file_info
+        file_info = {key: value for key, value in file_info.items() if key != "content"}
+        file_info["contentStatus"] = "over_budget"
+        return file_info
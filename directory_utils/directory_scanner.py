@@ -2,87 +2,206 @@ import os
 import json
 import sys
 from datetime import datetime
-import gzip
-import base64
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+
+# allow running this file as a script from anywhere
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from directory_utils.ignore_matcher import IGNORE_FILE_NAMES, ALWAYS_IGNORED
+from directory_utils.tree_walker import walk_files, map_file_batches, iter_directory_listings, iter_map_file_batches, DEFAULT_MAX_WORKERS
+from directory_utils.content_reader import ContentReader, DEFAULT_MAX_FILE_BYTES, DEFAULT_MAX_TOTAL_BYTES
+from directory_utils.scan_manifest import get_manifest_path, load_manifest, save_manifest, content_hash, is_unchanged, diff_manifest
+from directory_utils.symbol_table import extract_symbols, SYMBOL_EXTENSIONS
+from network_utils import tracing
 
 
 DEFAULT_FOLDER_PATH = os.getcwd()
+CONTENT_EXTENSIONS = ('.md', '.py', '.sh', '.js', '.jsx')
 
 def read_dudeignore(dudeignore_location=DEFAULT_FOLDER_PATH):
     """
-    Reads the .dudeignore file and returns a list of files and directories to omit.
+    Reads the .dudeignore file and returns its lines as a list of gitignore-style patterns.
     Also ignores anything in a .gitigore, which should be in the same location.
+    .dudeignore patterns come last, so they take precedence (e.g. '!' can bring back a gitignored file).
+    .dudeignore and .gitignore files in subfolders are picked up while walking.
     """
-    dudeignore_path = os.path.join(dudeignore_location, '.dudeignore')
-    gitignore_path = os.path.join(dudeignore_location, '.gitignore')
-    if not os.path.exists(dudeignore_path):
-        # use my .dudeignore instead
-        return [".dudeignore", ".git"]
-    with open(dudeignore_path, 'r') as file:
-        lines = file.readlines()
-    if os.path.exists(gitignore_path):
-        with open(gitignore_path, 'r') as file:
-            git_lines = file.readlines()
-        for line in git_lines:
-            lines.append(line)
-    # Strip lines, ignore empty lines and comments
-    omit_paths = [line.strip().rstrip('/') for line in lines if line.strip() and not line.startswith("#")]
-    omit_paths.append(".dudeignore")
-    omit_paths.append(".git")
+    lines = []
+    for file_name in IGNORE_FILE_NAMES:
+        ignore_path = os.path.join(dudeignore_location, file_name)
+        if os.path.exists(ignore_path):
+            with open(ignore_path, 'r', errors='replace') as file:
+                lines.extend(file.readlines())
+    omit_paths = lines + ALWAYS_IGNORED
     return omit_paths
 
-def get_directory_structure(rootdir=DEFAULT_FOLDER_PATH, omit_paths=None):
+def get_file_info(file_path, name, stat, reader, symbols=False):
+    """
+    Builds the info record for one file from its stat result.
+    Content is only included for the file types in CONTENT_EXTENSIONS, within the reader's byte budget.
+    With symbols, source files whose whole content was read also get their definitions and imports.
+    """
+    file_info = {
+        "name": name,
+        "path": file_path,
+        "size": stat.st_size,
+        "lastModified": datetime.fromtimestamp(stat.st_mtime).isoformat(),
+    }
+    if name.endswith(CONTENT_EXTENSIONS):
+        content, status = reader.read(file_path, stat.st_size)
+        if content is not None:
+            file_info['content'] = content
+        if status is not None:
+            file_info['contentStatus'] = status
+        if symbols:
+            add_symbols(file_info)
+    return file_info
+
+def add_symbols(file_info):
+    """
+    Adds the symbols of a source file to its info record, if it has any to add.
+    """
+    file_symbols = extract_symbols(file_info)
+    if file_symbols is not None:
+        file_info['symbols'] = file_symbols
+    return file_info
+
+def get_directory_structure(rootdir=DEFAULT_FOLDER_PATH, omit_paths=None, max_workers=DEFAULT_MAX_WORKERS, reader=None, symbols=False):
     """
     Recursively collects information about files and directories, omitting specified subdirectories and files.
     Will not omit a directory listed in .dudeignore if that directory is the rootdir.
+    Directory listings and file reads are spread over max_workers threads.
+    File content is read within the byte budgets of reader (a ContentReader with default limits if not given).
+    With symbols, source file records get a "symbols" field (see symbol_table.py).
     """
-    if omit_paths is None:
-        omit_paths = []
-
-    file_info_list = []
-    for dirpath, dirnames, filenames in os.walk(rootdir):
-        # Omit specified subdirectories
-        dirnames[:] = [d for d in dirnames if d not in omit_paths]
-        # Omit specified files
-        filenames[:] = [f for f in filenames if f not in omit_paths]
-
-        for file in filenames:
-            file_path = os.path.join(dirpath, file)
-            file_info = {
-                "name": file,
-                "path": file_path,
-                "size": os.path.getsize(file_path),
-                "lastModified": datetime.fromtimestamp(os.path.getmtime(file_path)).isoformat(),
-            }
-            if file.endswith(('.md', '.py', '.sh', '.js', '.jsx')):
-                # Read and compress the file content
-                with open(file_path, 'r') as f:
-                    file_content = f.read()
-                    # compressed_content = gzip.compress(file_content)
-                    # base64_encoded_content = base64.b64encode(compressed_content).decode('utf-8')
-                    
-                    # # Ensure proper base64 padding
-                    # missing_padding = len(base64_encoded_content) % 4
-                    # if missing_padding != 0:
-                    #     base64_encoded_content += '=' * (4 - missing_padding)
-                    
-                    file_info['content'] = file_content
-
-            file_info_list.append(file_info)
+    if reader is None:
+        reader = ContentReader()
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        file_entries = walk_files(rootdir, omit_paths, executor=executor)
+        file_info_list = map_file_batches(lambda file_entry: get_file_info(*file_entry, reader, symbols), file_entries, executor)
     return file_info_list
-   
+
+def iter_directory_structure(rootdir=DEFAULT_FOLDER_PATH, omit_paths=None, max_workers=DEFAULT_MAX_WORKERS, reader=None, symbols=False):
+    """
+    Generator version of get_directory_structure.
+    Yields each file's info as soon as it's ready, so the caller can start on the
+    first files while the rest of the folder is still being walked. Order is not os.walk order.
+    """
+    if reader is None:
+        reader = ContentReader()
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        listings = iter_directory_listings(rootdir, omit_paths, executor)
+        yield from iter_map_file_batches(lambda file_entry: get_file_info(*file_entry, reader, symbols), (files for _, files, _ in listings), executor)
+
+def iter_directory_structure_incremental(rootdir=DEFAULT_FOLDER_PATH, omit_paths=None, manifest_path=None, max_workers=DEFAULT_MAX_WORKERS, changes=None, reader=None, symbols=False):
+    """
+    Generator version of get_directory_structure_incremental.
+    Yields each file's info as soon as it's ready. Once the generator is exhausted, the manifest is
+    saved and the given changes dict (if any) is filled in with the added, modified and deleted file paths.
+    Symbols are saved in the manifest with the rest of the record, so only changed files are parsed again.
+    """
+    if manifest_path is None:
+        manifest_path = get_manifest_path(rootdir)
+    if reader is None:
+        reader = ContentReader()
+
+    old_entries = load_manifest(manifest_path, rootdir)
+    new_entries = {}
+
+    def get_manifest_entry(file_entry):
+        file_path, name, stat = file_entry
+        entry = old_entries.get(file_path)
+        # files that didn't fit in an earlier scan's budget get another try
+        if is_unchanged(entry, stat.st_size, stat.st_mtime_ns) and entry["record"].get("contentStatus") != "over_budget":
+            record = entry["record"]
+            if symbols and "symbols" not in record and name.endswith(SYMBOL_EXTENSIONS):
+                # scanned before without symbols
+                add_symbols(record)
+            elif not symbols and "symbols" in record:
+                record = {key: value for key, value in record.items() if key != "symbols"}
+            return file_path, entry, reader.apply_budget(record)
+        file_info = get_file_info(file_path, name, stat, reader, symbols)
+        entry = {
+            "size": stat.st_size,
+            "mtime": stat.st_mtime_ns,
+            "hash": content_hash(file_info["content"]) if "content" in file_info else None,
+            "record": file_info,
+        }
+        return file_path, entry, file_info
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        listings = iter_directory_listings(rootdir, omit_paths, executor)
+        for file_path, entry, file_info in iter_map_file_batches(get_manifest_entry, (files for _, files, _ in listings), executor):
+            new_entries[file_path] = entry
+            yield file_info
+
+    if changes is not None:
+        changes.update(diff_manifest(old_entries, new_entries))
+    save_manifest(manifest_path, rootdir, new_entries)
+
+def get_directory_structure_incremental(rootdir=DEFAULT_FOLDER_PATH, omit_paths=None, manifest_path=None, max_workers=DEFAULT_MAX_WORKERS, reader=None, symbols=False):
+    """
+    Same as get_directory_structure, but reuses the records saved in the root's manifest
+    for files whose size and mtime haven't changed. Only new or changed files are re-read.
+    Returns the file info list and a dict of the added, modified and deleted file paths.
+    """
+    changes = {}
+    file_info_list = list(iter_directory_structure_incremental(rootdir, omit_paths, manifest_path, max_workers, changes, reader, symbols))
+    return file_info_list, changes
+
+def write_ndjson(records, stream):
+    """
+    Writes each record as one line of JSON, flushing as it goes so a reader sees records right away.
+    """
+    for record in records:
+        stream.write(json.dumps(record) + "\n")
+        stream.flush()
+
 
 if __name__ == "__main__":
-    folder_path = sys.argv[1] if len(sys.argv) > 1 else DEFAULT_FOLDER_PATH
-    dudeignore_path = sys.argv[2] if len(sys.argv) > 2 else DEFAULT_FOLDER_PATH
+    parser = argparse.ArgumentParser(description="Scans a folder and prints its structure as JSON")
+    parser.add_argument('folder_path', nargs='?', default=DEFAULT_FOLDER_PATH)
+    parser.add_argument('dudeignore_path', nargs='?', default=DEFAULT_FOLDER_PATH)
+    parser.add_argument('-i', '--incremental', action='store_true',
+                        help='Reuse the saved manifest and only re-read changed files. Prints {"files": [...], "changes": {...}}')
+    parser.add_argument('--manifest', type=str, default=None, help='Manifest file to use with --incremental')
+    parser.add_argument('-s', '--ndjson', action='store_true',
+                        help='Stream one JSON record per line as files are scanned. With --incremental, the last line is {"changes": {...}}')
+    parser.add_argument('-w', '--workers', type=int, default=DEFAULT_MAX_WORKERS, help='Number of threads used to walk and read the folder')
+    parser.add_argument('--max-file-bytes', type=int, default=DEFAULT_MAX_FILE_BYTES, help='Larger files are cut down to their head and tail')
+    parser.add_argument('--max-total-bytes', type=int, default=DEFAULT_MAX_TOTAL_BYTES, help='Content budget for the whole scan')
+    parser.add_argument('--symbols', action='store_true',
+                        help='Add the definitions and imports of .py, .js, .jsx and .sh files to their records')
+    args = parser.parse_args()
+    # traced when the client is (see network_utils/tracing.py)
+    tracing.configure_from_env("directory_scanner")
+    scan_span = tracing.start_span("directory_scan", folder=args.folder_path, incremental=args.incremental, symbols=args.symbols)
 
     try:
-        omit_paths = read_dudeignore(dudeignore_path)
-        files = get_directory_structure(folder_path, omit_paths)
+        omit_paths = read_dudeignore(args.dudeignore_path)
+        reader = ContentReader(args.max_file_bytes, args.max_total_bytes)
+        if args.ndjson:
+            # Stream the records out as they're scanned
+            changes = {}
+            if args.incremental:
+                files = iter_directory_structure_incremental(args.folder_path, omit_paths, args.manifest, args.workers, changes, reader, args.symbols)
+                write_ndjson(files, sys.stdout)
+                write_ndjson([{"changes": changes}], sys.stdout)
+            else:
+                write_ndjson(iter_directory_structure(args.folder_path, omit_paths, args.workers, reader, args.symbols), sys.stdout)
+        else:
+            if args.incremental:
+                files, changes = get_directory_structure_incremental(args.folder_path, omit_paths, args.manifest, args.workers, reader, args.symbols)
+                output = {"files": files, "changes": changes}
+            else:
+                output = get_directory_structure(args.folder_path, omit_paths, args.workers, reader, args.symbols)
 
-        # Output the directory structure as a JSON string
-        files_json = json.dumps(files, indent=2)
-        print(files_json)
+            # Output the directory structure as a JSON string
+            files_json = json.dumps(output, indent=2)
+            print(files_json)
     except Exception as e:
+        if scan_span is not None:
+            scan_span.end(e)
         print(f"Error: {e}", file=sys.stderr)
         sys.exit(1)
+    if scan_span is not None:
+        scan_span.end()
@@ -0,0 +1,246 @@
+"""
+gitignore-compatible matching for .dudeignore and .gitignore files.
+
+Each ignore file is compiled once into an IgnoreRules object: patterns that are a plain
+name (e.g. node_modules) go in dicts, and every other pattern is merged into one regex
+whose alternatives are tried newest pattern first. Either way, checking a path is one
+dict lookup plus one regex match, however many patterns the file has.
+
+IgnoreMatcher stacks the rules of nested ignore files, deepest folder first, the same
+way git does. Paths are always relative to the scanned root and use '/' separators.
+"""
+
+import os
+import re
+
+IGNORE_FILE_NAMES = ('.gitignore', '.dudeignore') # later files take precedence in the same folder
+ALWAYS_IGNORED = ['.git', '.dudeignore']
+
+def class_to_regex(body):
+    """
+    Translates the inside of a [...] glob class into the inside of a regex class.
+    """
+    regex = ''
+    i = 0
+    if body[0] in '!^':
+        regex += '^'
+        i = 1
+    while i < len(body):
+        c = body[i]
+        if c == '\\' and i + 1 < len(body):
+            i += 1
+            regex += re.escape(body[i])
+        elif c == '-' and 0 < i < len(body) - 1:
+            regex += '-' # range
+        else:
+            regex += re.escape(c)
+        i += 1
+    return regex
+
+def glob_to_regex(pattern):
+    """
+    Translates one gitignore glob (without leading '!' or trailing '/') into a regex string.
+    Supports *, ?, [...] classes, backslash escapes and the special ** forms:
+    leading '**/', trailing '/**' and '/**/' in the middle.
+    """
+    regex = ''
+    i = 0
+    n = len(pattern)
+    while i < n:
+        c = pattern[i]
+        if c == '*':
+            if pattern.startswith('**', i):
+                at_segment_start = i == 0 or pattern[i - 1] == '/'
+                at_segment_end = i + 2 == n or pattern[i + 2] == '/'
+                if at_segment_start and at_segment_end:
+                    if i + 2 == n:
+                        # trailing /** matches everything inside
+                        regex += '.*'
+                        i += 2
+                    else:
+                        # **/ matches zero or more folders
+                        regex += '(?:.*/)?'
+                        i += 3
+                    continue
+                # any other run of asterisks is a regular *
+                while i < n and pattern[i] == '*':
+                    i += 1
+                regex += '[^/]*'
+                continue
+            regex += '[^/]*'
+        elif c == '?':
+            regex += '[^/]'
+        elif c == '[':
+            j = i + 1
+            if j < n and pattern[j] in '!^':
+                j += 1
+            if j < n and pattern[j] == ']':
+                j += 1
+            while j < n and pattern[j] != ']':
+                j += 1
+            if j >= n:
+                # no closing bracket, so it's a literal [
+                regex += re.escape(c)
+            else:
+                regex += '(?!/)[' + class_to_regex(pattern[i + 1:j]) + ']'
+                i = j
+        elif c == '\\' and i + 1 < n:
+            i += 1
+            regex += re.escape(pattern[i])
+        else:
+            regex += re.escape(c)
+        i += 1
+    return regex
+
+def parse_ignore_line(line):
+    """
+    Parses one line of an ignore file.
+    Returns (pattern, negated, dir_only, anchored), or None for blank lines and comments.
+    """
+    line = line.rstrip('\n').rstrip('\r')
+    # trailing spaces are ignored unless escaped with a backslash
+    stripped = line.rstrip(' ')
+    if stripped.endswith('\\') and len(stripped) < len(line):
+        stripped += ' '
+    line = stripped
+    if not line or line.startswith('#'):
+        return None
+    negated = False
+    if line.startswith('!'):
+        negated = True
+        line = line[1:]
+    elif line.startswith('\\!') or line.startswith('\\#'):
+        line = line[1:]
+    dir_only = line.endswith('/') and not line.endswith('\\/')
+    line = line.rstrip('/')
+    if not line:
+        return None
+    # a slash at the start or in the middle anchors the pattern to the ignore file's folder
+    anchored = '/' in line
+    line = line.lstrip('/')
+    return line, negated, dir_only, anchored
+
+class IgnoreRules:
+    """
+    The compiled patterns of one ignore file.
+    base is the folder the file lives in, relative to the scanned root ('' for the root itself).
+    """
+    def __init__(self, lines, base=''):
+        self.base = base.strip('/')
+        # name -> (index, negated) of the last plain name rule for it. Rules ending in '/'
+        # only go in the folder table, so "dist" then "dist/" still ignores files named dist.
+        self.literal_file_names = {}
+        self.literal_dir_names = {}
+        self.patterns = [] # (index, negated, dir_only) per regex group
+        alternatives = []
+        for index, line in enumerate(lines):
+            parsed = parse_ignore_line(line)
+            if parsed is None:
+                continue
+            pattern, negated, dir_only, anchored = parsed
+            if not anchored and not re.search(r'[*?\[\\]', pattern):
+                self.literal_dir_names[pattern] = (index, negated)
+                if not dir_only:
+                    self.literal_file_names[pattern] = (index, negated)
+                continue
+            regex = glob_to_regex(pattern)
+            if not anchored:
+                regex = '(?:.*/)?' + regex
+            group = f"p{len(self.patterns)}"
+            self.patterns.append((index, negated, dir_only))
+            alternatives.append(f"(?P<{group}>{regex})")
+        self.regex = None
+        self.file_regex = None
+        if alternatives:
+            # newest pattern first, so the first alternative that matches is the one git would use
+            self.regex = re.compile('|'.join(reversed(alternatives)), re.DOTALL)
+            file_alternatives = [alt for alt, (_, _, dir_only) in zip(alternatives, self.patterns) if not dir_only]
+            if file_alternatives:
+                self.file_regex = re.compile('|'.join(reversed(file_alternatives)), re.DOTALL)
+
+    @classmethod
+    def from_file(cls, path, base=''):
+        """
+        Compiles the ignore file at path. Returns None if it doesn't exist or can't be read.
+        """
+        try:
+            with open(path, 'r', errors='replace') as file:
+                return cls(file.readlines(), base)
+        except OSError:
+            return None
+
+    def match(self, relpath, is_dir):
+        """
+        Returns True if the last pattern matching relpath ignores it, False if it
+        re-includes it with '!', or None if no pattern matches.
+        """
+        if self.base:
+            if not relpath.startswith(self.base + '/'):
+                return None
+            relpath = relpath[len(self.base) + 1:]
+
+        best_index = -1
+        result = None
+        name = relpath.rsplit('/', 1)[-1]
+        literal = (self.literal_dir_names if is_dir else self.literal_file_names).get(name)
+        if literal is not None:
+            best_index, result = literal[0], not literal[1]
+
+        # patterns ending in '/' only apply to folders
+        regex = self.regex if is_dir else self.file_regex
+        if regex is not None:
+            found = regex.fullmatch(relpath)
+            if found is not None:
+                index, negated, _ = self.patterns[int(found.lastgroup[1:])]
+                if index > best_index:
+                    result = not negated
+        return result
+
+class IgnoreMatcher:
+    """
+    A stack of IgnoreRules, from the root's ignore files down to the current folder's.
+    Deeper rules win over shallower ones, and later files in the stack win over earlier ones.
+    """
+    def __init__(self, rules=()):
+        self.rules = tuple(rule for rule in rules if rule is not None)
+
+    @classmethod
+    def from_lines(cls, lines):
+        """
+        Compiles root level patterns, e.g. the list returned by read_dudeignore.
+        """
+        return cls([IgnoreRules(lines)])
+
+    def is_ignored(self, relpath, is_dir=False):
+        """
+        Returns True if the path (relative to the scanned root) should be left out.
+        The caller is expected to prune ignored folders, so parents aren't re-checked here.
+        """
+        for rules in reversed(self.rules):
+            result = rules.match(relpath, is_dir)
+            if result is not None:
+                return result
+        return False
+
+    def for_directory(self, dirpath, reldir):
+        """
+        Returns the matcher to use inside a folder, adding any ignore files it contains.
+        Returns self when the folder has none, which is the common case.
+        """
+        nested = []
+        for file_name in IGNORE_FILE_NAMES:
+            ignore_path = os.path.join(dirpath, file_name)
+            if os.path.isfile(ignore_path):
+                nested.append(IgnoreRules.from_file(ignore_path, reldir))
+        if not nested:
+            return self
+        return IgnoreMatcher(self.rules + tuple(nested))
+
+def compile_omit_paths(omit_paths):
+    """
+    Returns an IgnoreMatcher for omit_paths, which can be a matcher already,
+    a list of ignore patterns, or None.
+    """
+    if isinstance(omit_paths, IgnoreMatcher):
+        return omit_paths
+    return IgnoreMatcher.from_lines(list(omit_paths or []) + ALWAYS_IGNORED)
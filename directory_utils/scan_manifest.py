@@ -0,0 +1,96 @@
+"""
+Persistent manifest of a scanned directory. It maps every file path under a root
+to the (size, mtime, content hash) it had during the last scan, along with the
+file info record that was produced for it, so a rescan only has to stat files
+and re-read the ones that changed.
+"""
+
+import os
+import json
+import uuid
+import hashlib
+
+MANIFEST_DIRECTORY = os.path.expanduser("~/.datadude/manifests")
+MANIFEST_VERSION = 1
+
+def get_manifest_path(rootdir, manifest_dir=MANIFEST_DIRECTORY):
+    """
+    Returns the manifest location for a root folder.
+    The file name uses the same uuid5 scheme as the server's session IDs.
+    """
+    root_id = str(uuid.uuid5(uuid.NAMESPACE_DNS, os.path.abspath(rootdir)))
+    return os.path.join(manifest_dir, root_id + ".json")
+
+def content_hash(content):
+    """
+    Returns the sha256 hex digest of the given file content (str or bytes).
+    """
+    if isinstance(content, str):
+        content = content.encode('utf-8', errors='surrogatepass')
+    return hashlib.sha256(content).hexdigest()
+
+def load_manifest(manifest_path, rootdir):
+    """
+    Returns the manifest entries saved for rootdir, keyed by file path.
+    Returns an empty dict if there is no usable manifest, so the caller does a full scan.
+    """
+    if not os.path.exists(manifest_path):
+        return {}
+    try:
+        with open(manifest_path, 'r') as file:
+            manifest = json.load(file)
+    except (OSError, ValueError):
+        # a corrupt manifest just means a full rescan
+        return {}
+    if manifest.get("version") != MANIFEST_VERSION or manifest.get("root") != os.path.abspath(rootdir):
+        return {}
+    return manifest.get("entries", {})
+
+def save_manifest(manifest_path, rootdir, entries):
+    """
+    Writes the manifest entries for rootdir.
+    The file is written to a temp path first and swapped in, so an interrupted scan never leaves a partial manifest.
+    """
+    manifest_dir = os.path.dirname(manifest_path)
+    if manifest_dir and not os.path.exists(manifest_dir):
+        os.makedirs(manifest_dir, exist_ok=True)
+    manifest = {
+        "version": MANIFEST_VERSION,
+        "root": os.path.abspath(rootdir),
+        "entries": entries,
+    }
+    tmp_path = manifest_path + ".tmp"
+    with open(tmp_path, 'w') as file:
+        json.dump(manifest, file)
+    os.replace(tmp_path, manifest_path)
+
+def is_unchanged(entry, size, mtime):
+    """
+    Returns True if a manifest entry still matches the file's current stat values.
+    """
+    return entry is not None and entry.get("size") == size and entry.get("mtime") == mtime
+
+def diff_manifest(old_entries, new_entries):
+    """
+    Compares two sets of manifest entries.
+    Returns a dict listing the added, modified and deleted file paths.
+    A file only counts as modified if its content hash changed, or, for files without
+    content, if its size or mtime changed.
+    """
+    added = []
+    modified = []
+    for path, entry in new_entries.items():
+        old_entry = old_entries.get(path)
+        if old_entry is None:
+            added.append(path)
+        elif entry.get("hash") is not None or old_entry.get("hash") is not None:
+            if entry.get("hash") != old_entry.get("hash"):
+                modified.append(path)
+        elif not is_unchanged(old_entry, entry.get("size"), entry.get("mtime")):
+            modified.append(path)
+    deleted = [path for path in old_entries if path not in new_entries]
+    return {
+        "added": sorted(added),
+        "modified": sorted(modified),
+        "deleted": sorted(deleted),
+    }
@@ -0,0 +1,228 @@
+"""
+Symbol tables of source files: where functions, classes and methods are defined, and what
+each file imports.
+
+Python files are parsed with ast. JavaScript (.js/.jsx) and shell (.sh) files go through
+lightweight tokenizers that skip strings and comments and track braces, which is enough
+to find definitions and where their bodies end without a full parser.
+
+A file's symbols are kept compact, as lists instead of dicts:
+    {"definitions": [[name, kind, line, end_line], ...], "imports": [[module, name, line], ...]}
+kind is "function", "class", "method" or "variable" (module-level Python assignments).
+name is "" for imports of a whole module. Lines are 1-based.
+
+With --symbols, the directory scanner adds them to each file record as "symbols". The
+record is saved in the scan manifest, so a rescan only extracts the symbols of the files
+that changed.
+"""
+
+import os
+import re
+import ast
+import sys
+import json
+
+SYMBOL_EXTENSIONS = ('.py', '.js', '.jsx', '.sh')
+
+JS_TOKEN_PATTERN = re.compile(r"""
+    (?P<comment>//[^\n]*|/\*.*?(?:\*/|\Z))
+  | (?P<string>'(?:\\.|[^'\\\n])*'?|"(?:\\.|[^"\\\n])*"?|`(?:\\.|[^`\\])*`?)
+  | (?P<word>[A-Za-z_$][\w$]*)
+  | (?P<punct>=>|[{}()\[\];=*])
+  | (?P<newline>\n)
+""", re.S | re.X)
+JS_NOT_METHODS = frozenset("if for while switch catch function return typeof new with do else".split())
+JS_DECLARATIONS = frozenset(("const", "let", "var"))
+
+SHELL_FUNCTION_PATTERN = re.compile(r"^\s*(?:function\s+([\w.:-]+)\s*(?:\(\s*\))?|([\w.:-]+)\s*\(\s*\))\s*(?:\{|\(|$)")
+SHELL_SOURCE_PATTERN = re.compile(r"^\s*(?:source|\.)\s+(['\"]?)([^\s'\";|&]+)\1")
+SHELL_STRIP_PATTERN = re.compile(r"'[^']*'|\"(?:\\.|[^\"\\])*\"|(?:^|\s)#.*$")
+
+def extract_python_symbols(content):
+    tree = ast.parse(content)
+    definitions = []
+    imports = []
+
+    def visit(node, scope):
+        # only statements can hold definitions and imports, so expressions aren't walked
+        for child in ast.iter_child_nodes(node):
+            if isinstance(child, (ast.FunctionDef, ast.AsyncFunctionDef)):
+                definitions.append([child.name, "method" if scope == "class" else "function", child.lineno, child.end_lineno])
+                visit(child, "function")
+            elif isinstance(child, ast.ClassDef):
+                definitions.append([child.name, "class", child.lineno, child.end_lineno])
+                visit(child, "class")
+            elif isinstance(child, ast.Import):
+                imports.extend([alias.name, "", child.lineno] for alias in child.names)
+            elif isinstance(child, ast.ImportFrom):
+                module = "." * child.level + (child.module or "")
+                imports.extend([module, alias.name, child.lineno] for alias in child.names)
+            elif scope == "module" and isinstance(child, (ast.Assign, ast.AnnAssign)):
+                targets = child.targets if isinstance(child, ast.Assign) else [child.target]
+                definitions.extend([target.id, "variable", child.lineno, child.end_lineno] for target in targets if isinstance(target, ast.Name))
+            elif isinstance(child, ast.stmt):
+                # if/try/with/for blocks
+                visit(child, scope)
+
+    visit(tree, "module")
+    return definitions, imports
+
+def tokenize_js(content):
+    """
+    Returns the (kind, text, line) tokens of JavaScript code that matter for finding symbols:
+    words, strings and the punctuation in JS_TOKEN_PATTERN. Comments and everything else are skipped.
+    """
+    tokens = []
+    line = 1
+    for match in JS_TOKEN_PATTERN.finditer(content):
+        kind = match.lastgroup
+        text = match.group()
+        if kind == "newline":
+            line += 1
+            continue
+        if kind != "comment":
+            tokens.append((kind, text, line))
+        if kind in ("comment", "string"):
+            line += text.count('\n')
+    return tokens
+
+def extract_js_symbols(content):
+    tokens = tokenize_js(content)
+    definitions = []
+    imports = []
+
+    def text_at(i):
+        return tokens[i][1] if 0 <= i < len(tokens) else ""
+
+    def closing_paren(i):
+        # index of the ")" matching the "(" at i, or None
+        depth = 0
+        for j in range(i, len(tokens)):
+            if tokens[j][0] == "punct":
+                if tokens[j][1] == "(":
+                    depth += 1
+                elif tokens[j][1] == ")":
+                    depth -= 1
+                    if depth == 0:
+                        return j
+        return None
+
+    depth = 0
+    open_bodies = [] # (depth outside the body, definition) for definitions whose "{" has been seen
+    class_bodies = [] # depths inside class bodies
+    pending = None # (index the body's "{" must be at, definition)
+    for i, (kind, text, line) in enumerate(tokens):
+        if kind == "punct":
+            if text == "{":
+                if pending is not None and pending[0] == i:
+                    open_bodies.append((depth, pending[1]))
+                    if pending[1][1] == "class":
+                        class_bodies.append(depth + 1)
+                depth += 1
+            elif text == "}":
+                depth = max(depth - 1, 0)
+                while open_bodies and open_bodies[-1][0] >= depth:
+                    open_bodies.pop()[1][3] = line
+                while class_bodies and class_bodies[-1] > depth:
+                    class_bodies.pop()
+            continue
+        if kind == "string":
+            if text_at(i - 1) == "(" and (text_at(i - 2) == "require" or text_at(i - 2) == "import"):
+                imports.append([text[1:-1], "", line])
+            elif text_at(i - 1) == "from" or (text_at(i - 1) == "import" and text_at(i - 2) != "."):
+                imports.append([text[1:-1], "", line])
+            continue
+
+        definition = None
+        body = None # index of the token after the signature
+        if text == "function":
+            j = i + 2 if text_at(i + 1) == "*" else i + 1
+            if j < len(tokens) and tokens[j][0] == "word" and text_at(j + 1) == "(":
+                definition = [tokens[j][1], "function", line, line]
+                end = closing_paren(j + 1)
+                body = end + 1 if end is not None else None
+        elif text == "class" and i + 1 < len(tokens) and tokens[i + 1][0] == "word" and text_at(i + 1) != "extends":
+            definition = [tokens[i + 1][1], "class", line, line]
+            j = i + 2
+            while j < len(tokens) and text_at(j) != "{" and text_at(j) != ";":
+                j += 1
+            body = j
+        elif text in JS_DECLARATIONS and i + 2 < len(tokens) and tokens[i + 1][0] == "word" and text_at(i + 2) == "=":
+            name = tokens[i + 1][1]
+            j = i + 4 if text_at(i + 3) == "async" else i + 3
+            if text_at(j) == "function" or text_at(j) == "class":
+                # a named function/class expression also gets a definition under its own name
+                definition = [name, text_at(j), line, line]
+                if text_at(j) == "function":
+                    paren = j + 1 if text_at(j + 1) == "(" else j + 2
+                    end = closing_paren(paren) if text_at(paren) == "(" else None
+                    body = end + 1 if end is not None else None
+                else:
+                    k = j + 1
+                    while k < len(tokens) and text_at(k) != "{" and text_at(k) != ";":
+                        k += 1
+                    body = k
+            else:
+                end = closing_paren(j) if text_at(j) == "(" else (j if j < len(tokens) and tokens[j][0] == "word" else None)
+                if end is not None and text_at(end + 1) == "=>":
+                    definition = [name, "function", line, line]
+                    body = end + 2
+        elif class_bodies and class_bodies[-1] == depth and text_at(i + 1) == "(" and text not in JS_NOT_METHODS:
+            end = closing_paren(i + 1)
+            if end is not None and text_at(end + 1) == "{":
+                definition = [text, "method", line, line]
+                body = end + 1
+        if definition is not None:
+            definitions.append(definition)
+            if body is not None and text_at(body) == "{":
+                pending = (body, definition)
+    return definitions, imports
+
+def extract_shell_symbols(content):
+    definitions = []
+    imports = []
+    depth = 0
+    open_bodies = []
+    for line_number, line in enumerate(content.split('\n'), 1):
+        match = SHELL_FUNCTION_PATTERN.match(line)
+        if match:
+            definition = [match.group(1) or match.group(2), "function", line_number, line_number]
+            definitions.append(definition)
+            open_bodies.append((depth, definition))
+        else:
+            source = SHELL_SOURCE_PATTERN.match(line)
+            if source:
+                imports.append([source.group(2), "", line_number])
+        code = SHELL_STRIP_PATTERN.sub(" ", line)
+        depth += code.count("{") - code.count("}")
+        depth = max(depth, 0)
+        while open_bodies and depth <= open_bodies[-1][0] and "}" in code:
+            open_bodies.pop()[1][3] = line_number
+    return definitions, imports
+
+def extract_symbols(file_info):
+    """
+    Returns the symbols of a file info record, or None if it's not a supported source file,
+    has no content, or its content is incomplete (cut down, or not parseable).
+    """
+    name = file_info["name"]
+    content = file_info.get("content")
+    if not name.endswith(SYMBOL_EXTENSIONS) or not content or file_info.get("contentStatus"):
+        return None
+    try:
+        if name.endswith('.py'):
+            definitions, imports = extract_python_symbols(content)
+        elif name.endswith('.sh'):
+            definitions, imports = extract_shell_symbols(content)
+        else:
+            definitions, imports = extract_js_symbols(content)
+    except (SyntaxError, ValueError, RecursionError):
+        return None
+    return {"definitions": definitions, "imports": imports}
+
+if __name__ == "__main__":
+    # Prints the symbols of the files given on the command line
+    for path in sys.argv[1:]:
+        with open(path, 'r', errors='replace') as file:
+            symbols = extract_symbols({"name": os.path.basename(path), "content": file.read()})
+        print(json.dumps({"path": path, "symbols": symbols}))
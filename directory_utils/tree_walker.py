@@ -0,0 +1,127 @@
+"""
+Parallel tree walker built on os.scandir.
+Each directory is listed by a worker thread, and each file is stat'ed exactly once
+through its DirEntry. walk_files returns results in the same top-down order os.walk uses,
+so callers get the same output no matter how the work was scheduled. The iter_* generators
+hand results over as soon as they're ready instead, for streaming.
+"""
+
+import os
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from directory_utils.ignore_matcher import compile_omit_paths
+
+DEFAULT_MAX_WORKERS = min(32, (os.cpu_count() or 1) + 4) # same default as ThreadPoolExecutor
+FILE_BATCH_SIZE = 256 # files handed to a worker at a time by map_file_batches
+MAX_BATCHES_IN_FLIGHT = 2 * DEFAULT_MAX_WORKERS # read-ahead limit for iter_map_file_batches
+
+def scan_single_directory(dirpath, reldir, matcher):
+    """
+    Lists one directory, reldir being its path relative to the scanned root.
+    Ignored entries are dropped here, so ignored folders are never descended into.
+    Returns the (path, name, stat) of its files, the (path, relpath) of its subdirectories,
+    and the matcher to use for those subdirectories.
+    Unreadable directories and files are skipped, like os.walk does.
+    """
+    if reldir:
+        matcher = matcher.for_directory(dirpath, reldir)
+    files = []
+    subdirs = []
+    try:
+        with os.scandir(dirpath) as entries:
+            for entry in entries:
+                relpath = reldir + '/' + entry.name if reldir else entry.name
+                try:
+                    if entry.is_dir():
+                        # like os.walk, symlinked folders are neither walked nor listed as files
+                        if not entry.is_symlink() and not matcher.is_ignored(relpath, is_dir=True):
+                            subdirs.append((entry.path, relpath))
+                        continue
+                    if not matcher.is_ignored(relpath):
+                        files.append((entry.path, entry.name, entry.stat()))
+                except OSError:
+                    continue
+    except OSError:
+        pass
+    return files, subdirs, matcher
+
+def iter_directory_listings(rootdir, omit_paths, executor):
+    """
+    Generator that lists rootdir and its subdirectories on the executor.
+    omit_paths is a list of ignore patterns or an IgnoreMatcher.
+    Yields (dirpath, files, subdirs) for each directory as soon as it has been listed,
+    so the order depends on scheduling.
+    """
+    matcher = compile_omit_paths(omit_paths)
+    pending = {executor.submit(scan_single_directory, rootdir, '', matcher): rootdir}
+    try:
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                dirpath = pending.pop(future)
+                files, subdirs, subdir_matcher = future.result()
+                for subdir, relpath in subdirs:
+                    pending[executor.submit(scan_single_directory, subdir, relpath, subdir_matcher)] = subdir
+                yield dirpath, files, [subdir for subdir, _ in subdirs]
+    finally:
+        # the consumer stopped early, don't list the rest of the tree
+        for future in pending:
+            future.cancel()
+
+def walk_files(rootdir, omit_paths=None, max_workers=DEFAULT_MAX_WORKERS, executor=None):
+    """
+    Walks rootdir with a pool of threads, omitting paths matched by omit_paths
+    (a list of ignore patterns or an IgnoreMatcher) and by nested ignore files.
+    Returns a list of (path, name, stat) tuples, one per file, in os.walk order.
+    """
+    own_executor = executor is None
+    if own_executor:
+        executor = ThreadPoolExecutor(max_workers=max_workers)
+    listings = {}
+    try:
+        for dirpath, files, subdirs in iter_directory_listings(rootdir, omit_paths, executor):
+            listings[dirpath] = (files, subdirs)
+    finally:
+        if own_executor:
+            executor.shutdown()
+
+    # Put the listings back in top-down order: a folder's files, then each subfolder in turn
+    file_entries = []
+    stack = [rootdir]
+    while stack:
+        files, subdirs = listings[stack.pop()]
+        file_entries.extend(files)
+        stack.extend(reversed(subdirs))
+    return file_entries
+
+def map_file_batches(fn, items, executor, batch_size=FILE_BATCH_SIZE):
+    """
+    Applies fn to every item on the executor, a batch of items per task.
+    Returns the results in the same order as items.
+    """
+    def run_batch(batch):
+        return [fn(item) for item in batch]
+
+    batches = [items[i:i + batch_size] for i in range(0, len(items), batch_size)]
+    results = []
+    for batch_result in executor.map(run_batch, batches):
+        results.extend(batch_result)
+    return results
+
+def iter_map_file_batches(fn, item_lists, executor, batch_size=FILE_BATCH_SIZE, max_in_flight=MAX_BATCHES_IN_FLIGHT):
+    """
+    Generator version of map_file_batches for an iterable of item lists (e.g. one list per directory).
+    At most max_in_flight batches are queued at a time, so memory stays bounded
+    however far ahead the producer is. Results are yielded in submission order.
+    """
+    def run_batch(batch):
+        return [fn(item) for item in batch]
+
+    in_flight = deque()
+    for items in item_lists:
+        for i in range(0, len(items), batch_size):
+            in_flight.append(executor.submit(run_batch, items[i:i + batch_size]))
+            while len(in_flight) >= max_in_flight:
+                yield from in_flight.popleft().result()
+    while in_flight:
+        yield from in_flight.popleft().result()
@@ -0,0 +1,106 @@
+"""
+One asyncio event loop, running on a background thread, for the server's slow I/O.
+
+In async mode the server hands AI handler work (session setup, runs, streamed answers)
+to this loop as coroutines instead of doing it on the request's thread. Waiting on the
+OpenAI API then costs a suspended coroutine, not a blocked thread, so hundreds of sessions
+can set up or wait on runs at once. Long work is started as a job, and its status can be
+looked up by job ID while the request that started it has already returned.
+"""
+
+import uuid
+import queue
+import asyncio
+import threading
+from datetime import datetime
+from network_utils import tracing
+
+JOB_HISTORY = 1000 # finished jobs kept for status lookups, oldest are dropped past this
+
+class AsyncRunner:
+    """
+    Runs coroutines on an event loop in a daemon thread. Safe to use from any thread.
+    """
+    def __init__(self):
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, name="async-runner", daemon=True)
+        self.thread.start()
+        self.jobs = {}
+        self.lock = threading.Lock()
+
+    def submit(self, coro):
+        """
+        Schedules coro on the loop and returns a concurrent.futures.Future of its result.
+        The coroutine runs in the calling thread's trace.
+        """
+        return asyncio.run_coroutine_threadsafe(tracing.carry(coro), self.loop)
+
+    def run(self, coro, timeout=None):
+        """
+        Runs coro on the loop and returns its result, blocking the calling thread.
+        """
+        return self.submit(coro).result(timeout)
+
+    def iter_async(self, agen):
+        """
+        Generator that relays the items of an async generator running on the loop
+        to a plain (synchronous) iterator, as they are produced.
+        """
+        items = queue.Queue()
+        done = object()
+
+        async def pump():
+            try:
+                async for item in agen:
+                    items.put(item)
+            except BaseException as e:
+                items.put(e)
+            finally:
+                items.put(done)
+
+        future = self.submit(pump())
+        try:
+            while True:
+                item = items.get()
+                if item is done:
+                    return
+                if isinstance(item, BaseException):
+                    raise item
+                yield item
+        finally:
+            # the consumer went away (e.g. the client disconnected), stop producing
+            future.cancel()
+
+    def start_job(self, coro):
+        """
+        Starts coro as a background job and returns its job ID.
+        """
+        jobID = str(uuid.uuid4())
+        job = {"status": "running", "startTime": datetime.now().isoformat(), "endTime": "", "error": None}
+        with self.lock:
+            self.jobs[jobID] = job
+            if len(self.jobs) > JOB_HISTORY:
+                finished = [key for key, value in self.jobs.items() if value["status"] != "running"]
+                for key in finished[:len(self.jobs) - JOB_HISTORY]:
+                    del self.jobs[key]
+
+        def finish(future):
+            job["endTime"] = datetime.now().isoformat()
+            if future.cancelled():
+                job["status"] = "cancelled"
+            elif future.exception() is not None:
+                job["status"] = "failed"
+                job["error"] = str(future.exception())
+            else:
+                job["status"] = "done"
+
+        self.submit(coro).add_done_callback(finish)
+        return jobID
+
+    def get_job(self, jobID):
+        """
+        Returns a copy of the job's status record, or None if there is no such job.
+        """
+        with self.lock:
+            job = self.jobs.get(jobID)
+            return dict(job) if job else None
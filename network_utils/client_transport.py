@@ -0,0 +1,73 @@
+"""
+HTTP transport from the client to the DataDude server.
+One requests.Session is kept for the life of the client, so every /chat message reuses
+the same keep-alive connection instead of opening a new one. JSON bodies are compressed
+(zstd if available, otherwise gzip), which matters for large /session uploads.
+With tracing on, each request is a span, and carries the trace ID to the server.
+"""
+
+import json
+import requests
+from requests.adapters import HTTPAdapter
+
+from network_utils.compression import compress_body, get_supported_encodings, MIN_COMPRESS_BYTES
+from network_utils import tracing
+
+DEFAULT_SERVER_URL = 'http://127.0.0.1:5000'
+POOL_SIZE = 4
+
+class ClientTransport:
+    """
+    Sends JSON requests to the server over a pooled, keep-alive session.
+    """
+    def __init__(self, server_url=DEFAULT_SERVER_URL, compress=True):
+        self.server_url = server_url.rstrip('/')
+        self.compress = compress
+        self.encodings = get_supported_encodings()
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=POOL_SIZE)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+    def post(self, path, body, **kwargs):
+        """
+        POSTs body as JSON to the server path and returns the requests.Response.
+        Bodies over MIN_COMPRESS_BYTES are compressed. If the server can't decode the
+        preferred encoding, the request is retried with the next one, and that one is kept.
+        """
+        data = json.dumps(body).encode('utf-8')
+        headers = {'Content-Type': 'application/json'}
+        if not self.compress or len(data) < MIN_COMPRESS_BYTES:
+            return self.request('POST', path, data=data, headers=headers, **kwargs)
+
+        while True:
+            encoding = self.encodings[0]
+            response = self.request('POST', path, data=compress_body(data, encoding),
+                                    headers=dict(headers, **{'Content-Encoding': encoding}), **kwargs)
+            if response.status_code != 415 or len(self.encodings) == 1:
+                return response
+            self.encodings = self.encodings[1:]
+
+    def get(self, path, **kwargs):
+        """
+        GETs the server path and returns the requests.Response.
+        """
+        return self.request('GET', path, **kwargs)
+
+    def delete(self, path, **kwargs):
+        """
+        DELETEs the server path and returns the requests.Response.
+        """
+        return self.request('DELETE', path, **kwargs)
+
+    def request(self, method, path, **kwargs):
+        if not tracing.is_enabled():
+            return self.session.request(method, self.server_url + path, **kwargs)
+        kwargs["headers"] = dict(kwargs.get("headers") or {}, **{tracing.TRACE_HEADER: tracing.get_trace_id() or ""})
+        with tracing.span(f"{method} {path}", bytes=len(kwargs.get("data") or b"")) as span:
+            response = self.session.request(method, self.server_url + path, **kwargs)
+            span.args["status"] = response.status_code
+            return response
+
+    def close(self):
+        self.session.close()
@@ -0,0 +1,32 @@
+"""
+Server-sent events (text/event-stream) for streaming chat responses.
+The server writes one event per chunk of model output, "data: <json>" followed by a blank
+line, and the client reads them off the open response as they arrive. Event payloads are
+{"delta": <text>} for each chunk, then {"done": true, "message": <full text>} at the end,
+or {"error": <message>} if the handler failed partway through.
+"""
+
+import json
+
+MIMETYPE = 'text/event-stream'
+
+def format_event(data):
+    """
+    Returns one server-sent event carrying data as JSON.
+    """
+    return f"data: {json.dumps(data)}\n\n"
+
+def iter_events(lines):
+    """
+    Generator that parses server-sent events from an iterable of text lines
+    (e.g. requests' Response.iter_lines(decode_unicode=True)) and yields each event's data.
+    """
+    data_lines = []
+    for line in lines:
+        if line.startswith('data:'):
+            data_lines.append(line[5:].lstrip(' '))
+        elif not line and data_lines:
+            yield json.loads('\n'.join(data_lines))
+            data_lines = []
+    if data_lines:
+        yield json.loads('\n'.join(data_lines))
@@ -0,0 +1,187 @@
+"""
+Counters and histograms of where the server's time goes, served at /metrics in the
+Prometheus text format (https://prometheus.io/docs/instrumenting/exposition_formats/).
+
+Every stage of setting up a session and answering a message is timed into
+datadude_stage_seconds{stage=...}, with time_stage(). Stages that fail also count in
+datadude_stage_errors_total. The client's own stages (the folder scan and token
+validation) are timed by the client and sent along with its requests.
+
+OpenAI calls are counted and timed by endpoint (see ai_utils/instrumented_client.py),
+and tokens in and out are counted by session.
+
+Metrics are kept per process. With several worker processes, scrape each one, or add up
+what they report.
+"""
+
+import time
+import threading
+from contextlib import contextmanager
+from network_utils import tracing
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300) # seconds
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+CLIENT_STAGES = ("scan", "token_validation") # stages the client may report timings of
+
+def format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ""
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in pairs)
+    return "{" + ",".join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + "}"
+
+def format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+class Metric:
+    """
+    A metric family: one value (or set of values) per combination of label values.
+    """
+    kind = "untyped"
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.values = {} # label values -> value
+        self.lock = threading.Lock()
+
+    def key(self, labels):
+        return tuple(str(labels[name]) for name in self.labels)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        with self.lock:
+            items = sorted(self.values.items())
+        for key, value in items:
+            lines.extend(self.render_samples(key, value))
+        return lines
+
+    def render_samples(self, key, value):
+        return [f"{self.name}{format_labels(self.labels, key)} {format_value(value)}"]
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self.key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+class Gauge(Metric):
+    """
+    A value read when the metrics are rendered: callback() returns it, or a dict of label values -> value.
+    """
+    kind = "gauge"
+
+    def __init__(self, name, help, callback, labels=()):
+        super().__init__(name, help, labels)
+        self.callback = callback
+
+    def render(self):
+        try:
+            value = self.callback()
+        except Exception as e:
+            print(f"metrics.py: Warning: failed to read {self.name}: {e}")
+            return []
+        with self.lock:
+            self.values = value if isinstance(value, dict) else {(): value}
+        return super().render()
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name, help, labels=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self.key(labels)
+        with self.lock:
+            counts = self.values.get(key)
+            if counts is None:
+                # one count per bucket, then the count over the last bucket, then the sum
+                counts = self.values[key] = [0] * (len(self.buckets) + 1) + [0.0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+                    break
+            else:
+                counts[-2] += 1
+            counts[-1] += value
+
+    def render_samples(self, key, counts):
+        lines = []
+        total = 0
+        for bound, count in zip(self.buckets + (float("inf"),), counts):
+            total += count
+            lines.append(f"{self.name}_bucket{format_labels(self.labels, key, [('le', format_value(float(bound)))])} {total}")
+        lines.append(f"{self.name}_sum{format_labels(self.labels, key)} {format_value(counts[-1])}")
+        lines.append(f"{self.name}_count{format_labels(self.labels, key)} {total}")
+        return lines
+
+class Registry:
+    def __init__(self):
+        self.metrics = {}
+
+    def add(self, metric):
+        self.metrics[metric.name] = metric
+        return metric
+
+    def render(self):
+        """
+        Returns every metric in the Prometheus text format.
+        """
+        lines = []
+        for metric in list(self.metrics.values()):
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+registry = Registry()
+stage_seconds = registry.add(Histogram("datadude_stage_seconds", "Time spent in each stage of setting up sessions and answering messages", ["stage"]))
+stage_errors = registry.add(Counter("datadude_stage_errors_total", "Stages that failed", ["stage"]))
+http_requests = registry.add(Counter("datadude_http_requests_total", "Requests to the server by endpoint and status code", ["endpoint", "status"]))
+http_request_seconds = registry.add(Histogram("datadude_http_request_seconds", "Time to handle requests to the server, up to the first byte of streamed responses", ["endpoint"]))
+openai_requests = registry.add(Counter("datadude_openai_requests_total", "Calls to the OpenAI API by endpoint", ["endpoint"]))
+openai_errors = registry.add(Counter("datadude_openai_errors_total", "Calls to the OpenAI API that raised, by endpoint and error", ["endpoint", "error"]))
+openai_request_seconds = registry.add(Histogram("datadude_openai_request_seconds", "Time of calls to the OpenAI API by endpoint", ["endpoint"]))
+tokens = registry.add(Counter("datadude_tokens_total", "Model tokens by session and direction (in: prompt, out: completion)", ["session", "direction"]))
+
+@contextmanager
+def time_stage(stage):
+    """
+    Context manager that times the code in it as a stage, and traces it as a span if tracing
+    is on. Works around awaits too.
+    """
+    start = time.perf_counter()
+    with tracing.span(stage):
+        try:
+            yield
+        except Exception:
+            stage_errors.inc(stage=stage)
+            raise
+        finally:
+            stage_seconds.observe(time.perf_counter() - start, stage=stage)
+
+def observe_client_timings(timings):
+    """
+    Records the stage timings a client sent with its request ({stage: seconds}). Unknown stages are ignored.
+    """
+    if not isinstance(timings, dict):
+        return
+    for stage, seconds in timings.items():
+        if stage in CLIENT_STAGES and isinstance(seconds, (int, float)) and seconds >= 0:
+            stage_seconds.observe(float(seconds), stage=stage)
+
+def record_usage(sessionID, usage):
+    """
+    Counts the tokens of an OpenAI usage object (of a completion or a run) for the session.
+    """
+    if usage is None:
+        return
+    tokens.inc(getattr(usage, "prompt_tokens", 0) or 0, session=sessionID or "", direction="in")
+    tokens.inc(getattr(usage, "completion_tokens", 0) or 0, session=sessionID or "", direction="out")
@@ -0,0 +1,294 @@
+"""
+Memory-bounded store of the server's sessions (messagePool).
+
+Sessions work like the dict they replace: messagePool[sessionID]["threads"][threadID]...
+Behind that, the store keeps the sessions in LRU order with an estimate of their size
+(mostly file contents and messages), and spills cold ones to a SQLite database (in WAL
+mode, so reads don't block writes):
+
+- Sessions idle for longer than session_ttl, and then the least recently used sessions
+  while the total is over max_resident_bytes or max_sessions, are written to disk and
+  dropped from memory. Looking one up again reads it back (a rehydration).
+- Threads idle for longer than thread_ttl have their message history written to disk, and
+  the server drops their AI handler (see on_thread_evict). get_thread_messages() returns
+  the whole history, spilled and resident.
+
+A session is never spilled while a request is using it (see pin()), or within
+MIN_IDLE_SECONDS of being used, so a request never writes to a session that's no longer
+in the store. Limits are soft: when every session is in use, the store stays over them
+until some aren't.
+"""
+
+import os
+import json
+import time
+import zlib
+import sqlite3
+import threading
+from collections import OrderedDict
+from collections.abc import MutableMapping
+from contextlib import contextmanager
+
+STATE_DB_PATH = os.path.expanduser("~/.datadude/sessions.db")
+DEFAULT_MAX_RESIDENT_BYTES = 512 * 1024 * 1024
+DEFAULT_MAX_SESSIONS = 1000
+DEFAULT_SESSION_TTL = 6 * 60 * 60 # seconds
+DEFAULT_THREAD_TTL = 60 * 60
+MIN_IDLE_SECONDS = 60
+MAINTENANCE_INTERVAL = 10 # seconds between checks of the limits
+RECORD_OVERHEAD = 128 # rough bytes per file record or message besides its text
+COMPRESS_LEVEL = 1
+
+def estimate_size(session):
+    """
+    Returns a rough estimate of the memory a session takes, in bytes.
+    """
+    size = 0
+    for record in session.get("files") or []:
+        size += len(record.get("content") or "") + len(record.get("path") or "") + RECORD_OVERHEAD
+    for thread in session.get("threads", {}).values():
+        for message in thread.get("messages", []):
+            size += sum(len(text) for text in message.values()) + RECORD_OVERHEAD
+    return size
+
+def encode(value):
+    return zlib.compress(json.dumps(value).encode('utf-8', errors='surrogatepass'), COMPRESS_LEVEL)
+
+def decode(data):
+    return json.loads(zlib.decompress(data).decode('utf-8', errors='surrogatepass'))
+
+class SessionStore(MutableMapping):
+    """
+    sessionID -> session dict, with LRU/TTL eviction to a SQLite database. Safe to share between threads.
+    on_session_evict(sessionID, session) and on_thread_evict(sessionID, threadID) are called
+    after a session or a thread's history is spilled, to let go of anything kept alongside it.
+    """
+    def __init__(self, path=STATE_DB_PATH, max_resident_bytes=DEFAULT_MAX_RESIDENT_BYTES, max_sessions=DEFAULT_MAX_SESSIONS,
+                 session_ttl=DEFAULT_SESSION_TTL, thread_ttl=DEFAULT_THREAD_TTL, on_session_evict=None, on_thread_evict=None):
+        self.path = path
+        self.max_resident_bytes = max_resident_bytes
+        self.max_sessions = max_sessions
+        self.session_ttl = session_ttl
+        self.thread_ttl = thread_ttl
+        self.on_session_evict = on_session_evict
+        self.on_thread_evict = on_thread_evict
+        self.sessions = OrderedDict() # sessionID -> session, least recently used first
+        self.last_used = {} # sessionID -> time.monotonic() of the last use
+        self.thread_last_used = {} # (sessionID, threadID) -> time.monotonic() of the last use
+        self.sizes = {} # sessionID -> estimated bytes, None until measured
+        self.pins = {} # sessionID -> number of requests using it
+        self.lock = threading.RLock()
+        self.db = None # opened on the first spill or lookup of a session that isn't resident
+        self.last_maintenance = time.monotonic()
+        self.stats = {"session_evictions": 0, "thread_evictions": 0, "session_rehydrations": 0, "thread_rehydrations": 0}
+
+    def get_db(self):
+        if self.db is None:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            self.db = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+            self.db.execute("PRAGMA journal_mode=WAL")
+            self.db.execute("PRAGMA synchronous=NORMAL")
+            self.db.execute("CREATE TABLE IF NOT EXISTS sessions (session_id TEXT PRIMARY KEY, data BLOB NOT NULL)")
+            self.db.execute("CREATE TABLE IF NOT EXISTS thread_messages (session_id TEXT, thread_id TEXT, data BLOB NOT NULL, "
+                            "PRIMARY KEY (session_id, thread_id))")
+        return self.db
+
+    def __getitem__(self, sessionID):
+        with self.lock:
+            session = self.sessions.get(sessionID)
+            if session is None:
+                session = self.rehydrate(sessionID)
+            self.sessions.move_to_end(sessionID)
+            self.last_used[sessionID] = time.monotonic()
+            self.sizes[sessionID] = None # it may be about to change
+            return session
+
+    def __setitem__(self, sessionID, session):
+        with self.lock:
+            self.sessions[sessionID] = session
+            self.sessions.move_to_end(sessionID)
+            self.last_used[sessionID] = time.monotonic()
+            self.sizes[sessionID] = None
+            if self.db is not None:
+                self.db.execute("DELETE FROM sessions WHERE session_id = ?", (sessionID,))
+
+    def __delitem__(self, sessionID):
+        with self.lock:
+            resident = self.sessions.pop(sessionID, None) is not None
+            self.forget(sessionID)
+            deleted = 0
+            if self.db is not None or os.path.exists(self.path):
+                deleted = self.get_db().execute("DELETE FROM sessions WHERE session_id = ?", (sessionID,)).rowcount
+                self.db.execute("DELETE FROM thread_messages WHERE session_id = ?", (sessionID,))
+            if not resident and not deleted:
+                raise KeyError(sessionID)
+
+    def __iter__(self):
+        return iter(self.keys_snapshot())
+
+    def __len__(self):
+        return len(self.keys_snapshot())
+
+    def keys_snapshot(self):
+        with self.lock:
+            keys = list(self.sessions)
+            if self.db is not None or os.path.exists(self.path):
+                keys.extend(row[0] for row in self.get_db().execute("SELECT session_id FROM sessions") if row[0] not in self.sessions)
+            return keys
+
+    def rehydrate(self, sessionID):
+        """
+        Reads a spilled session back into memory. Raises KeyError if there's no such session.
+        """
+        if self.db is None and not os.path.exists(self.path):
+            raise KeyError(sessionID)
+        row = self.get_db().execute("SELECT data FROM sessions WHERE session_id = ?", (sessionID,)).fetchone()
+        if row is None:
+            raise KeyError(sessionID)
+        session = decode(row[0])
+        self.db.execute("DELETE FROM sessions WHERE session_id = ?", (sessionID,))
+        self.sessions[sessionID] = session
+        self.sizes[sessionID] = None
+        self.stats["session_rehydrations"] += 1
+        return session
+
+    def forget(self, sessionID):
+        self.last_used.pop(sessionID, None)
+        self.sizes.pop(sessionID, None)
+        for key in [key for key in self.thread_last_used if key[0] == sessionID]:
+            del self.thread_last_used[key]
+
+    def pin(self, sessionID):
+        """
+        Keeps a session in memory while a request works on it, until unpin().
+        """
+        with self.lock:
+            self.pins[sessionID] = self.pins.get(sessionID, 0) + 1
+
+    def unpin(self, sessionID):
+        with self.lock:
+            self.pins[sessionID] -= 1
+            if not self.pins[sessionID]:
+                del self.pins[sessionID]
+            if sessionID in self.sessions:
+                self.last_used[sessionID] = time.monotonic()
+            elif sessionID not in self.pins:
+                # requests may pin IDs of sessions that were spilled, deleted or never existed
+                self.last_used.pop(sessionID, None)
+
+    @contextmanager
+    def using(self, sessionID):
+        """
+        Context manager version of pin() and unpin().
+        """
+        self.pin(sessionID)
+        try:
+            yield
+        finally:
+            self.unpin(sessionID)
+
+    def touch_thread(self, sessionID, threadID):
+        """
+        Marks a thread as used. Threads that aren't used for thread_ttl get their history spilled.
+        """
+        with self.lock:
+            self.thread_last_used[(sessionID, threadID)] = time.monotonic()
+
+    def get_thread_messages(self, sessionID, threadID):
+        """
+        Returns a thread's whole message history: what was spilled to disk, then what's in memory.
+        """
+        with self.lock:
+            messages = list(self[sessionID]["threads"][threadID]["messages"])
+            if self[sessionID]["threads"][threadID].get("spilledMessages"):
+                row = self.get_db().execute("SELECT data FROM thread_messages WHERE session_id = ? AND thread_id = ?",
+                                            (sessionID, threadID)).fetchone()
+                if row is not None:
+                    messages = decode(row[0]) + messages
+                    self.stats["thread_rehydrations"] += 1
+            return messages
+
+    def get_resident_bytes(self):
+        with self.lock:
+            for sessionID, size in self.sizes.items():
+                if size is None:
+                    self.sizes[sessionID] = estimate_size(self.sessions[sessionID])
+            return sum(self.sizes.values())
+
+    def is_idle(self, sessionID, now, idle_seconds):
+        return sessionID not in self.pins and now - self.last_used.get(sessionID, 0) >= idle_seconds
+
+    def spill_session(self, sessionID):
+        session = self.sessions.pop(sessionID)
+        self.forget(sessionID)
+        self.get_db().execute("INSERT OR REPLACE INTO sessions (session_id, data) VALUES (?, ?)", (sessionID, encode(session)))
+        self.stats["session_evictions"] += 1
+        return session
+
+    def spill_thread(self, sessionID, threadID):
+        thread = self.sessions[sessionID]["threads"].get(threadID)
+        del self.thread_last_used[(sessionID, threadID)]
+        if thread is None:
+            return False
+        if thread["messages"]:
+            db = self.get_db()
+            row = db.execute("SELECT data FROM thread_messages WHERE session_id = ? AND thread_id = ?", (sessionID, threadID)).fetchone()
+            messages = (decode(row[0]) if row else []) + thread["messages"]
+            db.execute("INSERT OR REPLACE INTO thread_messages (session_id, thread_id, data) VALUES (?, ?, ?)",
+                       (sessionID, threadID, encode(messages)))
+            thread["spilledMessages"] = len(messages)
+            thread["messages"] = []
+            self.sizes[sessionID] = None
+        self.stats["thread_evictions"] += 1
+        return True
+
+    def maybe_enforce_limits(self):
+        """
+        Enforces the limits if it's been MAINTENANCE_INTERVAL seconds since they were last checked.
+        """
+        if time.monotonic() - self.last_maintenance >= MAINTENANCE_INTERVAL:
+            self.enforce_limits()
+
+    def enforce_limits(self):
+        """
+        Spills idle threads' histories, then idle sessions, then the least recently used sessions
+        until the store is within its limits.
+        """
+        evicted_threads = []
+        evicted_sessions = []
+        with self.lock:
+            now = time.monotonic()
+            self.last_maintenance = now
+            for (sessionID, threadID), last_used in list(self.thread_last_used.items()):
+                if now - last_used >= self.thread_ttl and sessionID in self.sessions and sessionID not in self.pins:
+                    if self.spill_thread(sessionID, threadID):
+                        evicted_threads.append((sessionID, threadID))
+            for sessionID in list(self.sessions):
+                if self.is_idle(sessionID, now, self.session_ttl):
+                    evicted_sessions.append((sessionID, self.spill_session(sessionID)))
+            resident_bytes = self.get_resident_bytes()
+            for sessionID in list(self.sessions):
+                if resident_bytes <= self.max_resident_bytes and len(self.sessions) <= self.max_sessions:
+                    break
+                if self.is_idle(sessionID, now, MIN_IDLE_SECONDS):
+                    resident_bytes -= self.sizes[sessionID]
+                    evicted_sessions.append((sessionID, self.spill_session(sessionID)))
+        # outside the lock: the callbacks may close AI handlers
+        if self.on_thread_evict:
+            for sessionID, threadID in evicted_threads:
+                self.on_thread_evict(sessionID, threadID)
+        if self.on_session_evict:
+            for sessionID, session in evicted_sessions:
+                self.on_session_evict(sessionID, session)
+
+    def get_stats(self):
+        """
+        Returns the store's counters: resident sessions and bytes, active threads, spilled sessions, evictions and rehydrations.
+        """
+        with self.lock:
+            stats = dict(self.stats)
+            stats["resident_sessions"] = len(self.sessions)
+            stats["active_threads"] = len(self.thread_last_used)
+            stats["resident_bytes"] = self.get_resident_bytes()
+            stats["spilled_sessions"] = len(self.keys_snapshot()) - len(self.sessions)
+            return stats
@@ -0,0 +1,53 @@
+"""
+Delta sync of a session's files between the client and the server.
+
+Both sides describe a folder with a manifest: a dict of file path -> hash of the file's
+record, plus one hash over the whole manifest. The client opens a session with just the
+manifest hash. If the server already holds the same files, that's the only round trip.
+Otherwise the client sends its manifest to /session/sync, the server replies with the
+paths it is missing (new or changed) and the paths it should drop, and the client sends
+only those records.
+"""
+
+import json
+import hashlib
+
+def record_hash(record):
+    """
+    Returns the hash of one file record (metadata and content).
+    """
+    return hashlib.sha256(json.dumps(record, sort_keys=True).encode('utf-8', errors='surrogatepass')).hexdigest()
+
+def build_manifest(files):
+    """
+    Returns the manifest of a list of file records: a dict of path -> record hash.
+    """
+    return {record["path"]: record_hash(record) for record in files}
+
+def manifest_hash(manifest):
+    """
+    Returns one hash for a whole manifest, independent of its order.
+    """
+    digest = hashlib.sha256()
+    for path in sorted(manifest):
+        digest.update(f"{path}\0{manifest[path]}\n".encode('utf-8', errors='surrogatepass'))
+    return digest.hexdigest()
+
+def diff_manifests(server_manifest, client_manifest):
+    """
+    Compares the server's manifest with the client's.
+    Returns the paths the server is missing or has an old version of, and the paths it should delete.
+    """
+    missing = [path for path, file_hash in client_manifest.items() if server_manifest.get(path) != file_hash]
+    deleted = [path for path in server_manifest if path not in client_manifest]
+    return missing, deleted
+
+def apply_delta(files, changed, deleted):
+    """
+    Returns the file records after replacing/adding the changed records and dropping the deleted paths.
+    """
+    deleted = set(deleted)
+    changed_by_path = {record["path"]: record for record in changed}
+    merged = [changed_by_path.pop(record["path"], record) for record in files if record["path"] not in deleted]
+    merged.extend(changed_by_path.values())
+    return merged
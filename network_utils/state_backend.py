@@ -0,0 +1,304 @@
+"""
+Where the server keeps its sessions, threads and messages.
+
+MemoryBackend keeps them in this process, in a memory-bounded SessionStore. It's the
+default, and all a single server process needs.
+
+SQLiteBackend keeps them in a SQLite database (WAL mode) that every server process on the
+host opens, so requests about a session can go to any worker:
+    DATADUDE_STATE=sqlite gunicorn -w 4 server:app
+
+Either way, the AI handlers themselves stay in the process that uses them. A thread only
+records its handler's state (handlerState: the IDs from AIHandler.get_state(), like the
+OpenAI thread, assistant and vector store IDs), and a process that doesn't have the handler
+restores one from those IDs.
+
+Thread records are dicts like {"startTime", "endTime", "ai_type", "setupJob", "setupStatus",
+"handlerState"}. Messages are kept apart from them, and read with get_messages().
+"""
+
+import os
+import json
+import time
+import sqlite3
+import threading
+from collections import OrderedDict
+
+from network_utils.session_store import SessionStore, STATE_DB_PATH, DEFAULT_THREAD_TTL, MAINTENANCE_INTERVAL, encode, decode
+
+SHARED_STATE_PATH = os.path.expanduser("~/.datadude/state.db")
+BUSY_TIMEOUT = 30 # seconds a process waits for another one's write to finish
+FILES_CACHE_SESSIONS = 8 # sessions whose files each process keeps decoded
+
+class StateBackend:
+    """
+    Interface for all state backends.
+    on_session_evict(sessionID, session) and on_thread_evict(sessionID, threadID) are called when
+    a session or thread is let go of in this process, to release what the server keeps alongside it.
+    """
+    on_session_evict = None
+    on_thread_evict = None
+
+    def has_session(self, sessionID: str):
+        raise NotImplementedError("Subclasses should implement this method")
+
+    def get_session(self, sessionID: str):
+        """
+        Returns the session ({"folder", "files", "fileHashes", "manifestHash"}), or None.
+        """
+        raise NotImplementedError("Subclasses should implement this method")
+
+    def save_session(self, sessionID: str, fields: dict):
+        """
+        Creates the session, or updates its fields. Its threads are kept.
+        """
+        raise NotImplementedError("Subclasses should implement this method")
+
+    def get_thread(self, sessionID: str, threadID: str):
+        raise NotImplementedError("Subclasses should implement this method")
+
+    def add_thread(self, sessionID: str, threadID: str, thread: dict):
+        raise NotImplementedError("Subclasses should implement this method")
+
+    def update_thread(self, sessionID: str, threadID: str, **fields):
+        raise NotImplementedError("Subclasses should implement this method")
+
+    def append_messages(self, sessionID: str, threadID: str, messages: list):
+        raise NotImplementedError("Subclasses should implement this method")
+
+    def get_messages(self, sessionID: str, threadID: str):
+        raise NotImplementedError("Subclasses should implement this method")
+
+    def find_setup_job(self, jobID: str):
+        """
+        Returns the thread record whose setup is the given background job, or None.
+        Lets a process answer for a job that another process is running.
+        """
+        return None
+
+    def pin(self, sessionID: str):
+        """
+        Called while a request is using a session.
+        """
+        pass
+
+    def unpin(self, sessionID: str):
+        pass
+
+    def touch_thread(self, sessionID: str, threadID: str):
+        pass
+
+    def maybe_enforce_limits(self):
+        pass
+
+    def get_stats(self):
+        return {}
+
+class MemoryBackend(StateBackend):
+    """
+    Sessions, threads and messages in this process's memory, as the session store's nested dicts.
+    """
+    def __init__(self, store: SessionStore = None):
+        self.store = store if store is not None else SessionStore()
+        self.store.on_session_evict = lambda sessionID, session: self.on_session_evict and self.on_session_evict(sessionID, session)
+        self.store.on_thread_evict = lambda sessionID, threadID: self.on_thread_evict and self.on_thread_evict(sessionID, threadID)
+
+    def has_session(self, sessionID):
+        return self.store.get(sessionID) is not None
+
+    def get_session(self, sessionID):
+        return self.store.get(sessionID)
+
+    def save_session(self, sessionID, fields):
+        session = self.store.get(sessionID)
+        if session is None:
+            self.store[sessionID] = dict(fields, threads={})
+        else:
+            session.update(fields)
+
+    def get_thread(self, sessionID, threadID):
+        session = self.store.get(sessionID)
+        return session["threads"].get(threadID) if session else None
+
+    def add_thread(self, sessionID, threadID, thread):
+        self.store[sessionID]["threads"][threadID] = dict(thread, messages=[])
+
+    def update_thread(self, sessionID, threadID, **fields):
+        self.store[sessionID]["threads"][threadID].update(fields)
+
+    def append_messages(self, sessionID, threadID, messages):
+        self.store[sessionID]["threads"][threadID]["messages"].extend(messages)
+
+    def get_messages(self, sessionID, threadID):
+        return self.store.get_thread_messages(sessionID, threadID)
+
+    def pin(self, sessionID):
+        self.store.pin(sessionID)
+
+    def unpin(self, sessionID):
+        self.store.unpin(sessionID)
+
+    def touch_thread(self, sessionID, threadID):
+        self.store.touch_thread(sessionID, threadID)
+
+    def maybe_enforce_limits(self):
+        self.store.maybe_enforce_limits()
+
+    def get_stats(self):
+        return dict(self.store.get_stats(), backend="memory")
+
+class SQLiteBackend(StateBackend):
+    """
+    Sessions, threads and messages in a SQLite database shared by the server processes on a host.
+    Each thread of each process gets its own connection. Decoded session files are cached per
+    process (for the FILES_CACHE_SESSIONS most recently used sessions) and checked against the
+    session's manifest hash, so a session's files are only read from disk again after they change.
+    """
+    def __init__(self, path=SHARED_STATE_PATH, thread_ttl=DEFAULT_THREAD_TTL, files_cache_sessions=FILES_CACHE_SESSIONS):
+        self.path = path
+        self.thread_ttl = thread_ttl
+        self.files_cache_sessions = files_cache_sessions
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        self.files_cache = OrderedDict() # sessionID -> (manifestHash, files, fileHashes)
+        self.thread_last_used = {} # (sessionID, threadID) -> time.monotonic(), for threads with a handler in this process
+        self.last_maintenance = time.monotonic()
+        self.stats = {"files_cache_hits": 0, "files_cache_misses": 0, "thread_evictions": 0}
+        self.get_db()
+
+    def get_db(self):
+        db = getattr(self.local, "db", None)
+        if db is None:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            db = sqlite3.connect(self.path, timeout=BUSY_TIMEOUT, isolation_level=None)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("PRAGMA synchronous=NORMAL")
+            db.execute("CREATE TABLE IF NOT EXISTS sessions (session_id TEXT PRIMARY KEY, folder TEXT, manifest_hash TEXT, files BLOB)")
+            db.execute("CREATE TABLE IF NOT EXISTS threads (thread_id TEXT PRIMARY KEY, session_id TEXT NOT NULL, setup_job TEXT, data TEXT NOT NULL)")
+            db.execute("CREATE INDEX IF NOT EXISTS threads_setup_job ON threads (setup_job)")
+            db.execute("CREATE TABLE IF NOT EXISTS messages (id INTEGER PRIMARY KEY AUTOINCREMENT, thread_id TEXT NOT NULL, data TEXT NOT NULL)")
+            db.execute("CREATE INDEX IF NOT EXISTS messages_thread ON messages (thread_id)")
+            self.local.db = db
+        return db
+
+    def has_session(self, sessionID):
+        return self.get_db().execute("SELECT 1 FROM sessions WHERE session_id = ?", (sessionID,)).fetchone() is not None
+
+    def get_session(self, sessionID):
+        db = self.get_db()
+        row = db.execute("SELECT folder, manifest_hash FROM sessions WHERE session_id = ?", (sessionID,)).fetchone()
+        if row is None:
+            return None
+        folder, manifestHash = row
+        with self.lock:
+            cached = self.files_cache.get(sessionID)
+            if cached and cached[0] == manifestHash:
+                self.files_cache.move_to_end(sessionID)
+                self.stats["files_cache_hits"] += 1
+                return {"folder": folder, "manifestHash": manifestHash, "files": cached[1], "fileHashes": cached[2]}
+        row = db.execute("SELECT manifest_hash, files FROM sessions WHERE session_id = ?", (sessionID,)).fetchone()
+        if row is None:
+            return None
+        manifestHash = row[0]
+        saved = decode(row[1])
+        self.cache_files(sessionID, manifestHash, saved["files"], saved["fileHashes"])
+        with self.lock:
+            self.stats["files_cache_misses"] += 1
+        return {"folder": folder, "manifestHash": manifestHash, "files": saved["files"], "fileHashes": saved["fileHashes"]}
+
+    def cache_files(self, sessionID, manifestHash, files, fileHashes):
+        with self.lock:
+            self.files_cache[sessionID] = (manifestHash, files, fileHashes)
+            self.files_cache.move_to_end(sessionID)
+            while len(self.files_cache) > self.files_cache_sessions:
+                self.files_cache.popitem(last=False)
+
+    def save_session(self, sessionID, fields):
+        db = self.get_db()
+        db.execute("INSERT INTO sessions (session_id, folder, manifest_hash, files) VALUES (?, ?, NULL, NULL) "
+                   "ON CONFLICT (session_id) DO UPDATE SET folder = excluded.folder", (sessionID, fields.get("folder")))
+        if "files" in fields:
+            row = db.execute("SELECT manifest_hash FROM sessions WHERE session_id = ?", (sessionID,)).fetchone()
+            if row[0] != fields["manifestHash"]:
+                # the files are only written when they changed
+                db.execute("UPDATE sessions SET manifest_hash = ?, files = ? WHERE session_id = ?",
+                           (fields["manifestHash"], encode({"files": fields["files"], "fileHashes": fields["fileHashes"]}), sessionID))
+            self.cache_files(sessionID, fields["manifestHash"], fields["files"], fields["fileHashes"])
+
+    def get_thread(self, sessionID, threadID):
+        row = self.get_db().execute("SELECT data FROM threads WHERE thread_id = ? AND session_id = ?", (threadID, sessionID)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def add_thread(self, sessionID, threadID, thread):
+        self.get_db().execute("INSERT INTO threads (thread_id, session_id, setup_job, data) VALUES (?, ?, ?, ?)",
+                              (threadID, sessionID, thread.get("setupJob"), json.dumps(thread)))
+
+    def update_thread(self, sessionID, threadID, **fields):
+        db = self.get_db()
+        # read, change and write the record in one write transaction, so processes don't undo each other's updates
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            row = db.execute("SELECT data FROM threads WHERE thread_id = ? AND session_id = ?", (threadID, sessionID)).fetchone()
+            if row is None:
+                raise KeyError(threadID)
+            thread = json.loads(row[0])
+            thread.update(fields)
+            db.execute("UPDATE threads SET data = ?, setup_job = ? WHERE thread_id = ?", (json.dumps(thread), thread.get("setupJob"), threadID))
+            db.execute("COMMIT")
+        except BaseException:
+            db.execute("ROLLBACK")
+            raise
+
+    def append_messages(self, sessionID, threadID, messages):
+        self.get_db().executemany("INSERT INTO messages (thread_id, data) VALUES (?, ?)", [(threadID, json.dumps(message)) for message in messages])
+
+    def get_messages(self, sessionID, threadID):
+        rows = self.get_db().execute("SELECT data FROM messages WHERE thread_id = ? ORDER BY id", (threadID,))
+        return [json.loads(row[0]) for row in rows]
+
+    def find_setup_job(self, jobID):
+        row = self.get_db().execute("SELECT data FROM threads WHERE setup_job = ?", (jobID,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def touch_thread(self, sessionID, threadID):
+        with self.lock:
+            self.thread_last_used[(sessionID, threadID)] = time.monotonic()
+
+    def maybe_enforce_limits(self):
+        """
+        Lets go of the handlers of threads that have been idle in this process for thread_ttl.
+        Their state is in the database, so any process can pick them back up.
+        """
+        now = time.monotonic()
+        if now - self.last_maintenance < MAINTENANCE_INTERVAL:
+            return
+        with self.lock:
+            self.last_maintenance = now
+            idle = [key for key, last_used in self.thread_last_used.items() if now - last_used >= self.thread_ttl]
+            for key in idle:
+                del self.thread_last_used[key]
+            self.stats["thread_evictions"] += len(idle)
+        if self.on_thread_evict:
+            for sessionID, threadID in idle:
+                self.on_thread_evict(sessionID, threadID)
+
+    def get_stats(self):
+        db = self.get_db()
+        with self.lock:
+            stats = dict(self.stats)
+            stats["active_threads"] = len(self.thread_last_used)
+            stats["cached_sessions"] = len(self.files_cache)
+        stats["sessions"] = db.execute("SELECT COUNT(*) FROM sessions").fetchone()[0]
+        stats["threads"] = db.execute("SELECT COUNT(*) FROM threads").fetchone()[0]
+        stats["backend"] = "sqlite"
+        return stats
+
+def create_state_backend(kind="memory", path=None, **options):
+    """
+    Returns a new state backend: "memory" (options are SessionStore's) or "sqlite" (options are SQLiteBackend's).
+    """
+    if kind == "memory":
+        return MemoryBackend(SessionStore(path or STATE_DB_PATH, **options))
+    if kind == "sqlite":
+        return SQLiteBackend(path or SHARED_STATE_PATH, **options)
+    raise ValueError(f"Unknown state backend: {kind}")
@@ -0,0 +1,158 @@
+"""
+Span tracing of single requests, from the client through the server to the AI handlers
+and the OpenAI API, for finding out why one session is slow.
+
+The client makes a trace ID and sends it with every request in the TRACE_HEADER header.
+The scanner subprocess gets it in the DATADUDE_TRACE_ID environment variable. Spans
+(the scan, token validation, HTTP calls, each handler stage, each OpenAI call) are tagged
+with the trace ID and appended to a file in the Chrome trace event format, which opens in
+chrome://tracing or https://ui.perfetto.dev. Client, scanner and server can all write to
+the same file, each as its own process in the timeline.
+
+Tracing is on when the DATADUDE_TRACE environment variable names the file (or with the
+client's and server's --trace option). When it's off, span() returns a shared do-nothing
+context manager and nothing is recorded.
+"""
+
+import os
+import json
+import time
+import uuid
+import threading
+import contextvars
+from contextlib import nullcontext
+
+TRACE_ENV = "DATADUDE_TRACE"
+TRACE_ID_ENV = "DATADUDE_TRACE_ID"
+TRACE_HEADER = "X-Trace-ID"
+
+current_trace_id = contextvars.ContextVar("trace_id", default=None)
+NO_SPAN = nullcontext()
+tracer = None # set by configure()
+
+class Tracer:
+    """
+    Appends trace events to a file. Safe to share between threads, and between processes
+    writing to the same file (each event is a single append).
+    """
+    def __init__(self, path, process_name):
+        self.path = path
+        self.process_name = process_name
+        self.named_pid = None
+        self.lock = threading.Lock()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        try:
+            # the trace event format allows the array's closing bracket to be left out
+            fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL | os.O_APPEND, 0o644)
+            os.write(fd, b"[\n")
+        except FileExistsError:
+            fd = os.open(path, os.O_WRONLY | os.O_APPEND)
+        self.fd = fd
+
+    def write(self, event):
+        data = (json.dumps(event, default=str) + ",\n").encode('utf-8')
+        with self.lock:
+            os.write(self.fd, data)
+
+    def record(self, name, start, duration, args):
+        """
+        Records a finished span. start is a time.time() timestamp, duration is in seconds.
+        """
+        # looked up every time, since server workers may be forked after the tracer is made
+        pid = os.getpid()
+        if pid != self.named_pid:
+            self.named_pid = pid
+            self.write({"name": "process_name", "ph": "M", "pid": pid, "tid": 0, "args": {"name": f"{self.process_name} ({pid})"}})
+        trace_id = current_trace_id.get()
+        if trace_id is not None:
+            args = dict(args, trace_id=trace_id)
+        self.write({"name": name, "ph": "X", "ts": int(start * 1e6), "dur": int(duration * 1e6),
+                    "pid": pid, "tid": threading.get_ident(), "args": args})
+
+class Span:
+    """
+    A span in progress. Use it as a context manager, or call end() when it's over.
+    """
+    def __init__(self, name, args):
+        self.name = name
+        self.args = args
+        self.start = time.time()
+        self.start_counter = time.perf_counter()
+
+    def end(self, error=None):
+        if error is not None:
+            self.args["error"] = f"{type(error).__name__}: {error}"
+        if tracer is not None:
+            tracer.record(self.name, self.start, time.perf_counter() - self.start_counter, self.args)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, error_type, error, traceback):
+        self.end(error if isinstance(error, Exception) else None)
+
+def configure(path, process_name):
+    """
+    Turns tracing on, writing to path. A path of None turns it off.
+    """
+    global tracer
+    tracer = Tracer(os.path.expanduser(path), process_name) if path else None
+
+def configure_from_env(process_name):
+    """
+    Turns tracing on if DATADUDE_TRACE is set, and picks up the trace ID of DATADUDE_TRACE_ID.
+    """
+    configure(os.environ.get(TRACE_ENV), process_name)
+    if tracer is not None and os.environ.get(TRACE_ID_ENV):
+        set_trace_id(os.environ[TRACE_ID_ENV])
+
+def is_enabled():
+    return tracer is not None
+
+def new_trace_id():
+    return uuid.uuid4().hex
+
+def get_trace_id():
+    return current_trace_id.get()
+
+def set_trace_id(trace_id):
+    """
+    Makes trace_id the trace of what runs next in this thread (or task).
+    """
+    current_trace_id.set(trace_id)
+
+def span(name, **args):
+    """
+    Returns a context manager that records the code in it as a span, if tracing is on.
+    """
+    if tracer is None:
+        return NO_SPAN
+    return Span(name, args)
+
+def start_span(name, **args):
+    """
+    Returns a started Span to end() later, or None if tracing is off.
+    """
+    if tracer is None:
+        return None
+    return Span(name, args)
+
+def record_span(name, duration, **args):
+    """
+    Records a span that just ended after duration seconds.
+    """
+    if tracer is not None:
+        tracer.record(name, time.time() - duration, duration, args)
+
+def carry(coro):
+    """
+    Returns coro, set to run in the current trace wherever it runs (e.g. on another thread's event loop).
+    """
+    trace_id = current_trace_id.get()
+    if tracer is None or trace_id is None:
+        return coro
+
+    async def traced():
+        current_trace_id.set(trace_id)
+        return await coro
+    return traced()
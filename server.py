@@ -1,14 +1,31 @@
-from flask import Flask, request, jsonify
+from flask import Flask, request, jsonify, Response, stream_with_context, g
 import uuid
 import os
+import time
+import argparse
 from ai_utils.ai_factory import get_ai_handler
 from ai_utils.ai_base import AIHandler  # The base class to define type hints
 from datetime import datetime
+from network_utils.compression import DecompressionMiddleware, DECODE_SECONDS_KEY
+from network_utils import event_stream
+from network_utils.async_runner import AsyncRunner
+from network_utils.session_sync import build_manifest, manifest_hash, diff_manifests, apply_delta
+from network_utils.state_backend import StateBackend, create_state_backend
+from network_utils.session_store import DEFAULT_MAX_RESIDENT_BYTES, DEFAULT_MAX_SESSIONS, DEFAULT_SESSION_TTL, DEFAULT_THREAD_TTL
+from ai_utils.metadata_query import MetadataIndex
+from ai_utils.symbol_query import SymbolIndex
+from ai_utils.retrieval_index import release_index
+from ai_utils.answer_cache import answer_cache
+from ai_utils.run_waiter import get_run_stats
+from network_utils import metrics, tracing
+from network_utils.metrics import time_stage, observe_client_timings
 
 # Create an instance of AIHandler based on the desired type
 # For example, use "chat_completions" or "assistants"
 DEFAULT_AI_HANDLER = "assistants"
 ai_handlers = {} # store ai handlers for each thread
+local_indexes = {} # sessionID -> (manifestHash, MetadataIndex, SymbolIndex), built on the session's first question
+async_runner: AsyncRunner = None # event loop for AI handler work, only in async mode (--async)
 
 
 """
@@ -22,9 +39,14 @@ messagePool:
                 messages: [],
                 startTime: "",
                 endTime: "",
+                setupJob: "", (async mode only)
+                setupStatus: "", (async mode only: running, done or failed)
+                handlerState: {}, (IDs to restore the thread's AI handler from)
             },
         },
         files: [],
+        fileHashes: {<path>: <record hash>},
+        manifestHash: "",
         gitinfo: {},
     },
     <sessionID>: {
@@ -52,17 +74,24 @@ context: { folder: "", files: [{ filename: "", modified: "", size: "", ...}], gi
 It makes sense to keep the contexts common under the sessionID since the sessionID
 represents the folder itself.
 Also, the threadID is not the same as the thread_id used by the AI system.
+
+The pool is a StateBackend (see network_utils/state_backend.py). The default one keeps the
+structure above in memory, and keeps memory use bounded by spilling idle sessions and thread
+histories to disk. The SQLite one keeps it in a database shared by several server processes
+(DATADUDE_STATE=sqlite, or --state sqlite).
 """
-messagePool = {}
+messagePool: StateBackend = None # set by use_state_backend() below
 
 app = Flask(__name__)
+# Clients may gzip/zstd compress request bodies, decode them before Flask sees them
+app.wsgi_app = DecompressionMiddleware(app.wsgi_app)
 
 ########## Helper Functions ###########
 def validate_sessionID(sessionID: str):
     """
     Returns False if given sessionID is invalid. Returns True if valid.
     """
-    if not messagePool.get(sessionID):
+    if not messagePool.has_session(sessionID):
         return False
     return True
 
@@ -70,16 +99,227 @@ def validate_threadID(sessionID: str, threadID: str):
     """
     Returns False if given threadID not part of session. Returns True if valid.
     """
-    if len(messagePool[sessionID]["threads"]) == 0:
-        return False
-    # iterate through messagePool threads to see if the given threadID exists
-    if not messagePool[sessionID]["threads"].get(threadID):
+    if not messagePool.get_thread(sessionID, threadID):
         return False
     return True
     
+def get_session_files(sessionID: str, data: object):
+    """
+    Works out the session's files from a /session request.
+    Returns (files, None), or (None, error response).
+    A 409 response tells the client to sync its manifest and send the missing files.
+    """
+    session = messagePool.get_session(sessionID)
+    if "files" in data and not data.get("delta"):
+        # the client sent everything
+        return [dict(file) for file in data.get("files")], None
+    if "manifestHash" not in data:
+        return None, (jsonify({'error': 'No file object in the request'}), 400)
+
+    stale = (jsonify({'error': 'Session files are out of date. Sync the manifest first.', 'sync': True}), 409)
+    known = session is not None and "fileHashes" in session
+    if data.get("delta"):
+        # a first session's delta is all of its files
+        files = apply_delta(session["files"] if known else [], [dict(file) for file in data.get("files", [])], data.get("deleted", []))
+        if manifest_hash(build_manifest(files)) != data.get("manifestHash"):
+            # something changed on the client or the server in between, start over
+            return None, stale
+        return files, None
+    if not known or session["manifestHash"] != data.get("manifestHash"):
+        return None, stale
+    return session["files"], None
+
+def close_ai_handler(threadID: str):
+    ai_handler = ai_handlers.pop(threadID, None)
+    if ai_handler:
+        ai_handler.close()
+
+def release_session(sessionID: str, session: object):
+    """
+    Lets go of what the server keeps alongside a session that was spilled to disk.
+    """
+    for threadID in session["threads"]:
+        close_ai_handler(threadID)
+    local_indexes.pop(sessionID, None)
+    release_index(sessionID)
+
+def release_thread(sessionID: str, threadID: str):
+    """
+    Lets go of the AI handler of a thread that's been idle. It's restored if the thread is used again.
+    """
+    close_ai_handler(threadID)
+
+def use_state_backend(backend: StateBackend):
+    """
+    Makes backend the server's messagePool.
+    """
+    global messagePool
+    backend.on_session_evict = release_session
+    backend.on_thread_evict = release_thread
+    messagePool = backend
+
+use_state_backend(create_state_backend(os.environ.get("DATADUDE_STATE", "memory"), os.environ.get("DATADUDE_STATE_DB")))
+
+# traced if DATADUDE_TRACE names a file (or with --trace), see network_utils/tracing.py
+tracing.configure(os.environ.get(tracing.TRACE_ENV), "server")
+
+def count_live_sessions():
+    stats = messagePool.get_stats()
+    if "sessions" in stats:
+        return stats["sessions"]
+    return stats.get("resident_sessions", 0) + stats.get("spilled_sessions", 0)
+
+metrics.registry.add(metrics.Gauge("datadude_live_sessions", "Sessions the server holds", count_live_sessions))
+metrics.registry.add(metrics.Gauge("datadude_live_threads", "Threads used within the thread TTL", lambda: messagePool.get_stats().get("active_threads", 0)))
+metrics.registry.add(metrics.Gauge("datadude_ai_handlers", "AI handlers live in this process", lambda: len(ai_handlers)))
+
+async def setup_thread_async(sessionID: str, threadID: str, ai_handler: AIHandler, context: object):
+    """
+    Sets up a thread's AI handler as a background job, and records how it went in the thread,
+    so every server process can tell (and restore the handler once it's done).
+    """
+    try:
+        with time_stage("handler_setup"):
+            await ai_handler.setup_async(context)
+    except Exception as e:
+        messagePool.update_thread(sessionID, threadID, setupStatus="failed", setupError=str(e))
+        raise
+    messagePool.update_thread(sessionID, threadID, setupStatus="done", handlerState=ai_handler.get_state())
+
+def get_thread_handler(sessionID: str, threadID: str):
+    """
+    Returns the thread's AI handler. If this process doesn't have one (the thread was set up by
+    another process, or its handler was let go of while it was idle), it's restored from the
+    thread's handlerState.
+    """
+    ai_handler = ai_handlers.get(threadID)
+    if ai_handler is not None:
+        return ai_handler
+    thread = messagePool.get_thread(sessionID, threadID)
+    context = {"files": messagePool.get_session(sessionID)["files"]}
+    ai_handler = get_ai_handler(thread["ai_type"], sessionID=sessionID, context=None)
+    with time_stage("handler_restore"):
+        if async_runner:
+            async_runner.run(ai_handler.restore_async(thread.get("handlerState"), context))
+        else:
+            ai_handler.restore(thread.get("handlerState"), context)
+    handlerState = ai_handler.get_state()
+    if handlerState != thread.get("handlerState"):
+        # set up from scratch, e.g. the thread's OpenAI resources were gone
+        messagePool.update_thread(sessionID, threadID, handlerState=handlerState)
+    current = ai_handlers.setdefault(threadID, ai_handler)
+    if current is not ai_handler:
+        # another request for the thread got there first
+        ai_handler.close()
+    return current
+
+def get_local_indexes(sessionID: str):
+    """
+    Returns the session's MetadataIndex and SymbolIndex, rebuilt if the session's files changed.
+    """
+    session = messagePool.get_session(sessionID)
+    cached = local_indexes.get(sessionID)
+    if not cached or cached[0] != session["manifestHash"]:
+        files = session["files"]
+        cached = (session["manifestHash"], MetadataIndex(files), SymbolIndex(files))
+        local_indexes[sessionID] = cached
+    return cached[1], cached[2]
+
+def stream_response(sessionID: str, threadID: str, ai_handler: AIHandler, message: str, prompt: str = None, cache_key: tuple = None):
+    """
+    Generator of server-sent events relaying the AI handler's response as it's generated.
+    The handler gets prompt (the message with anything added to it), or the message itself.
+    The full response is saved in the session once the handler is done, and in the answer
+    cache under cache_key (sessionID, context hash, handler type, message) if there is one.
+    The session is pinned in memory while the response streams, which outlasts the request's own pin.
+    """
+    if prompt is None:
+        prompt = message
+    chunks = []
+    messagePool.pin(sessionID)
+    try:
+        try:
+            with time_stage("response"):
+                if async_runner:
+                    chunks_iter = async_runner.iter_async(ai_handler.get_response_stream_async(input=prompt))
+                else:
+                    chunks_iter = ai_handler.get_response_stream(input=prompt)
+                for chunk in chunks_iter:
+                    chunks.append(chunk)
+                    yield event_stream.format_event({"delta": chunk})
+        except Exception as e:
+            print(f"server.py: Error: streaming response failed: {e}")
+            yield event_stream.format_event({"error": "Internal server error. The response was cut short."})
+            return
+        response = ''.join(chunks)
+        messagePool.append_messages(sessionID, threadID, [{"user": message.strip()}, {"system": response}])
+        if cache_key:
+            answer_cache.put(*cache_key, response)
+        yield event_stream.format_event({"done": True, "message": response})
+    finally:
+        messagePool.unpin(sessionID)
+
 #######################################
 
 ########## API Endpoints ###########
+@app.before_request
+def start_trace():
+    """
+    Picks up the client's trace ID, and starts the request's span, if tracing is on.
+    """
+    if tracing.is_enabled():
+        # a worker thread serves many requests, so the last one's trace is replaced either way
+        tracing.set_trace_id(request.headers.get(tracing.TRACE_HEADER))
+        rule = request.url_rule.rule if request.url_rule else request.path
+        g.request_span = tracing.start_span(f"{request.method} {rule}", sessionID=(request.view_args or {}).get("sessionID"))
+
+@app.teardown_request
+def end_trace(error=None):
+    span = g.pop("request_span", None)
+    if span is not None:
+        span.end(error)
+
+@app.before_request
+def start_request_timer():
+    """
+    Times the request for /metrics, and decodes its JSON body up front to time that too
+    (on top of decompressing it, which DecompressionMiddleware timed).
+    """
+    g.request_start = time.perf_counter()
+    if request.is_json:
+        start = time.perf_counter()
+        request.get_json(silent=True) # parsed once, and kept for the endpoint
+        decode_seconds = time.perf_counter() - start + request.environ.get(DECODE_SECONDS_KEY, 0)
+        metrics.stage_seconds.observe(decode_seconds, stage="request_decode")
+
+@app.after_request
+def count_request(response):
+    endpoint = request.url_rule.rule if request.url_rule else "unmatched"
+    metrics.http_requests.inc(endpoint=endpoint, status=response.status_code)
+    if "request_start" in g:
+        metrics.http_request_seconds.observe(time.perf_counter() - g.request_start, endpoint=endpoint)
+    if g.get("request_span") is not None:
+        g.request_span.args["status"] = response.status_code
+    return response
+
+@app.before_request
+def pin_session():
+    """
+    Keeps the session a request is about in memory until the request is done.
+    """
+    sessionID = (request.view_args or {}).get("sessionID")
+    if sessionID:
+        g.pinned_session = sessionID.strip()
+        messagePool.pin(g.pinned_session)
+
+@app.teardown_request
+def unpin_session(error=None):
+    # a streamed response tears the request down a second time when it's done, pin or no pin
+    sessionID = g.pop("pinned_session", None)
+    if sessionID:
+        messagePool.unpin(sessionID)
+    messagePool.maybe_enforce_limits()
+
 @app.route('/')
 def home():
     return "DataDude Server is running"
@@ -100,6 +340,15 @@ def start_session():
     
     
     sessionID = str(uuid.uuid5(uuid.NAMESPACE_DNS, path))
+
+    # Some context is required, even if it's just a refresh of what's already there.
+    # Clients can send all files, only the ones that changed (delta), or just a manifest
+    # hash when they expect the server to have the files already.
+    observe_client_timings(data.get("timings"))
+    files, error = get_session_files(sessionID, data)
+    if error:
+        return error
+
     # create new thread, which is completely independent of the AI handler's threads
     # they may have the same data, or not depending on the handler used.
     # for example, chat completions API doesn't use threads.
@@ -108,50 +357,95 @@ def start_session():
     ai_type = data.get("ai_type", DEFAULT_AI_HANDLER)
 
     
-    # If path already in message pool, just create a new thread
-    if messagePool.get(sessionID):
-        messagePool[sessionID]["threads"][threadID] = {
-            "startTime": datetime.now().isoformat(),
-            "endTime": "",
-            "messages": [],
-            "ai_type": ai_type
-        }
-    else:
-    # If this is a new session completely, add all of the info to the message pool
-        messagePool[sessionID] = {
-            "folder": os.path.basename(path),
-            "threads": {
-                threadID: {
-                    "startTime": datetime.now().isoformat(),
-                    "endTime": "",
-                    "messages": [],
-                    "ai_type": ai_type
-                },
-            },
-        }
-   
-
-    # Some context is required, even if it's just a refresh of what's already there.
-    # In the future, we may decide to use the file data already attached to the
-    # session in the message pool if that's available.
-    if "files" not in data:
-        return jsonify({'error': 'No file object in the request'}), 400
-    files = data.get("files")
+    # Add the session's info to the message pool (or refresh it, if the path is already there),
+    # then create the new thread
     # git_info = data.get("git_info")
-    messagePool[sessionID]["files"] = [dict(file) for file in files]
-    # messagePool[sessionID]["gitinfo"] = git_info
+    manifest = build_manifest(files)
+    messagePool.save_session(sessionID, {
+        "folder": os.path.basename(path),
+        "files": files,
+        "fileHashes": manifest,
+        "manifestHash": manifest_hash(manifest),
+        # "gitinfo": git_info,
+    })
+    # answers about the session's previous files no longer apply
+    answer_cache.invalidate(sessionID, manifest_hash(manifest))
+    thread = {
+        "startTime": datetime.now().isoformat(),
+        "endTime": "",
+        "ai_type": ai_type
+    }
+    if async_runner:
+        thread["setupStatus"] = "running"
+    messagePool.add_thread(sessionID, threadID, thread)
     context = {
         "files": files,
         # "git_info": {item['key']: item['value'] for item in git_info}
     }
 
+    messagePool.touch_thread(sessionID, threadID)
+
     # Create a new AI handler for each thread/client instance, even if it's the same session.
     if not ai_handlers.get(threadID):
-        ai_handler = get_ai_handler(ai_type, sessionID=sessionID, context=context) 
+        if async_runner:
+            # In async mode, setup runs as a background job. The client polls /jobs/<jobID> until it's done.
+            ai_handler = get_ai_handler(ai_type, sessionID=sessionID, context=None)
+            ai_handlers[threadID] = ai_handler
+            jobID = async_runner.start_job(setup_thread_async(sessionID, threadID, ai_handler, context))
+            messagePool.update_thread(sessionID, threadID, setupJob=jobID)
+            return jsonify({'sessionID': sessionID, 'threadID': threadID, 'jobID': jobID}), 202
+        with time_stage("handler_setup"):
+            ai_handler = get_ai_handler(ai_type, sessionID=sessionID, context=context)
         ai_handlers[threadID] = ai_handler
+        messagePool.update_thread(sessionID, threadID, handlerState=ai_handler.get_state())
+
+    return jsonify({'sessionID': sessionID, 'threadID': threadID}), 200
 
+@app.route('/session/sync', methods=['POST'])
+def sync_session():
+    """
+    Compares the client's manifest (file path -> record hash) with the session's files.
+    Returns the paths the server needs the client to send, and the paths it will drop.
+    """
+    data = request.get_json()
+    if "path" not in data or "manifest" not in data:
+        return jsonify({'error': 'The request needs a path and a manifest'}), 400
+    sessionID = str(uuid.uuid5(uuid.NAMESPACE_DNS, data.get("path")))
+    session = messagePool.get_session(sessionID) or {}
+    missing, deleted = diff_manifests(session.get("fileHashes", {}), data.get("manifest"))
+    return jsonify({'sessionID': sessionID, 'missing': missing, 'deleted': deleted}), 200
+
+@app.route('/session/<sessionID>/threads/<threadID>', methods=['DELETE'])
+def end_thread(sessionID: str, threadID: str):
+    """
+    Ends a thread. Its AI handler is closed, which lets go of the session context it shared with other threads.
+    """
+    sessionID = sessionID.strip()
+    threadID = threadID.strip()
+    if not validate_sessionID(sessionID):
+        return jsonify({'error': 'Invalid sessionID.'}), 400
+    if not validate_threadID(sessionID, threadID):
+        return jsonify({'error': 'Invalid threadID.'}), 400
+    messagePool.update_thread(sessionID, threadID, endTime=datetime.now().isoformat())
+    close_ai_handler(threadID)
     return jsonify({'sessionID': sessionID, 'threadID': threadID}), 200
 
+@app.route('/jobs/<jobID>', methods=['GET'])
+def get_job_status(jobID: str):
+    """
+    Returns the status of a background job (running, done, failed or cancelled).
+    """
+    jobID = jobID.strip()
+    job = async_runner.get_job(jobID) if async_runner else None
+    if not job:
+        # another server process may be running it
+        thread = messagePool.find_setup_job(jobID)
+        if thread:
+            job = {"id": jobID, "status": thread["setupStatus"], "error": thread.get("setupError")}
+    if not job:
+        return jsonify({'error': 'Invalid jobID.'}), 404
+    return jsonify(job), 200
+
 @app.route('/chat/<sessionID>', methods=['POST'])
 def answer_message(sessionID: str):
     """
@@ -165,31 +459,125 @@ def answer_message(sessionID: str):
     if "message" not in data:
         return jsonify({'error': 'No message in the request'}), 400
     threadID: str = data.get("threadID")
+    observe_client_timings(data.get("timings"))
     sessionID = sessionID.strip()
     if not validate_sessionID(sessionID):
         return jsonify({'error': 'Invalid sessionID.'}), 400
     threadID = threadID.strip()
     if not validate_threadID(sessionID, threadID):
         return jsonify({'error': 'Invalid threadID.'}), 400
+    thread = messagePool.get_thread(sessionID, threadID)
+    if thread["endTime"]:
+        return jsonify({'error': 'The thread has ended.'}), 400
 
     message: str = data.get("message")
     if message == "":
         response = "Sup!"
-        messagePool[sessionID]["threads"][threadID]["messages"].append({"system": response})
+        messagePool.append_messages(sessionID, threadID, [{"system": response}])
         return jsonify({'message': response}), 200
     
-    if not ai_handlers.get(threadID):
-        # something is wrong. we should not be creating a new ai handler here.
-        return jsonify({'error': 'Internal server error. Failed to retrieve AI handler.'}), 500
-    ai_handler: AIHandler = ai_handlers.get(threadID)
-    response = ai_handler.get_response( input=message)
+    # Questions about file metadata (latest file, path to a file, ...) and code symbols (where a
+    # function is defined or used, ...) are answered right here, without a round trip to the model.
+    # Send "skipLocal": true to always ask the model.
+    prompt = message
+    if not data.get("skipLocal"):
+        metadata_index, symbol_index = get_local_indexes(sessionID)
+        response = metadata_index.answer(message)
+        if response is None:
+            response = symbol_index.answer(message)
+        if response is not None:
+            messagePool.append_messages(sessionID, threadID, [{"user": message.strip()}, {"system": response}])
+            return jsonify({'message': response}), 200
+        # hand the model the code of the functions and classes the question names
+        excerpts = symbol_index.get_excerpts(message)
+        if excerpts:
+            prompt = f"{message}\n\n{excerpts}"
 
-    messagePool[sessionID]["threads"][threadID]["messages"].append({"user": message.strip()})
-    messagePool[sessionID]["threads"][threadID]["messages"].append({"system": response})
+    jobID = thread.get("setupJob")
+    if thread.get("setupStatus") == "running":
+        return jsonify({'error': 'The session is still being set up.', 'jobID': jobID}), 409
+    if thread.get("setupStatus") == "failed":
+        return jsonify({'error': f'The session failed to set up: {thread.get("setupError")}', 'jobID': jobID}), 500
+    messagePool.touch_thread(sessionID, threadID)
+    ai_handler: AIHandler = get_thread_handler(sessionID, threadID)
+
+    # A question asked before about the same files, of the same kind of handler, gets the same answer.
+    # Handlers that keep the conversation only share answers to a thread's first message, since
+    # follow-ups depend on what came before. A cached answer is still added to their conversation.
+    # Send "noCache": true to ask the model again (its new answer replaces the cached one).
+    cache_key = None
+    if not ai_handler.keeps_history or not messagePool.get_messages(sessionID, threadID):
+        cache_key = (sessionID, messagePool.get_session(sessionID)["manifestHash"], thread["ai_type"], message)
+    if cache_key and not data.get("noCache"):
+        response = answer_cache.get(*cache_key)
+        if response is not None:
+            if async_runner:
+                async_runner.run(ai_handler.add_exchange_async(message, response))
+            else:
+                ai_handler.add_exchange(message, response)
+            messagePool.append_messages(sessionID, threadID, [{"user": message.strip()}, {"system": response}])
+            return jsonify({'message': response, 'cached': True}), 200
+
+    if data.get("stream"):
+        return Response(stream_with_context(stream_response(sessionID, threadID, ai_handler, message, prompt, cache_key)), mimetype=event_stream.MIMETYPE)
+    with time_stage("response"):
+        if async_runner:
+            response = async_runner.run(ai_handler.get_response_async(input=prompt))
+        else:
+            response = ai_handler.get_response(input=prompt)
+
+    messagePool.append_messages(sessionID, threadID, [{"user": message.strip()}, {"system": response}])
+    if cache_key:
+        answer_cache.put(*cache_key, response)
 
     # Return message back to user
     return {'message': response}, 200
+
+@app.route('/stats', methods=['GET'])
+def get_stats():
+    """
+    Returns the state backend's counters (resident size, evictions, rehydrations, ...), the answer
+    cache's hits and misses, the recent assistant runs' wait times and the number of live AI handlers.
+    """
+    return jsonify({'sessions': messagePool.get_stats(), 'answerCache': answer_cache.get_stats(), 'runs': get_run_stats(),
+                    'aiHandlers': len(ai_handlers)}), 200
+
+@app.route('/metrics', methods=['GET'])
+def get_metrics():
+    """
+    Returns the server's metrics in the Prometheus text format: time per stage, requests,
+    OpenAI calls and errors by endpoint, tokens by session, and live sessions and threads.
+    """
+    return Response(metrics.registry.render(), content_type=metrics.CONTENT_TYPE)
 #####################################
 
 if __name__ == '__main__':
-    app.run()  
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="DataDude server")
+    parser.add_argument('--async', dest='async_mode', action='store_true',
+                        help='Run AI handler work on an asyncio event loop, with session setup as background jobs')
+    parser.add_argument('--state', choices=['memory', 'sqlite'], default=os.environ.get("DATADUDE_STATE", "memory"),
+                        help='Where sessions are kept: in this process, or in a SQLite database shared by several server processes')
+    parser.add_argument('--state-db', type=str, default=os.environ.get("DATADUDE_STATE_DB"),
+                        help='Database file of the state backend (spilled sessions for memory, everything for sqlite)')
+    parser.add_argument('--max-memory-mb', type=int, default=DEFAULT_MAX_RESIDENT_BYTES // (1024 * 1024),
+                        help='Sessions over this much memory (files and messages) are spilled to disk, least recently used first')
+    parser.add_argument('--max-sessions', type=int, default=DEFAULT_MAX_SESSIONS, help='Most sessions kept in memory')
+    parser.add_argument('--session-ttl', type=int, default=DEFAULT_SESSION_TTL, help='Seconds before an idle session is spilled to disk')
+    parser.add_argument('--thread-ttl', type=int, default=DEFAULT_THREAD_TTL,
+                        help="Seconds before an idle thread's AI handler is let go of and its messages are spilled to disk")
+    parser.add_argument('--trace', type=str, default=os.environ.get(tracing.TRACE_ENV),
+                        help='Append spans of the requests to this file, in the Chrome trace event format')
+    parser.add_argument('--answer-cache-entries', type=int, default=answer_cache.max_entries,
+                        help='Most answers kept for repeated questions (0 turns the answer cache off)')
+    args = parser.parse_args()
+    if args.trace != os.environ.get(tracing.TRACE_ENV):
+        tracing.configure(args.trace, "server")
+    answer_cache.max_entries = args.answer_cache_entries
+    if args.state == "memory":
+        use_state_backend(create_state_backend("memory", args.state_db, max_resident_bytes=args.max_memory_mb * 1024 * 1024,
+                                               max_sessions=args.max_sessions, session_ttl=args.session_ttl, thread_ttl=args.thread_ttl))
+    else:
+        use_state_backend(create_state_backend("sqlite", args.state_db, thread_ttl=args.thread_ttl))
+    if args.async_mode:
+        async_runner = AsyncRunner()
+    app.run(threaded=True)  
\ No newline at end of file
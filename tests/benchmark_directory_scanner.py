@@ -0,0 +1,97 @@
+"""
+Compares the scandir/thread pool scanner against the original os.walk scanner
+on synthetic trees. Usage:
+    python tests/benchmark_directory_scanner.py                  # 10k, 100k and 1M files
+    python tests/benchmark_directory_scanner.py --sizes 10000 --workers 8
+Building the 1M file tree takes a while and needs a few GB of free inodes/disk.
+"""
+
+import sys
+import os
+import time
+import shutil
+import argparse
+import tempfile
+from datetime import datetime
+
+# Add the root datadude/ folder to sys.path
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from directory_utils.directory_scanner import get_directory_structure, CONTENT_EXTENSIONS
+
+DEFAULT_SIZES = [10000, 100000, 1000000]
+FILES_PER_DIRECTORY = 100
+DIRECTORIES_PER_DIRECTORY = 10
+EXTENSIONS = ['.py', '.md', '.js', '.txt', '.json']
+
+def os_walk_directory_structure(rootdir, omit_paths=None):
+    """
+    The original os.walk scanner, kept here as the baseline.
+    """
+    if omit_paths is None:
+        omit_paths = []
+    file_info_list = []
+    for dirpath, dirnames, filenames in os.walk(rootdir):
+        dirnames[:] = [d for d in dirnames if d not in omit_paths]
+        filenames[:] = [f for f in filenames if f not in omit_paths]
+        for file in filenames:
+            file_path = os.path.join(dirpath, file)
+            file_info = {
+                "name": file,
+                "path": file_path,
+                "size": os.path.getsize(file_path),
+                "lastModified": datetime.fromtimestamp(os.path.getmtime(file_path)).isoformat(),
+            }
+            if file.endswith(CONTENT_EXTENSIONS):
+                with open(file_path, 'r') as f:
+                    file_info['content'] = f.read()
+            file_info_list.append(file_info)
+    return file_info_list
+
+def build_tree(rootdir, file_count):
+    """
+    Creates file_count small files under rootdir, FILES_PER_DIRECTORY per folder,
+    nested DIRECTORIES_PER_DIRECTORY wide.
+    """
+    created = 0
+    queue = [rootdir]
+    while created < file_count:
+        dirpath = queue.pop(0)
+        os.makedirs(dirpath, exist_ok=True)
+        for i in range(min(FILES_PER_DIRECTORY, file_count - created)):
+            extension = EXTENSIONS[i % len(EXTENSIONS)]
+            with open(os.path.join(dirpath, f"file_{i}{extension}"), 'w') as file:
+                file.write(f"# synthetic file {created}\n" * 4)
+            created += 1
+        for i in range(DIRECTORIES_PER_DIRECTORY):
+            queue.append(os.path.join(dirpath, f"dir_{i}"))
+
+def time_scan(fn, *args):
+    start = time.perf_counter()
+    result = fn(*args)
+    return time.perf_counter() - start, result
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the directory scanner")
+    parser.add_argument('--sizes', type=int, nargs='+', default=DEFAULT_SIZES, help='Number of files in each synthetic tree')
+    parser.add_argument('--workers', type=int, default=None, help='Threads used by the new scanner')
+    parser.add_argument('--root', type=str, default=None, help='Where to build the trees (defaults to a temp folder)')
+    args = parser.parse_args()
+
+    base_dir = args.root or tempfile.mkdtemp(prefix="datadude_bench_")
+    print(f"{'files':>10} {'os.walk (s)':>12} {'scandir (s)':>12} {'speedup':>8}")
+    try:
+        for size in args.sizes:
+            rootdir = os.path.join(base_dir, f"tree_{size}")
+            if not os.path.exists(rootdir):
+                build_tree(rootdir, size)
+            baseline_time, baseline = time_scan(os_walk_directory_structure, rootdir, [])
+            if args.workers:
+                new_time, result = time_scan(get_directory_structure, rootdir, [], args.workers)
+            else:
+                new_time, result = time_scan(get_directory_structure, rootdir, [])
+            assert result == baseline, "scanners disagree"
+            print(f"{size:>10} {baseline_time:>12.2f} {new_time:>12.2f} {baseline_time / new_time:>7.1f}x")
+    finally:
+        if args.root is None:
+            shutil.rmtree(base_dir, ignore_errors=True)
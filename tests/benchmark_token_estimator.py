@@ -0,0 +1,88 @@
+"""
+Calibrates the fast token estimator against exact tiktoken counts. Usage:
+    python tests/benchmark_token_estimator.py ~/code/project1 ~/code/project2
+Every file with content in the given folders is counted both ways. The script reports
+the distribution of exact/estimate ratios (the worst case at p0 and p100), the speed of
+both methods, and least squares weights per character class that can be copied into
+ai_utils/token_estimator.py.
+"""
+
+import sys
+import os
+import time
+import argparse
+
+# Add the root datadude/ folder to sys.path
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from directory_utils.directory_scanner import read_dudeignore, get_directory_structure
+from ai_utils.token_counter import count_tokens
+from ai_utils.token_estimator import get_text_stats, estimate_tokens, TOKENS_PER_BYTE
+
+PERCENTILES = [0, 1, 5, 50, 95, 99, 100]
+MIN_FILE_BYTES = 64 # ratios of tiny files are noise
+
+def percentile(sorted_values, p):
+    index = min(len(sorted_values) - 1, int(round(p / 100 * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+def solve_least_squares(rows, targets):
+    """
+    Solves the normal equations for weights minimizing sum((row . weights - target)^2).
+    Plain Gaussian elimination, there are only a handful of columns.
+    """
+    n = len(rows[0])
+    matrix = [[sum(row[i] * row[j] for row in rows) for j in range(n)] + [sum(row[i] * t for row, t in zip(rows, targets))] for i in range(n)]
+    for col in range(n):
+        pivot = max(range(col, n), key=lambda r: abs(matrix[r][col]))
+        matrix[col], matrix[pivot] = matrix[pivot], matrix[col]
+        if matrix[col][col] == 0:
+            continue
+        for r in range(n):
+            if r != col:
+                factor = matrix[r][col] / matrix[col][col]
+                matrix[r] = [a - factor * b for a, b in zip(matrix[r], matrix[col])]
+    return [matrix[i][n] / matrix[i][i] if matrix[i][i] else 0.0 for i in range(n)]
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Calibrate the token estimator on real source trees")
+    parser.add_argument('folders', nargs='+', help='Folders to scan')
+    args = parser.parse_args()
+
+    texts = []
+    for folder in args.folders:
+        for file_info in get_directory_structure(folder, read_dudeignore(folder)):
+            content = file_info.get("content")
+            if content and len(content.encode('utf-8', errors='surrogatepass')) >= MIN_FILE_BYTES:
+                texts.append(content)
+    if not texts:
+        print("No files with content found")
+        sys.exit(1)
+
+    start = time.perf_counter()
+    exact = [count_tokens(text) for text in texts]
+    exact_time = time.perf_counter() - start
+    start = time.perf_counter()
+    estimates = [estimate_tokens(text) for text in texts]
+    estimate_time = time.perf_counter() - start
+
+    ratios = sorted(e / max(est, 1e-9) for e, est in zip(exact, estimates))
+    total_mb = sum(len(text.encode('utf-8', errors='surrogatepass')) for text in texts) / 1e6
+
+    print(f"{len(texts)} files, {total_mb:.1f} MB, {sum(exact)} tokens")
+    print(f"exact:    {exact_time:.2f} s ({total_mb / exact_time:.1f} MB/s)")
+    print(f"estimate: {estimate_time:.2f} s ({total_mb / max(estimate_time, 1e-9):.1f} MB/s)")
+    print(f"total estimate {sum(estimates):.0f} vs exact {sum(exact)} ({sum(exact) / sum(estimates):.3f})")
+    print("exact/estimate ratio percentiles:")
+    for p in PERCENTILES:
+        print(f"  p{p:<3} {percentile(ratios, p):.3f}")
+
+    keys = list(TOKENS_PER_BYTE)
+    rows = []
+    for text in texts:
+        stats = get_text_stats(text)
+        rows.append([stats[key] for key in keys])
+    weights = solve_least_squares(rows, exact)
+    print("least squares TOKENS_PER_BYTE:")
+    for key, weight in zip(keys, weights):
+        print(f"  \"{key}\": {weight:.4f},")
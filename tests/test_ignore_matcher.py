@@ -0,0 +1,138 @@
+"""
+Conformance tests for the .dudeignore/.gitignore matcher.
+Each case builds a small tree with ignore files, then checks the scanner keeps exactly
+the files that git itself reports as not ignored (git ls-files --others --exclude-standard).
+The expected lists were recorded from git; if git is installed, it is asked as well.
+"""
+
+import sys
+import os
+import shutil
+import subprocess
+import tempfile
+
+# Add the root datadude/ folder to sys.path
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from directory_utils.directory_scanner import read_dudeignore
+from directory_utils.tree_walker import walk_files
+
+FILES = [
+    "README.md",
+    "main.py",
+    "debug.log",
+    "important.log",
+    "build/output.js",
+    "build/keep/notes.md",
+    "docs/guide.md",
+    "docs/build/page.md",
+    "docs/api/index.md",
+    "node_modules/pkg/index.js",
+    "src/app.js",
+    "src/app.min.js",
+    "src/lib/util.js",
+    "src/lib/util.min.js",
+    "src/lib/deep/x.py",
+    "src/tmp/cache.txt",
+    "logs/today/a.log",
+    "a/b/c/d.txt",
+    "file[1].txt",
+    "space .txt",
+]
+
+CASES = {
+    "literal names": (
+        {".gitignore": "node_modules\ndebug.log\n"},
+        [f for f in FILES if not f.startswith("node_modules/") and f != "debug.log"],
+    ),
+    "literal name as a file rule and a folder rule": (
+        {".gitignore": "debug.log\n!deep/\ndebug.log/\nnode_modules\n!node_modules/\n"},
+        [f for f in FILES if f != "debug.log"],
+    ),
+    "globs and negation": (
+        {".gitignore": "*.log\n!important.log\n*.min.js\n"},
+        [f for f in FILES if not (f.endswith(".log") and f != "important.log") and not f.endswith(".min.js")],
+    ),
+    "anchored and directory only": (
+        {".gitignore": "/build/\nsrc/tmp\n"},
+        [f for f in FILES if not f.startswith("build/") and not f.startswith("src/tmp/")],
+    ),
+    "unanchored directory matches at any depth": (
+        {".gitignore": "build/\n"},
+        [f for f in FILES if not f.startswith("build/") and not f.startswith("docs/build/")],
+    ),
+    "double asterisk": (
+        {".gitignore": "**/lib/**/*.py\nlogs/**\na/**/d.txt\ndocs/**/index.md\n"},
+        [f for f in FILES if f not in ("src/lib/deep/x.py", "logs/today/a.log", "a/b/c/d.txt", "docs/api/index.md")],
+    ),
+    "cannot re-include inside an ignored folder": (
+        {".gitignore": "build/\n!build/keep/notes.md\n"},
+        [f for f in FILES if not f.startswith("build/") and not f.startswith("docs/build/")],
+    ),
+    "re-include with folder contents pattern": (
+        {".gitignore": "build/*\n!build/keep/\n"},
+        [f for f in FILES if f != "build/output.js"],
+    ),
+    "nested gitignore": (
+        {".gitignore": "*.js\n", "src/.gitignore": "!*.js\n*.min.js\n", "src/lib/.gitignore": "!util.min.js\n"},
+        [f for f in FILES if not (f.endswith(".js") and not f.startswith("src/")) and f != "src/app.min.js"]
+        + ["src/.gitignore", "src/lib/.gitignore"],
+    ),
+    "nested anchored pattern is relative to its folder": (
+        {"src/.gitignore": "/lib/deep\ntmp/\n"},
+        [f for f in FILES if f not in ("src/lib/deep/x.py", "src/tmp/cache.txt")] + ["src/.gitignore"],
+    ),
+    "comments, escapes and classes": (
+        {".gitignore": "# comment\n\\#not-a-comment\nfile\\[1\\].txt\nspace\\ .txt\nsrc/app.[jt]s\n*.[!pm][!yd]\n"},
+        [f for f in FILES if f not in ("file[1].txt", "space .txt") and not f.endswith(".js")],
+    ),
+    "question mark": (
+        {".gitignore": "main.p?\nsrc/lib/util.?s\n"},
+        [f for f in FILES if f not in ("main.py", "src/lib/util.js")],
+    ),
+}
+
+def build_case(root, ignore_files):
+    for path in FILES:
+        full_path = os.path.join(root, path)
+        os.makedirs(os.path.dirname(full_path), exist_ok=True)
+        with open(full_path, 'w') as file:
+            file.write("x\n")
+    for path, text in ignore_files.items():
+        with open(os.path.join(root, path), 'w') as file:
+            file.write(text)
+
+def scanned_files(root):
+    omit_paths = read_dudeignore(root)
+    return sorted(os.path.relpath(path, root).replace(os.sep, '/') for path, _, _ in walk_files(root, omit_paths))
+
+def git_files(root):
+    """
+    Returns what git keeps in the same tree, or None if git isn't available.
+    """
+    if shutil.which("git") is None:
+        return None
+    subprocess.run(["git", "init", "-q"], cwd=root, check=True)
+    result = subprocess.run(["git", "ls-files", "--others", "--exclude-standard"], cwd=root, capture_output=True, text=True, check=True)
+    shutil.rmtree(os.path.join(root, ".git"))
+    return sorted(result.stdout.splitlines())
+
+def check_case(name):
+    ignore_files, expected = CASES[name]
+    expected = sorted(set(expected) | ({".gitignore"} if ".gitignore" in ignore_files else set()))
+    with tempfile.TemporaryDirectory() as root:
+        build_case(root, ignore_files)
+        git_result = git_files(root)
+        if git_result is not None:
+            assert git_result == expected, f"{name}: expected list disagrees with git: {git_result}"
+        result = scanned_files(root)
+        assert result == expected, f"{name}: scanner kept {result}, git keeps {expected}"
+
+def test_ignore_matcher_conformance():
+    for name in CASES:
+        check_case(name)
+
+if __name__ == "__main__":
+    for name in CASES:
+        check_case(name)
+        print(f"OK\t{name}")
@@ -0,0 +1,43 @@
+import sys
+import os
+import tempfile
+
+# Add the root datadude/ folder to sys.path
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from directory_utils.directory_scanner import get_directory_structure_incremental
+
+def write_file(path, text):
+    with open(path, 'w') as file:
+        file.write(text)
+
+def test_incremental_scan():
+    """
+    Scans a temp folder twice and checks the reported changes.
+    """
+    with tempfile.TemporaryDirectory() as root:
+        manifest_path = os.path.join(root, "manifest", "scan.json")
+        os.makedirs(os.path.join(root, "sub"))
+        write_file(os.path.join(root, "a.py"), "print(1)\n")
+        write_file(os.path.join(root, "sub", "b.txt"), "b\n")
+
+        files, changes = get_directory_structure_incremental(root, ["manifest"], manifest_path)
+        assert len(files) == 2
+        assert len(changes["added"]) == 2
+
+        write_file(os.path.join(root, "a.py"), "print(22)\n")
+        os.remove(os.path.join(root, "sub", "b.txt"))
+        write_file(os.path.join(root, "c.md"), "# c\n")
+
+        files, changes = get_directory_structure_incremental(root, ["manifest"], manifest_path)
+        assert changes["added"] == [os.path.join(root, "c.md")]
+        assert changes["modified"] == [os.path.join(root, "a.py")]
+        assert changes["deleted"] == [os.path.join(root, "sub", "b.txt")]
+        assert next(f for f in files if f["name"] == "a.py")["content"] == "print(22)\n"
+
+        files, changes = get_directory_structure_incremental(root, ["manifest"], manifest_path)
+        assert changes == {"added": [], "modified": [], "deleted": []}
+
+if __name__ == "__main__":
+    test_incremental_scan()
+    print("incremental scan OK")
@@ -0,0 +1,43 @@
+import sys
+import os
+
+# Add the root datadude/ folder to sys.path
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from ai_utils.metadata_query import MetadataIndex
+from ai_utils.chat_completions_handler import create_context_text
+
+def make_file(path, size, last_modified="2024-06-01T18:18:00"):
+    return {"name": os.path.basename(path), "path": path, "size": size, "lastModified": last_modified}
+
+def test_summary():
+    files = [make_file("/project/server.py", 2048), make_file("/project/README.md", 100, "2024-01-01T00:00:00")]
+    summary = MetadataIndex(files).get_summary()
+    assert summary.startswith("2 files, 2.1 KB in total.")
+    assert "Most recently updated: /project/server.py (6/1/2024 at 6:18 PM); /project/README.md" in summary
+
+def test_empty_folder():
+    """
+    An empty folder gets a summary too, and no answers.
+    """
+    index = MetadataIndex([])
+    assert index.get_summary() == "The folder has no files."
+    assert index.answer("What is the biggest file?") is None
+    assert "no files" in create_context_text({"files": []})
+
+def test_folder_size():
+    """
+    Folders are looked up by their path in the project, with or without a leading ./, dots in names kept.
+    """
+    files = [make_file("/project/server.py", 100), make_file("/project/.github/workflows/ci.yml", 30), make_file("/project/github/notes.md", 5)]
+    index = MetadataIndex(files)
+    assert index.answer("How big is .github?").startswith("30 bytes in 1 files")
+    assert index.answer("How big is ./.github/workflows?").startswith("30 bytes in 1 files")
+    assert index.answer("How big is github/").startswith("5 bytes in 1 files")
+    assert index.answer("How big is this folder?").startswith("135 bytes in 3 files")
+
+if __name__ == "__main__":
+    test_summary()
+    test_empty_folder()
+    test_folder_size()
+    print("metadata query OK")
@@ -0,0 +1,78 @@
+import sys
+import os
+import tempfile
+
+# Add the root datadude/ folder to sys.path
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import server
+from ai_utils.ai_base import AIHandler
+from network_utils.session_sync import build_manifest, manifest_hash
+
+class FakeHandler(AIHandler):
+    """
+    Stands in for the OpenAI handlers, so sessions can be set up without the API.
+    """
+    def __init__(self, sessionID=None, context=None):
+        self.files = None
+
+    def setup(self, sessionContext):
+        self.files = sessionContext["files"]
+
+    def get_response(self, input):
+        return "answer"
+
+def make_file(root, name, content):
+    return {"name": name, "path": os.path.join(root, name), "size": len(content),
+            "lastModified": "2024-01-01T00:00:00", "content": content}
+
+def start_session(client, root, files):
+    """
+    Does what client.py does: sends the manifest hash, and on a 409 syncs and sends the missing files.
+    Returns the last /session response and the paths the server asked for.
+    """
+    manifest = build_manifest(files)
+    body = {"path": root, "ai_type": "chat_completions", "manifestHash": manifest_hash(manifest)}
+    response = client.post('/session', json=body)
+    if response.status_code != 409:
+        return response, None
+    sync = client.post('/session/sync', json={"path": root, "manifest": manifest})
+    assert sync.status_code == 200
+    missing = set(sync.json["missing"])
+    body = dict(body, delta=True, files=[file for file in files if file["path"] in missing], deleted=sync.json["deleted"])
+    return client.post('/session', json=body), missing
+
+def test_session_sync():
+    """
+    Runs the 409 -> sync -> delta round trip for a new session, then for a changed one.
+    """
+    get_ai_handler = server.get_ai_handler
+    server.get_ai_handler = lambda ai_type, sessionID, context: FakeHandler(sessionID, context)
+    client = server.app.test_client()
+    try:
+        with tempfile.TemporaryDirectory() as root:
+            files = [make_file(root, "a.py", "print(1)\n"), make_file(root, "b.txt", "b\n")]
+
+            # the server has never seen the folder, so it asks for everything
+            response, missing = start_session(client, root, files)
+            assert response.status_code == 200, response.json
+            assert missing == {file["path"] for file in files}
+            sessionID = response.json["sessionID"]
+            assert server.messagePool.get_session(sessionID)["files"] == files
+
+            # nothing changed, the manifest hash is enough
+            response, missing = start_session(client, root, files)
+            assert response.status_code == 200 and missing is None
+
+            # only the changed file is sent, and the deleted one is dropped
+            files = [make_file(root, "a.py", "print(22)\n")]
+            response, missing = start_session(client, root, files)
+            assert response.status_code == 200, response.json
+            assert missing == {files[0]["path"]}
+            assert server.messagePool.get_session(sessionID)["files"] == files
+    finally:
+        server.get_ai_handler = get_ai_handler
+
+if __name__ == "__main__":
+    test_session_sync()
+    print("session sync OK")
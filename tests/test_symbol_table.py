@@ -0,0 +1,97 @@
+import sys
+import os
+import tempfile
+
+# Add the root datadude/ folder to sys.path
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from directory_utils.symbol_table import extract_symbols
+from directory_utils.directory_scanner import get_directory_structure_incremental
+from ai_utils.symbol_query import SymbolIndex
+
+PYTHON_SOURCE = '''import os
+from json import dumps
+
+LIMIT = 10
+
+class Loader:
+    def load(self, path):
+        return open(path).read()
+
+def save(data):
+    return dumps(data)
+'''
+
+JS_SOURCE = '''import React from 'react';
+const api = require("./api");
+// function commented() {}
+export default function App({ a, b = {} }) {
+  const label = "}{";
+  const onClick = (e) => {
+    api.send(e);
+  };
+  return <div onClick={onClick}>{label}</div>;
+}
+class Store {
+  load(id) {
+    if (id) { return api.get(id); }
+  }
+}
+'''
+
+SHELL_SOURCE = '''source ./env.sh
+function setup {
+  echo "{"
+}
+build() { make; }
+'''
+
+def definitions(name, content):
+    return [tuple(definition) for definition in extract_symbols({"name": name, "content": content})["definitions"]]
+
+def test_extract_symbols():
+    assert definitions("a.py", PYTHON_SOURCE) == [
+        ("LIMIT", "variable", 4, 4), ("Loader", "class", 6, 8), ("load", "method", 7, 8), ("save", "function", 10, 11)]
+    assert extract_symbols({"name": "a.py", "content": PYTHON_SOURCE})["imports"] == [["os", "", 1], ["json", "dumps", 2]]
+    assert definitions("a.jsx", JS_SOURCE) == [
+        ("App", "function", 4, 10), ("onClick", "function", 6, 8), ("Store", "class", 11, 15), ("load", "method", 12, 14)]
+    assert extract_symbols({"name": "a.js", "content": JS_SOURCE})["imports"] == [["react", "", 1], ["./api", "", 2]]
+    assert definitions("a.sh", SHELL_SOURCE) == [("setup", "function", 2, 4), ("build", "function", 5, 5)]
+    # not parseable, cut short, or not source code
+    assert extract_symbols({"name": "a.py", "content": "def broken(:\n"}) is None
+    assert extract_symbols({"name": "a.py", "content": PYTHON_SOURCE, "contentStatus": "truncated"}) is None
+    assert extract_symbols({"name": "a.md", "content": "# def f():"}) is None
+
+def test_symbol_index():
+    files = [{"name": "a.py", "path": "/p/a.py", "content": PYTHON_SOURCE},
+             {"name": "b.py", "path": "/p/b.py", "content": "from a import save\n\nsave({})\n"}]
+    index = SymbolIndex(files)
+    assert index.answer("Where is save defined?").startswith("save is a function defined in /p/a.py at line 10.")
+    assert index.answer("what calls save") == "save is used on 2 lines in 1 files:\n/p/b.py:1: from a import save\n/p/b.py:3: save({})"
+    assert index.answer("which files import json") == "json is imported in 1 places:\n/p/a.py:2"
+    assert index.answer("where is the bug") is None
+    assert "def load(self, path):" in index.get_excerpts("why does Loader.load fail?")
+    assert index.get_excerpts("what does this folder do?") is None
+
+def test_incremental_symbols():
+    """
+    Symbols are kept in the manifest, and added to files that were scanned without them.
+    """
+    with tempfile.TemporaryDirectory() as root:
+        manifest_path = os.path.join(root, "manifest", "scan.json")
+        with open(os.path.join(root, "a.py"), 'w') as file:
+            file.write(PYTHON_SOURCE)
+        files, _ = get_directory_structure_incremental(root, ["manifest"], manifest_path)
+        assert "symbols" not in files[0]
+        files, _ = get_directory_structure_incremental(root, ["manifest"], manifest_path, symbols=True)
+        assert files[0]["symbols"]["definitions"][0] == ["LIMIT", "variable", 4, 4]
+        files, changes = get_directory_structure_incremental(root, ["manifest"], manifest_path, symbols=True)
+        assert "symbols" in files[0] and changes["modified"] == []
+        files, _ = get_directory_structure_incremental(root, ["manifest"], manifest_path)
+        assert "symbols" not in files[0]
+
+if __name__ == "__main__":
+    test_extract_symbols()
+    test_symbol_index()
+    test_incremental_symbols()
+    print("symbol table OK")